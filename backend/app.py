@@ -1,107 +1,173 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo import MongoClient
+from flask_jwt_extended import JWTManager
+import click
 import os
 from datetime import datetime, timedelta
-import gridfs
-from bson import ObjectId
-import pandas as pd
-import io
-import base64
-import numpy as np
-import face_recognition
-import cv2
-from PIL import Image
-import json
-from functools import wraps
 from dotenv import load_dotenv
 
+# Heavy vision and export libraries (face_recognition, cv2, PIL, openpyxl) are
+# imported lazily where they are used, keeping worker startup fast.
+
 # Import our models and routes
-from models import UserModel, CompanyModel, AttendanceModel, FaceRecognitionModel
+from archive import AttendanceArchive, archive_closed_months, archive_root
+from database import PoolStats, create_indexes, create_mongo_client, get_database, report_read_preference
+import metrics
+from models import UserModel, CompanyModel, AttendanceModel, FaceRecognitionModel, FaceIdentificationIndex
+from authorization import is_token_in_scope, is_token_revoked
+from face_worker import FaceWorkerPool
+from image_store import ImageWriteBehind, create_image_store
+from live_feed import AttendanceFeed
 from routes.auth import create_auth_routes
 from routes.attendance import create_attendance_routes
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-
-# Configuration
-app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')  # Change this in production
-app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
-app.config['UPLOAD_FOLDER'] = 'uploads'
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-
-# Initialize extensions
-jwt = JWTManager(app)
-CORS(app, origins=['http://localhost:3000'])  # Allow React frontend
-
-# MongoDB Connection
-MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/attendance_app')
-client = MongoClient(MONGODB_URI)
-db = client.attendance_app
-fs = gridfs.GridFS(db)
-
-# Create uploads directory if it doesn't exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-
-# Initialize models
-user_model = UserModel(db)
-company_model = CompanyModel(db)
-attendance_model = AttendanceModel(db)
-face_model = FaceRecognitionModel()
-
-# Register blueprints
-auth_bp = create_auth_routes(app, db, user_model, company_model, face_model)
-attendance_bp = create_attendance_routes(app, db, user_model, attendance_model, face_model)
-
-app.register_blueprint(auth_bp)
-app.register_blueprint(attendance_bp)
-
-def role_required(allowed_roles):
-    """Decorator to check if user has required role"""
-    def decorator(f):
-        @wraps(f)
-        @jwt_required()
-        def decorated_function(*args, **kwargs):
-            current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
-            if not user or user['role'] not in allowed_roles:
-                return jsonify({'error': 'Insufficient permissions'}), 403
-            return f(*args, **kwargs)
-        return decorated_function
-    return decorator
-
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Health check endpoint"""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()})
-
-# Database indexes for performance
-def create_indexes():
-    """Create database indexes for better performance"""
-    try:
-        # User indexes
-        db.users.create_index('username', unique=True)
-        db.users.create_index('role')
-        db.users.create_index('company_id')
-        
-        # Attendance indexes
-        db.attendance_records.create_index([('student_id', 1), ('timestamp', -1)])
-        db.attendance_records.create_index('company_id')
-        db.attendance_records.create_index('timestamp')
-        db.attendance_records.create_index('status')
-        
-        # Company indexes
-        db.companies.create_index('name')
-        
-        print("Database indexes created successfully")
-    except Exception as e:
-        print(f"Error creating indexes: {e}")
+def create_app(config=None):
+    """Build the Flask app with its database connection, models and routes
+    
+    Each serving process calls this once (after forking), so nothing here is
+    shared between processes. Services are exposed in app.extensions['attendance'].
+    """
+    app = Flask(__name__)
+    
+    # Configuration
+    app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'your-secret-key-change-in-production')  # Change this in production
+    app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+    app.config['UPLOAD_FOLDER'] = 'uploads'
+    app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    app.config['MONGODB_URI'] = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/attendance_app')
+    if config:
+        app.config.update(config)
+    
+    # Initialize extensions
+    jwt = JWTManager(app)
+    CORS(app, origins=['http://localhost:3000'])  # Allow React frontend
+    
+    # MongoDB Connection (pool, timeouts and compression from MONGO_* settings)
+    pool_stats = PoolStats()
+    client = create_mongo_client(
+        app.config['MONGODB_URI'],
+        pool_stats=pool_stats,
+        event_listeners=[metrics.MongoCommandMetrics()]
+    )
+    db = get_database(client)
+    
+    # Create uploads directory if it doesn't exist
+    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+    
+    # Selfie storage (local disk, GridFS or S3, chosen by IMAGE_STORE)
+    image_store = create_image_store(db, app.config['UPLOAD_FOLDER'])
+    
+    # Initialize models
+    user_model = UserModel(db)
+    company_model = CompanyModel(db)
+    # Parquet archive of closed months (ATTENDANCE_ARCHIVE_DIR, shared by every node)
+    archive = AttendanceArchive(archive_root(), db.attendance_archive)
+    attendance_model = AttendanceModel(db, report_read_preference=report_read_preference(), archive=archive)
+    face_model = FaceRecognitionModel()
+    face_index = FaceIdentificationIndex()
+    face_pool = FaceWorkerPool()
+    image_writer = ImageWriteBehind(image_store, attendance_model, os.path.join(app.config['UPLOAD_FOLDER'], 'spool'))
+    
+    # Live dashboard feed (change stream, or this process's inserts without a replica set)
+    live_feed = AttendanceFeed(db.attendance_records, user_model)
+    attendance_model.insert_listeners.append(live_feed.publish_local)
+    
+    # Register blueprints
+    auth_bp = create_auth_routes(app, db, user_model, company_model, face_model, face_pool, face_index)
+    attendance_bp = create_attendance_routes(app, db, user_model, company_model, attendance_model, face_model, face_pool, face_index, image_store, image_writer, live_feed)
+    
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(attendance_bp)
+    
+    @jwt.token_in_blocklist_loader
+    def check_token_revoked(jwt_header, jwt_payload):
+        """Reject tokens of deactivated users or with an outdated token version"""
+        return is_token_revoked(user_model, jwt_payload)
+    
+    @jwt.token_verification_loader
+    def check_token_scope(jwt_header, jwt_payload):
+        """Reject scoped tokens (e.g. live feed tokens) outside their endpoints"""
+        return is_token_in_scope(jwt_payload, request.endpoint)
+    
+    @jwt.token_verification_failed_loader
+    def token_out_of_scope(jwt_header, jwt_payload):
+        return jsonify({'error': 'Token is not valid for this endpoint'}), 403
+    
+    @app.route('/api/health', methods=['GET'])
+    def health_check():
+        """Health check endpoint"""
+        return jsonify({
+            'status': 'healthy',
+            'timestamp': datetime.utcnow().isoformat(),
+            'face_workers': face_pool.get_stats(),
+            'image_writer': image_writer.get_stats(),
+            'live_feed': live_feed.get_stats(),
+            'mongo_pool': pool_stats.get_stats(),
+            'caches': {
+                'users': user_model.cache.get_stats(),
+                'companies': company_model.cache.get_stats()
+            }
+        })
+    
+    # Request latency, Mongo commands per request, stage timers and the X-Profile header
+    metrics.init_app(app)
+    metrics.REGISTRY.add_gauges('mongo_pool', pool_stats.get_stats)
+    metrics.REGISTRY.add_gauges('face_workers', face_pool.get_stats)
+    metrics.REGISTRY.add_gauges('image_writer', image_writer.get_stats)
+    metrics.REGISTRY.add_gauges('live_feed', live_feed.get_stats)
+    metrics.REGISTRY.add_gauges('user_cache', user_model.cache.get_stats)
+    metrics.REGISTRY.add_gauges('company_cache', company_model.cache.get_stats)
+    
+    @app.route('/metrics', methods=['GET'])
+    def prometheus_metrics():
+        """Metrics in the Prometheus text format (bearer METRICS_TOKEN required when set)"""
+        token = os.getenv('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return jsonify({'error': 'Unauthorized'}), 401
+        return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+    
+    @app.cli.command('create-indexes')
+    def create_indexes_command():
+        """Create database indexes (run once per deploy)"""
+        create_indexes(db)
+    
+    @app.cli.command('archive-attendance')
+    @click.option('--keep-months', default=3, show_default=True, help='Full months to keep in MongoDB')
+    @click.option('--dry-run', is_flag=True, help='Report what would move without moving it')
+    def archive_attendance_command(keep_months, dry_run):
+        """Move closed months of attendance records to the Parquet archive"""
+        if not archive.root and not dry_run:
+            raise click.ClickException("Set ATTENDANCE_ARCHIVE_DIR to storage every api node can read")
+        results = archive_closed_months(db.attendance_records, archive, keep_months=keep_months, dry_run=dry_run)
+        for company_id, month, moved in results:
+            print(f"{month} company {company_id}: {moved} records{' (dry run)' if dry_run else ''}")
+        print(f"Archived {sum(moved for _, _, moved in results)} records in {len(results)} partitions")
+    
+    app.extensions['attendance'] = {
+        'client': client,
+        'pool_stats': pool_stats,
+        'db': db,
+        'image_store': image_store,
+        'user_model': user_model,
+        'company_model': company_model,
+        'attendance_model': attendance_model,
+        'archive': archive,
+        'face_model': face_model,
+        'face_index': face_index,
+        'face_pool': face_pool,
+        'image_writer': image_writer,
+        'live_feed': live_feed
+    }
+    
+    return app
 
 if __name__ == '__main__':
+    # Development server only; production runs wsgi:app under gunicorn (see gunicorn.conf.py)
+    app = create_app()
+    
     # Create database indexes on startup
-    create_indexes()
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_indexes(app.extensions['attendance']['db'])
+    app.run(debug=os.getenv('FLASK_DEBUG', 'true').lower() == 'true', host='0.0.0.0', port=5000)
@@ -0,0 +1,409 @@
+import heapq
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+from bson import ObjectId
+
+NO_COMPANY = 'none'
+DATA_FILE = 'data.parquet'
+DELETE_BATCH_SIZE = 10000
+# Filters the archive can evaluate; anything else (e.g. region) is answered from MongoDB only
+ARCHIVE_FILTERS = {'student_id', 'student_ids', 'company_id', 'date_from', 'date_to', 'status'}
+# How long a process trusts its copy of the partition manifest
+MANIFEST_TTL = float(os.getenv('ARCHIVE_MANIFEST_TTL', 30))
+MAX_CACHED_COUNTS = 10000
+# Rows per Parquet row group, and rows converted to dicts at a time when reading
+ROW_GROUP_SIZE = 50000
+READ_BATCH_SIZE = 1000
+MONTH_PATTERN = re.compile(r'\d{4}-\d{2}')
+
+def archive_root():
+    """Archive directory from ATTENDANCE_ARCHIVE_DIR, or None when archiving is not set up
+    
+    There is deliberately no default: every api node must read the same directory
+    (shared storage), or nodes would answer listings differently.
+    """
+    return os.getenv('ATTENDANCE_ARCHIVE_DIR') or None
+
+def load_pyarrow():
+    """pyarrow modules, imported on first use so only processes that touch the archive pay for them"""
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("The attendance archive requires pyarrow (pip install pyarrow)")
+    return pyarrow, pyarrow.dataset, pyarrow.parquet
+
+def month_bounds(month):
+    """[start, end) of a YYYY-MM month as naive UTC datetimes"""
+    start = datetime.strptime(month, '%Y-%m')
+    return start, (start + timedelta(days=32)).replace(day=1)
+
+def record_key(record):
+    return record['timestamp'], record['_id']
+
+def merge_newest_first(*sources):
+    """Merge record iterables that are each sorted newest first into one such iterable"""
+    return heapq.merge(*sources, key=record_key, reverse=True)
+
+class AttendanceArchive:
+    """Closed months of attendance records, as Parquet files partitioned by company and month
+    
+    Layout: <root>/company_id=<id or none>/month=<YYYY-MM>/data.parquet, with months by
+    UTC timestamp like the records' date filters. Only closed months are archived, so
+    everything in the archive is older than what is still in MongoDB.
+    
+    The partition list and row counts live in a MongoDB manifest collection shared
+    by every node; each process caches it for MANIFEST_TTL seconds, and memoizes
+    filtered counts until the manifest changes.
+    """
+    
+    def __init__(self, root, manifest):
+        self.root = root
+        self.manifest = manifest
+        self.lock = threading.Lock()
+        self.cached_partitions = None
+        self.cached_at = 0
+        self.counts = {}  # (manifest version, filters) -> {month: rows}
+    
+    def _partition_dir(self, company_key, month):
+        return os.path.join(self.root, f'company_id={company_key}', f'month={month}')
+    
+    def _load_manifest(self):
+        with self.lock:
+            if self.cached_partitions is not None and time.monotonic() - self.cached_at < MANIFEST_TTL:
+                return self.cached_partitions
+            
+            entries = sorted(self.manifest.find({}, {'company_key': 1, 'month': 1, 'rows': 1, 'updated_at': 1}),
+                             key=lambda entry: entry['_id'])
+            version = tuple((entry['_id'], entry['updated_at']) for entry in entries)
+            partitions = [
+                (entry['company_key'], entry['month'], self._path(entry['company_key'], entry['month']), entry['rows'])
+                for entry in entries
+            ]
+            if self.cached_partitions is None or version != self.cached_partitions[0]:
+                self.counts = {}
+            self.cached_partitions = (version, partitions)
+            self.cached_at = time.monotonic()
+            return self.cached_partitions
+    
+    def _path(self, company_key, month):
+        """A listed partition's file, failing loudly when this node cannot see it"""
+        if not self.root:
+            raise RuntimeError(
+                "Attendance records have been archived, but ATTENDANCE_ARCHIVE_DIR is not set on this node"
+            )
+        path = os.path.join(self._partition_dir(company_key, month), DATA_FILE)
+        if not os.path.exists(path):
+            raise RuntimeError(
+                f"Archived partition {company_key}/{month} is missing under ATTENDANCE_ARCHIVE_DIR "
+                f"({self.root}); it must be storage shared by every node"
+            )
+        return path
+    
+    def partitions(self):
+        """(company key, month, path, rows) of every archived partition"""
+        return self._load_manifest()[1]
+    
+    def has_data(self):
+        return bool(self._load_manifest()[1])
+    
+    @staticmethod
+    def supports(filters):
+        return set(key for key, value in (filters or {}).items() if value) <= ARCHIVE_FILTERS
+    
+    def _months(self, filters):
+        """{month: [(company key, path, rows)]} of the partitions a query can touch, newest month first"""
+        filters = filters or {}
+        company_key = str(filters['company_id']) if filters.get('company_id') else None
+        first_month = filters['date_from'][:7] if filters.get('date_from') and filters.get('date_to') else None
+        last_month = filters['date_to'][:7] if first_month else None
+        
+        months = {}
+        for key, month, path, rows in self.partitions():
+            if company_key and key != company_key:
+                continue
+            if first_month and not first_month <= month <= last_month:
+                continue
+            months.setdefault(month, []).append((key, path, rows))
+        return dict(sorted(months.items(), reverse=True))
+    
+    @staticmethod
+    def _expression(filters, before=None):
+        """pyarrow filter for the row-level filters (company and month are chosen by path)"""
+        pa, ds, _ = load_pyarrow()
+        filters = filters or {}
+        expression = None
+        
+        def add(condition):
+            nonlocal expression
+            expression = condition if expression is None else expression & condition
+        
+        if filters.get('student_id'):
+            add(ds.field('student_id') == str(filters['student_id']))
+        elif filters.get('student_ids'):
+            add(ds.field('student_id').isin([str(student_id) for student_id in filters['student_ids']]))
+        if filters.get('date_from') and filters.get('date_to'):
+            add(ds.field('timestamp') >= pa.scalar(datetime.fromisoformat(filters['date_from']), pa.timestamp('ms')))
+            add(ds.field('timestamp') <= pa.scalar(datetime.fromisoformat(filters['date_to']), pa.timestamp('ms')))
+        if filters.get('status'):
+            add(ds.field('status') == filters['status'])
+        if before:
+            # Keyset position: strictly older in (timestamp, _id) order; hex ids sort like ObjectIds
+            timestamp = pa.scalar(before[0], pa.timestamp('ms'))
+            add((ds.field('timestamp') < timestamp) |
+                ((ds.field('timestamp') == timestamp) & (ds.field('_id') < str(before[1]))))
+        return expression
+    
+    @staticmethod
+    def _needs_rows(filters):
+        """Whether counting needs the files, rather than the manifest's partition row counts"""
+        filters = filters or {}
+        if filters.get('student_id') or filters.get('student_ids') or filters.get('status'):
+            return True
+        if filters.get('date_from') and filters.get('date_to'):
+            # Whole months are chosen by partition; anything narrower filters rows
+            start, _ = month_bounds(filters['date_from'][:7])
+            _, end = month_bounds(filters['date_to'][:7])
+            return (datetime.fromisoformat(filters['date_from']) > start or
+                    datetime.fromisoformat(filters['date_to']) < end - timedelta(seconds=1))
+        return False
+    
+    def month_counts(self, filters=None):
+        """{month: archived records matching filters}, from the manifest or memoized file counts"""
+        version, _ = self._load_manifest()
+        cache_key = (version, json.dumps(filters or {}, sort_keys=True, default=str))
+        counts = self.counts.get(cache_key)
+        if counts is not None:
+            return counts
+        
+        months = self._months(filters)
+        if self._needs_rows(filters):
+            _, ds, _ = load_pyarrow()
+            expression = self._expression(filters)
+            counts = {
+                month: sum(ds.dataset(path, format='parquet').count_rows(filter=expression) for _, path, _ in paths)
+                for month, paths in months.items()
+            }
+        else:
+            counts = {month: sum(rows for _, _, rows in paths) for month, paths in months.items()}
+        
+        if len(self.counts) >= MAX_CACHED_COUNTS:
+            self.counts = {}
+        self.counts[cache_key] = counts
+        return counts
+    
+    def count(self, filters=None):
+        """Number of archived records matching filters"""
+        return sum(self.month_counts(filters).values())
+    
+    def _iter_partition(self, company_key, path, expression):
+        """One partition's matching records, newest first, READ_BATCH_SIZE rows converted at a time
+        
+        Files are sorted oldest first, so row groups are read in reverse; row group
+        statistics skip groups the filter rules out.
+        """
+        _, ds, _ = load_pyarrow()
+        dataset = ds.dataset(path, format='parquet')
+        for fragment in dataset.get_fragments():
+            for row_group in reversed(fragment.split_by_row_group(filter=expression, schema=dataset.schema)):
+                table = row_group.to_table(filter=expression, schema=dataset.schema)
+                for end in range(table.num_rows, 0, -READ_BATCH_SIZE):
+                    start = max(0, end - READ_BATCH_SIZE)
+                    for row in reversed(table.slice(start, end - start).to_pylist()):
+                        yield self._to_record(row, company_key)
+    
+    def _iter_month(self, paths, expression):
+        """A month's matching records across its company partitions, merged newest first"""
+        return merge_newest_first(*(
+            self._iter_partition(company_key, path, expression) for company_key, path, _ in paths
+        ))
+    
+    def iter_records(self, filters=None, before=None, skip=0, limit=None):
+        """Matching records as MongoDB-shaped dicts, newest first
+        
+        Memory stays flat: each company partition is read a row group at a time and
+        converted in batches of READ_BATCH_SIZE. before is a (timestamp, _id) keyset
+        position; skip and limit page through the result.
+        """
+        expression = self._expression(filters, before)
+        month_counts = self.month_counts(filters) if skip and not before else None
+        remaining = limit
+        
+        for month, paths in self._months(filters).items():
+            if remaining is not None and remaining <= 0:
+                return
+            if month_counts is not None:
+                # Skip whole months by their (memoized) row counts before reading any
+                if month_counts.get(month, 0) <= skip:
+                    skip -= month_counts.get(month, 0)
+                    continue
+            
+            stop = skip + remaining if remaining is not None else None
+            for record in islice(self._iter_month(paths, expression), skip, stop):
+                if remaining is not None:
+                    remaining -= 1
+                yield record
+            skip = 0
+    
+    def get_record(self, attendance_id, month, company_id=None):
+        """One archived record by id, looked up in the partitions of its month (and company)"""
+        _, ds, _ = load_pyarrow()
+        if not ObjectId.is_valid(attendance_id) or not MONTH_PATTERN.fullmatch(month or ''):
+            return None
+        
+        filters = {'company_id': company_id} if company_id else {}
+        paths = self._months(filters).get(month, [])
+        return next(self._iter_month(paths, ds.field('_id') == str(ObjectId(attendance_id))), None)
+    
+    @staticmethod
+    def _to_record(row, company_key):
+        record = {
+            '_id': ObjectId(row['_id']),
+            'student_id': ObjectId(row['student_id']),
+            'company_id': None if company_key == NO_COMPANY else ObjectId(company_key),
+            'timestamp': row['timestamp'],
+            'attendance_date': row['attendance_date'],
+            'location': {'latitude': row['latitude'], 'longitude': row['longitude']},
+            'status': row['status'],
+            'image': json.loads(row['image']) if row['image'] else None,
+            'created_at': row['created_at'],
+            'updated_at': row['updated_at'],
+            'archived': True
+        }
+        if row['image_path']:
+            record['image_path'] = row['image_path']
+        if row['geofence_inside'] is not None:
+            record['geofence'] = {'inside': row['geofence_inside'], 'fence_id': row['geofence_id']}
+        return record
+    
+    @staticmethod
+    def _to_table(records):
+        pa, _, _ = load_pyarrow()
+        columns = {
+            '_id': ([str(record['_id']) for record in records], pa.string()),
+            'student_id': ([str(record['student_id']) for record in records], pa.string()),
+            'timestamp': ([record['timestamp'] for record in records], pa.timestamp('ms')),
+            'attendance_date': (
+                [record.get('attendance_date') or record['timestamp'].strftime('%Y-%m-%d') for record in records],
+                pa.string()
+            ),
+            'status': ([record['status'] for record in records], pa.string()),
+            'latitude': ([(record.get('location') or {}).get('latitude') for record in records], pa.float64()),
+            'longitude': ([(record.get('location') or {}).get('longitude') for record in records], pa.float64()),
+            'geofence_inside': ([(record.get('geofence') or {}).get('inside') for record in records], pa.bool_()),
+            'geofence_id': ([(record.get('geofence') or {}).get('fence_id') for record in records], pa.string()),
+            'image': ([json.dumps(record['image']) if record.get('image') else None for record in records], pa.string()),
+            'image_path': ([record.get('image_path') for record in records], pa.string()),
+            'created_at': ([record.get('created_at') for record in records], pa.timestamp('ms')),
+            'updated_at': ([record.get('updated_at') for record in records], pa.timestamp('ms'))
+        }
+        return pa.table({name: pa.array(values, type=type_) for name, (values, type_) in columns.items()})
+    
+    def archive_partition(self, collection, company_id, month):
+        """Move one company's records of one month from MongoDB into its Parquet partition
+        
+        The partition file is replaced atomically, merged with what it already holds,
+        before the records are deleted from MongoDB, so a re-run after a crash neither
+        loses nor duplicates records. Returns the number of records moved.
+        """
+        pa, _, pq = load_pyarrow()
+        if not self.root:
+            raise RuntimeError("Set ATTENDANCE_ARCHIVE_DIR to storage every api node can read before archiving")
+        start, end = month_bounds(month)
+        records = list(collection.find({'company_id': company_id, 'timestamp': {'$gte': start, '$lt': end}}))
+        if not records:
+            return 0
+        
+        table = self._to_table(records)
+        company_key = str(company_id) if company_id else NO_COMPANY
+        directory = self._partition_dir(company_key, month)
+        path = os.path.join(directory, DATA_FILE)
+        os.makedirs(directory, exist_ok=True)
+        
+        if os.path.exists(path):
+            existing = pq.read_table(path)
+            new_ids = pa.array([str(record['_id']) for record in records])
+            keep = pa.compute.invert(pa.compute.is_in(existing['_id'], value_set=new_ids))
+            table = pa.concat_tables([existing.filter(keep), table.cast(existing.schema)])
+        
+        # Sorted by time so row group statistics let date filters skip row groups
+        table = table.sort_by([('timestamp', 'ascending'), ('_id', 'ascending')])
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        pq.write_table(table, tmp_path, compression='zstd', row_group_size=ROW_GROUP_SIZE)
+        os.replace(tmp_path, path)
+        
+        # Listed before the records leave MongoDB; other processes see it within MANIFEST_TTL
+        self.manifest.update_one(
+            {'_id': f'{company_key}/{month}'},
+            {'$set': {'company_key': company_key, 'month': month, 'rows': table.num_rows, 'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+        with self.lock:
+            self.cached_partitions = None
+        
+        ids = [record['_id'] for record in records]
+        for offset in range(0, len(ids), DELETE_BATCH_SIZE):
+            collection.delete_many({'_id': {'$in': ids[offset:offset + DELETE_BATCH_SIZE]}})
+        return len(records)
+    
+    @staticmethod
+    def closed_months(collection, keep_months):
+        """(company_id, month) pairs in MongoDB older than the last keep_months months"""
+        now = datetime.utcnow()
+        month_index = now.year * 12 + now.month - 1 - keep_months
+        cutoff = datetime(month_index // 12, month_index % 12 + 1, 1)
+        
+        pipeline = [
+            {'$match': {'timestamp': {'$lt': cutoff}}},
+            {'$group': {'_id': {
+                'company_id': '$company_id',
+                'month': {'$dateToString': {'format': '%Y-%m', 'date': '$timestamp'}}
+            }}}
+        ]
+        pairs = [(row['_id'].get('company_id'), row['_id']['month']) for row in collection.aggregate(pipeline)]
+        return sorted(pairs, key=lambda pair: (pair[1], str(pair[0])))
+    
+    def grouped_counts(self, company_id=None):
+        """Archived record counts per (company, student, day, status), shaped like the stats rebuild aggregation"""
+        _, ds, _ = load_pyarrow()
+        company_key = str(company_id) if company_id else None
+        for key, _, path, _ in self.partitions():
+            if company_key and key != company_key:
+                continue
+            
+            table = ds.dataset(path, format='parquet').to_table(columns=['student_id', 'attendance_date', 'status'])
+            counts = table.group_by(['student_id', 'attendance_date', 'status']).aggregate([('status', 'count')])
+            for row in counts.to_pylist():
+                yield {
+                    '_id': {
+                        'company_id': None if key == NO_COMPANY else ObjectId(key),
+                        'student_id': ObjectId(row['student_id']),
+                        'date': row['attendance_date'],
+                        'status': row['status']
+                    },
+                    'count': row['status_count']
+                }
+
+def archive_closed_months(collection, archive, keep_months=3, dry_run=False):
+    """Archive every company-month older than the last keep_months months; returns [(company_id, month, records)]"""
+    if keep_months < 1:
+        raise ValueError("keep_months must be at least 1 so late offline marks land in MongoDB")
+    
+    results = []
+    for company_id, month in AttendanceArchive.closed_months(collection, keep_months):
+        if dry_run:
+            start, end = month_bounds(month)
+            moved = collection.count_documents({'company_id': company_id, 'timestamp': {'$gte': start, '$lt': end}})
+        else:
+            moved = archive.archive_partition(collection, company_id, month)
+        results.append((company_id, month, moved))
+    return results
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+End-to-end benchmark for the attendance API hot paths
+Seeds a dataset, then drives login, mark, records (offset and cursor pages)
+and CSV export through the Flask test client in-process, reporting p50/p95/p99
+latency, throughput and Mongo commands per request for each endpoint. With
+--fixtures it also times the face pipeline stages on fixture images.
+
+Usage: python benchmarks/bench_api.py [--students N] [--days N] [--output results.json]
+                                      [--compare baseline.json] [--mongomock] [--skip-face]
+                                      [--concurrency N] [--inline-face]
+Uses MONGODB_URI with a throwaway database (--database, default
+'attendance_bench', dropped first). --mongomock runs without a server
+(requires the mongomock package; command counts are then unavailable).
+--skip-face replaces face encoding with a fixed vector, so /mark measures
+everything except dlib; use --fixtures to time the face stages themselves.
+
+/mark goes through the FaceWorkerPool as in production (FACE_WORKERS,
+FACE_QUEUE_SIZE); --concurrency sends marks from that many threads, so a full
+queue shows up as 503 responses, which are counted separately. --inline-face
+runs face work in the request thread instead (FACE_WORKERS=0).
+"""
+
+import argparse
+import base64
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pymongo import monitoring
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SKIP_FACE_VALUE = 0.05
+
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts commands sent to the server"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def started(self, event):
+        self.count += 1
+    
+    def succeeded(self, event):
+        pass
+    
+    def failed(self, event):
+        pass
+
+
+def percentiles(values):
+    """p50/p95/p99 of a list of milliseconds"""
+    if len(values) < 2:
+        value = values[0] if values else 0.0
+        return {'p50': value, 'p95': value, 'p99': value}
+    cuts = statistics.quantiles(values, n=100, method='inclusive')
+    return {'p50': round(cuts[49], 2), 'p95': round(cuts[94], 2), 'p99': round(cuts[98], 2)}
+
+
+def skip_face_encoding_timed(image_data):
+    """--skip-face job: a fixed encoding instead of dlib (module level, so pool workers can unpickle it)"""
+    import numpy as np
+    return np.full(128, SKIP_FACE_VALUE, dtype=np.float32), None, {}
+
+
+def skip_face_preload():
+    """--skip-face pool worker initializer: nothing to load"""
+
+
+def measure(name, requests, counter, expected_status, concurrency=1):
+    """Run request callables (from `concurrency` threads), timing each and counting Mongo commands
+    
+    503 responses with Retry-After are face queue backpressure; they are counted
+    as rejected rather than as unexpected responses.
+    """
+    commands_before = counter.count if counter else None
+    started = time.perf_counter()
+    
+    def timed(request):
+        request_started = time.perf_counter()
+        response = request()
+        # Streamed responses are only done once the body has been read
+        response.get_data()
+        status = response.status_code
+        if status == 503 and response.headers.get('Retry-After'):
+            status = 'rejected'
+        return (time.perf_counter() - request_started) * 1000, status
+    
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(timed, requests))
+    else:
+        outcomes = [timed(request) for request in requests]
+    
+    latencies = [latency for latency, _ in outcomes]
+    statuses = Counter(status for _, status in outcomes)
+    rejected = statuses.pop('rejected', 0)
+    errors = sum(count for status, count in statuses.items() if status != expected_status)
+    
+    elapsed = time.perf_counter() - started
+    result = {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'errors': errors,
+        'rejected_503': rejected,
+        'latency_ms': percentiles(latencies),
+        'mean_ms': round(statistics.mean(latencies), 2) if latencies else 0.0,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'mongo_commands_per_request': (
+            round((counter.count - commands_before) / len(latencies), 2)
+            if counter and latencies else None
+        )
+    }
+    
+    latency = result['latency_ms']
+    print(f"  {name:<16} p50 {latency['p50']:>8.1f}  p95 {latency['p95']:>8.1f}  p99 {latency['p99']:>8.1f} ms"
+          f"  {result['throughput_rps']:>7.1f} req/s  commands/req {result['mongo_commands_per_request']}"
+          + (f"  ({rejected} rejected with 503)" if rejected else '')
+          + (f"  ({errors} unexpected responses)" if errors else ''))
+    return result
+
+
+def make_selfie(path=None):
+    """Selfie bytes from a file, or a small generated JPEG"""
+    if path:
+        with open(path, 'rb') as f:
+            return f.read()
+    from PIL import Image
+    output = io.BytesIO()
+    Image.new('RGB', (640, 480), (128, 128, 128)).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def seed(db, num_companies, num_students, num_days, encoding):
+    """Load companies, students and attendance with the setup_db generator, in-process"""
+    import numpy as np
+    import setup_db
+    from database import create_indexes
+    from models import face_encoding_fields
+    from werkzeug.security import generate_password_hash
+    
+    setup_db.generator_db = db
+    companies = setup_db.generate_companies(db, 'bench', num_companies, np.random.default_rng(0))
+    
+    password_hash = generate_password_hash(setup_db.GENERATED_PASSWORD)
+    days = setup_db.generation_days(num_days)
+    records = 0
+    for start in range(0, num_students, setup_db.STUDENTS_PER_TASK):
+        end = min(start + setup_db.STUDENTS_PER_TASK, num_students)
+        _, task_records = setup_db.generate_students(
+            ('bench', start, end, companies, days, 0.9, 10000, password_hash, 0)
+        )
+        records += task_records
+    
+    # Every student's stored face matches the benchmark selfie
+    db.users.update_many({'role': 'student'}, {'$set': face_encoding_fields(encoding)})
+    db.users.insert_one({
+        'username': 'bench_admin',
+        'username_lower': 'bench_admin',
+        'password_hash': password_hash,
+        'role': 'faculty_admin',
+        'company_id': None,
+        **face_encoding_fields(None),
+        'created_at': datetime.utcnow(),
+        'is_active': True,
+        'token_version': 0
+    })
+    create_indexes(db)
+    return records
+
+
+def run_face_pipeline(fixture_dir, repeats):
+    """Per-stage latency of the face pipeline on fixture images"""
+    import bench_face_pipeline
+    fixtures = bench_face_pipeline.load_fixtures(fixture_dir)
+    settings = bench_face_pipeline.CONFIGS['fast-path']
+    timings, _ = bench_face_pipeline.run_config(fixtures, settings, repeats)
+    
+    print(f"\nface pipeline ({len(fixtures)} fixtures x {repeats})")
+    results = {}
+    for stage, values in timings.items():
+        if values:
+            results[stage] = percentiles(values)
+            print(f"  {stage:<16} p50 {results[stage]['p50']:>8.1f}  p95 {results[stage]['p95']:>8.1f}"
+                  f"  p99 {results[stage]['p99']:>8.1f} ms")
+    return results
+
+
+def compare(results, baseline_path):
+    """Print p50/p95 changes against an earlier results file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    
+    print(f"\nChange vs {baseline_path} ({baseline.get('git_commit', 'unknown')})")
+    for name, result in results['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        changes = []
+        for key in ('p50', 'p95'):
+            old, new = before['latency_ms'][key], result['latency_ms'][key]
+            changes.append(f"{key} {old:.1f} -> {new:.1f} ms ({(new - old) / old * 100:+.0f}%)" if old else f"{key} n/a")
+        print(f"  {name:<16} " + '   '.join(changes))
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(args):
+    os.environ['MONGODB_DB'] = args.database
+    if args.inline_face:
+        os.environ['FACE_WORKERS'] = '0'
+    
+    counter = None
+    if args.mongomock:
+        import mongomock
+        import pymongo
+        import database
+        pymongo.MongoClient = mongomock.MongoClient
+        database.MongoClient = mongomock.MongoClient
+    else:
+        counter = CommandCounter()
+        monitoring.register(counter)
+    
+    import setup_db
+    from app import create_app
+    from authorization import create_user_token
+    from models import FaceRecognitionModel
+    
+    selfie = make_selfie(args.selfie)
+    if args.skip_face:
+        # Patched before the pool starts, so its workers run (and load) the stand-ins too
+        encoding, _, _ = skip_face_encoding_timed(selfie)
+        FaceRecognitionModel.extract_face_encoding_timed = staticmethod(skip_face_encoding_timed)
+        FaceRecognitionModel.extract_face_encoding = classmethod(lambda cls, image_data, timings=None: (encoding, None))
+        FaceRecognitionModel.preload = staticmethod(skip_face_preload)
+    else:
+        encoding, error = FaceRecognitionModel.extract_face_encoding(selfie)
+        if error:
+            raise SystemExit(f"Benchmark selfie is unusable ({error}); pass --selfie or --skip-face")
+    
+    app = create_app({'UPLOAD_FOLDER': tempfile.mkdtemp(prefix='attendance_bench_')})
+    services = app.extensions['attendance']
+    db = services['db']
+    face_pool = services['face_pool']
+    # Started before timing, as gunicorn's post_worker_init does
+    face_pool.warm()
+    db.client.drop_database(db.name)
+    
+    print(f"Seeding {args.companies} companies, {args.students} students, {args.days} days...")
+    seed_started = time.perf_counter()
+    records = seed(db, args.companies, args.students, args.days, encoding)
+    print(f"Seeded {records} attendance records in {time.perf_counter() - seed_started:.1f}s\n")
+    
+    client = app.test_client()
+    students = list(db.users.find({'role': 'student'}, {'username': 1, 'role': 1, 'company_id': 1, 'token_version': 1}))
+    admin = db.users.find_one({'username': 'bench_admin'})
+    with app.app_context():
+        student_tokens = [create_user_token(student) for student in students]
+        admin_headers = {'Authorization': f"Bearer {create_user_token(admin)}"}
+    
+    selfie_b64 = 'data:image/jpeg;base64,' + base64.b64encode(selfie).decode()
+    n = args.iterations
+    
+    # Each student can mark once per day, so every mark uses the next student
+    marks = [
+        (lambda token=token: client.post(
+            '/api/attendance/mark',
+            json={'selfie_image': selfie_b64, 'location': {'latitude': 1.0, 'longitude': 1.0}},
+            headers={'Authorization': f'Bearer {token}'}
+        ))
+        for token in student_tokens[:n]
+    ]
+    logins = [
+        (lambda username=student['username']: client.post(
+            '/api/auth/login',
+            json={'username': username, 'password': setup_db.GENERATED_PASSWORD}
+        ))
+        for student in students[:n]
+    ]
+    
+    endpoints = {}
+    endpoints['login'] = measure('login', logins, counter, 200)
+    endpoints['mark'] = measure('mark', marks, counter, 201, concurrency=args.concurrency)
+    services['image_writer'].flush()
+    endpoints['records_offset'] = measure('records_offset', [
+        lambda page=page: client.get(f'/api/attendance/records?page={page}&per_page=50', headers=admin_headers)
+        for page in range(1, n + 1)
+    ], counter, 200)
+    
+    # Cursor pages walk forward, each request using the cursor from the previous one
+    cursor = {'next': ''}
+    
+    def next_page():
+        response = client.get(f"/api/attendance/records?per_page=50&cursor={cursor['next']}", headers=admin_headers)
+        cursor['next'] = response.get_json()['pagination']['next_cursor'] or ''
+        return response
+    
+    endpoints['records_cursor'] = measure('records_cursor', [next_page] * n, counter, 200)
+    endpoints['export_csv'] = measure('export_csv', [
+        lambda: client.get('/api/attendance/export?format=csv', headers=admin_headers)
+        for _ in range(args.export_iterations)
+    ], counter, 200)
+    
+    results = {
+        'benchmark': 'api',
+        'created_at': datetime.utcnow().isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'backend': 'mongomock' if args.mongomock else 'mongodb',
+        'face': 'skipped' if args.skip_face else 'dlib',
+        'face_pool': face_pool.get_stats(),
+        'dataset': {
+            'companies': args.companies,
+            'students': args.students,
+            'days': args.days,
+            'attendance_records': records
+        },
+        'endpoints': endpoints
+    }
+    
+    if args.fixtures:
+        results['face_pipeline'] = run_face_pipeline(args.fixtures, args.face_repeats)
+    
+    face_pool.shutdown()
+    db.client.drop_database(db.name)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the attendance API hot paths')
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--iterations', type=int, default=200, help='Requests per endpoint (marks use one student each)')
+    parser.add_argument('--export-iterations', type=int, default=3)
+    parser.add_argument('--database', default='attendance_bench', help='Throwaway database (dropped before and after)')
+    parser.add_argument('--mongomock', action='store_true', help='Use mongomock instead of a MongoDB server')
+    parser.add_argument('--skip-face', action='store_true', help='Use a fixed face encoding instead of running dlib')
+    parser.add_argument('--concurrency', type=int, default=1, help='Threads sending /mark requests')
+    parser.add_argument('--inline-face', action='store_true', help='Run face work in the request thread (FACE_WORKERS=0)')
+    parser.add_argument('--selfie', help='Selfie image for /mark (needs a detectable face unless --skip-face)')
+    parser.add_argument('--fixtures', help='Fixture image directory for the face pipeline stages')
+    parser.add_argument('--face-repeats', type=int, default=3)
+    parser.add_argument('--output', help='Write results as JSON to this file')
+    parser.add_argument('--compare', help='Earlier results JSON to compare against')
+    args = parser.parse_args()
+    
+    results = run_benchmark(args)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Benchmark for resolving students/companies on /api/attendance/records pages
+Compares the old per-record lookups with the batched $in lookups and reports
+Mongo query count and latency for several page sizes.
+
+Usage: python benchmarks/bench_attendance_records.py
+Uses MONGODB_URI and a throwaway 'attendance_bench' database.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from pymongo import monitoring
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import create_mongo_client
+from models import UserModel, CompanyModel
+
+load_dotenv()
+
+PAGE_SIZES = [50, 500, 5000]
+NUM_COMPANIES = 20
+NUM_STUDENTS = 2000
+
+
+class QueryCounter(monitoring.CommandListener):
+    """Counts commands sent to the server"""
+    
+    def __init__(self):
+        self.count = 0
+    
+    def started(self, event):
+        self.count += 1
+    
+    def succeeded(self, event):
+        pass
+    
+    def failed(self, event):
+        pass
+
+
+def seed(db, num_records):
+    """Create companies, students and attendance records for the benchmark"""
+    db.companies.drop()
+    db.users.drop()
+    db.attendance_records.drop()
+    
+    company_ids = db.companies.insert_many([
+        {'name': f'Company {i}', 'is_active': True} for i in range(NUM_COMPANIES)
+    ]).inserted_ids
+    
+    student_ids = db.users.insert_many([
+        {
+            'username': f'student_{i}',
+            'password_hash': 'x' * 100,
+            'role': 'student',
+            'company_id': company_ids[i % NUM_COMPANIES],
+            'face_encoding': [0.0] * 128,
+            'is_active': True
+        } for i in range(NUM_STUDENTS)
+    ]).inserted_ids
+    
+    now = datetime.utcnow()
+    db.attendance_records.insert_many([
+        {
+            'student_id': student_ids[i % NUM_STUDENTS],
+            'company_id': company_ids[i % NUM_COMPANIES],
+            'timestamp': now - timedelta(minutes=i),
+            'location': {'latitude': 0.0, 'longitude': 0.0},
+            'status': 'Present'
+        } for i in range(num_records)
+    ])
+
+
+def resolve_per_record(db, user_model, records):
+    """Previous behaviour: two lookups per record"""
+    for record in records:
+        user_model.get_user_by_id(record['student_id'])
+        if record.get('company_id'):
+            db.companies.find_one({'_id': record['company_id']})
+
+
+def resolve_batched(user_model, company_model, records):
+    """Current behaviour: one $in lookup per collection"""
+    user_model.get_users_by_ids(record['student_id'] for record in records)
+    company_model.get_companies_by_ids(record.get('company_id') for record in records)
+
+
+def measure(counter, fn):
+    counter.count = 0
+    start = time.perf_counter()
+    fn()
+    return counter.count, (time.perf_counter() - start) * 1000
+
+
+def run_benchmark():
+    counter = QueryCounter()
+    client = create_mongo_client(event_listeners=[counter])
+    db = client.attendance_bench
+    
+    print(f"Seeding {max(PAGE_SIZES)} attendance records...")
+    seed(db, max(PAGE_SIZES))
+    
+    user_model = UserModel(db)
+    company_model = CompanyModel(db)
+    
+    print(f"\n{'page size':>10} {'mode':>12} {'queries':>8} {'latency (ms)':>13}")
+    for page_size in PAGE_SIZES:
+        records = list(db.attendance_records.find().sort('timestamp', -1).limit(page_size))
+        
+        for mode, fn in [
+            ('per-record', lambda: resolve_per_record(db, user_model, records)),
+            ('batched', lambda: resolve_batched(user_model, company_model, records)),
+        ]:
+            queries, latency = measure(counter, fn)
+            print(f"{page_size:>10} {mode:>12} {queries:>8} {latency:>13.1f}")
+    
+    client.drop_database('attendance_bench')
+
+
+if __name__ == '__main__':
+    run_benchmark()
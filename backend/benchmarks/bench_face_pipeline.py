@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the face encoding pipeline
+Runs every fixture image through the original pipeline (full-size decode,
+face_encodings on the whole uncropped frame), the current pipeline at full
+resolution and the reduced decode / downscaled detection fast path, reports
+per-stage latency and checks match decisions against the original.
+
+Usage: python benchmarks/bench_face_pipeline.py <fixture_dir> [--repeats N]
+                                               [--people N] [--per-person N]
+Fixtures are either one directory per person (<fixture_dir>/<person>/*.jpg)
+or flat files named <person>_<anything>.jpg; images of the same person are
+expected to match each other and no one else.
+
+Fixtures are not committed, since they are photos of real people. Labeled
+Faces in the Wild (http://vis-www.cs.umass.edu/lfw/, the lfw.tgz archive)
+has the per-person layout; --people 20 --per-person 4 takes the first 20
+people (by name) with at least 4 images, so runs are reproducible.
+"""
+
+import argparse
+import base64
+import itertools
+import os
+import statistics
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from models import FaceRecognitionModel
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+BASELINE = 'original'
+CONFIGS = {
+    # None: the pipeline before the fast path (see original_face_encoding)
+    BASELINE: None,
+    'full-resolution': {'DECODE_REDUCTION': 1, 'DETECT_MAX_SIDE': 0},
+    'fast-path': {
+        'DECODE_REDUCTION': FaceRecognitionModel.DECODE_REDUCTION,
+        'DETECT_MAX_SIDE': FaceRecognitionModel.DETECT_MAX_SIDE
+    }
+}
+STAGES = ['base64', 'decode', 'detect', 'embed']
+
+
+def person_of(name):
+    """Person label of a fixture key (<person>/<file> or <person>_<anything>)"""
+    return name.split('/')[0] if '/' in name else name.split('_')[0]
+
+
+def load_fixtures(fixture_dir, people=None, per_person=None):
+    """Load fixture images as base64 strings keyed by <person>/<file> or filename
+    
+    With people / per_person, only the first people persons (by name) having at
+    least per_person images are loaded, per_person images each.
+    """
+    paths = {}
+    for name in sorted(os.listdir(fixture_dir)):
+        path = os.path.join(fixture_dir, name)
+        if os.path.isdir(path):
+            images = sorted(image for image in os.listdir(path) if image.lower().endswith(IMAGE_EXTENSIONS))
+            paths[name] = [(f'{name}/{image}', os.path.join(path, image)) for image in images]
+        elif name.lower().endswith(IMAGE_EXTENSIONS):
+            paths.setdefault(person_of(name), []).append((name, path))
+    
+    if per_person:
+        paths = {person: images[:per_person] for person, images in paths.items() if len(images) >= per_person}
+    if people:
+        paths = dict(list(paths.items())[:people])
+    
+    fixtures = {}
+    for images in paths.values():
+        for key, path in images:
+            with open(path, 'rb') as f:
+                fixtures[key] = base64.b64encode(f.read()).decode()
+    return fixtures
+
+
+def original_face_encoding(image_data, timings=None):
+    """Encode the way the pipeline did before the fast path
+    
+    Full-size decode, then face_recognition.face_encodings on the whole frame
+    (its own detection, embedding of the first face found, no crop).
+    """
+    import cv2
+    import face_recognition
+    
+    start = time.perf_counter()
+    image_bytes = FaceRecognitionModel.decode_base64_image(image_data)
+    base64_done = time.perf_counter()
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    decode_done = time.perf_counter()
+    if image is None:
+        return None, "Could not decode image"
+    
+    encodings = face_recognition.face_encodings(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if timings is not None:
+        timings['base64'] = base64_done - start
+        timings['decode'] = decode_done - base64_done
+        timings['detect+embed'] = time.perf_counter() - decode_done
+    
+    if not encodings:
+        return None, "No face detected in image"
+    return encodings[0], None
+
+
+def run_config(fixtures, settings, repeats):
+    """Encode every fixture with the given settings (None: the original pipeline), collecting stage timings"""
+    if settings is None:
+        extract = original_face_encoding
+    else:
+        for key, value in settings.items():
+            setattr(FaceRecognitionModel, key, value)
+        extract = FaceRecognitionModel.extract_face_encoding
+    
+    timings = {stage: [] for stage in STAGES}
+    encodings = {}
+    for name, image_data in fixtures.items():
+        for _ in range(repeats):
+            stage_timings = {}
+            encoding, error = extract(image_data, timings=stage_timings)
+            for stage, seconds in stage_timings.items():
+                timings.setdefault(stage, []).append(seconds * 1000)
+            timings.setdefault('total', []).append(sum(stage_timings.values()) * 1000)
+        
+        if error:
+            print(f"  {name}: {error}")
+        encodings[name] = encoding
+    
+    return timings, encodings
+
+
+def match_decisions(encodings):
+    """Match decision for every pair of fixtures"""
+    decisions = {}
+    for (name_a, enc_a), (name_b, enc_b) in itertools.combinations(sorted(encodings.items()), 2):
+        decisions[(name_a, name_b)] = FaceRecognitionModel.compare_faces(enc_a, enc_b) if enc_a is not None and enc_b is not None else None
+    return decisions
+
+
+def accuracy(decisions):
+    """Fraction of pairs whose decision agrees with the person labels"""
+    scored = [(a, b, d) for (a, b), d in decisions.items() if d is not None]
+    if not scored:
+        return 0.0
+    correct = sum(1 for a, b, d in scored if d == (person_of(a) == person_of(b)))
+    return correct / len(scored)
+
+
+def run_benchmark(fixture_dir, repeats, people=None, per_person=None):
+    fixtures = load_fixtures(fixture_dir, people, per_person)
+    print(f"Loaded {len(fixtures)} fixture images\n")
+    
+    results = {}
+    for config_name, settings in CONFIGS.items():
+        print(f"{config_name}: {settings}")
+        timings, encodings = run_config(fixtures, settings, repeats)
+        results[config_name] = match_decisions(encodings)
+        
+        print(f"  {'stage':>8} {'mean (ms)':>10} {'p95 (ms)':>10}")
+        for stage, values in timings.items():
+            if values:
+                p95 = statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+                print(f"  {stage:>8} {statistics.mean(values):>10.1f} {p95:>10.1f}")
+        print(f"  match accuracy: {accuracy(results[config_name]):.3f}\n")
+    
+    baseline = results[BASELINE]
+    for config_name, decisions in results.items():
+        if config_name == BASELINE:
+            continue
+        changed = [pair for pair in baseline if baseline[pair] != decisions[pair]]
+        print(f"Match decisions changed by {config_name} vs {BASELINE}: {len(changed)} of {len(baseline)}")
+        for name_a, name_b in changed:
+            print(f"  {name_a} vs {name_b}: {baseline[(name_a, name_b)]} -> {decisions[(name_a, name_b)]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the face encoding pipeline')
+    parser.add_argument('fixture_dir', help='Fixture images (see the module docstring for the layout)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--people', type=int, help='Use only the first N people')
+    parser.add_argument('--per-person', type=int, help='Use N images per person, skipping people with fewer')
+    args = parser.parse_args()
+    run_benchmark(args.fixture_dir, args.repeats, args.people, args.per_person)
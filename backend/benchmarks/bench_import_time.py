@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark for app import time
+Imports app.py in a fresh interpreter under `python -X importtime`, reports
+the total and the slowest top-level modules, and fails if a heavy library
+(dlib, OpenCV, openpyxl, ...) is imported eagerly or the budget is exceeded.
+
+Usage: python benchmarks/bench_import_time.py [--budget-ms N] [--repeats N] [--json]
+Run from the backend directory; importing app does not connect to MongoDB.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Must only be imported on the face worker and export code paths
+HEAVY_MODULES = ['face_recognition', 'dlib', 'cv2', 'openpyxl', 'PIL', 'pyarrow']
+
+
+def measure_import(module='app'):
+    """Import a module in a fresh interpreter
+    
+    Returns (total us, {direct import: cumulative us}, every module imported).
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    
+    total = 0
+    direct = {}
+    imported = set()
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package (indented by nesting depth)
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            total = int(cumulative)
+        elif depth == 1:
+            direct[name] = int(cumulative)
+    
+    return total, direct, imported
+
+
+def run_benchmark(budget_ms, repeats, top):
+    totals = []
+    for _ in range(repeats):
+        total, direct, imported = measure_import()
+        totals.append(total / 1000)
+    
+    heavy = sorted({name.split('.')[0] for name in imported} & set(HEAVY_MODULES))
+    slowest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'import_ms': {
+            'median': round(statistics.median(totals), 1),
+            'min': round(min(totals), 1),
+            'max': round(max(totals), 1)
+        },
+        'budget_ms': budget_ms,
+        'slowest_modules_ms': {name: round(us / 1000, 1) for name, us in slowest},
+        'heavy_modules_imported': heavy,
+        'passed': not heavy and (not budget_ms or statistics.median(totals) <= budget_ms)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure app import time')
+    parser.add_argument('--budget-ms', type=float, default=0, help='Fail if the median import time exceeds this')
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest modules to report')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+    
+    report = run_benchmark(args.budget_ms, args.repeats, args.top)
+    
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        timing = report['import_ms']
+        print(f"import app: median {timing['median']} ms (min {timing['min']}, max {timing['max']})")
+        print(f"  {'module':<24} {'cumulative (ms)':>16}")
+        for name, ms in report['slowest_modules_ms'].items():
+            print(f"  {name:<24} {ms:>16.1f}")
+        if report['heavy_modules_imported']:
+            print(f"Heavy modules imported eagerly: {', '.join(report['heavy_modules_imported'])}")
+        if args.budget_ms and timing['median'] > args.budget_ms:
+            print(f"Import time exceeds the {args.budget_ms} ms budget")
+    
+    sys.exit(0 if report['passed'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from pymongo import MongoClient, ReadPreference, monitoring
+
+DEFAULT_MONGODB_URI = 'mongodb://localhost:27017/attendance_app'
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST
+}
+
+def read_preference(name):
+    """Read preference for a mode name such as 'secondaryPreferred'"""
+    try:
+        return READ_PREFERENCES[name]
+    except KeyError:
+        raise ValueError(f"Unknown read preference: {name}")
+
+def report_read_preference():
+    """Read preference for admin listing and export reads (MONGO_REPORT_READ_PREFERENCE)"""
+    return read_preference(os.getenv('MONGO_REPORT_READ_PREFERENCE', 'secondaryPreferred'))
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Connection pool counters across all servers, from pymongo pool events"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = {}  # thread id -> check out start time
+        self.stats = {
+            'connections_open': 0,
+            'connections_created': 0,
+            'connections_closed': 0,
+            'checked_out': 0,
+            'checkouts': 0,
+            'checkout_failures': 0,
+            'checkout_wait_ms_total': 0.0,
+            'checkout_wait_ms_max': 0.0,
+            'pools_cleared': 0
+        }
+    
+    def _count(self, key, delta=1):
+        with self.lock:
+            self.stats[key] += delta
+    
+    def _end_wait(self):
+        started = self.waits.pop(threading.get_ident(), None)
+        if started is not None:
+            wait_ms = (time.perf_counter() - started) * 1000
+            with self.lock:
+                self.stats['checkout_wait_ms_total'] += wait_ms
+                self.stats['checkout_wait_ms_max'] = max(self.stats['checkout_wait_ms_max'], wait_ms)
+    
+    def pool_created(self, event):
+        pass
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        self._count('pools_cleared')
+    
+    def pool_closed(self, event):
+        pass
+    
+    def connection_created(self, event):
+        self._count('connections_created')
+        self._count('connections_open')
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        self._count('connections_closed')
+        self._count('connections_open', -1)
+    
+    def connection_check_out_started(self, event):
+        self.waits[threading.get_ident()] = time.perf_counter()
+    
+    def connection_check_out_failed(self, event):
+        self._end_wait()
+        self._count('checkout_failures')
+    
+    def connection_checked_out(self, event):
+        self._end_wait()
+        self._count('checkouts')
+        self._count('checked_out')
+    
+    def connection_checked_in(self, event):
+        self._count('checked_out', -1)
+    
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        stats['checkout_wait_ms_avg'] = stats['checkout_wait_ms_total'] / stats['checkouts'] if stats['checkouts'] else 0.0
+        stats['checkout_wait_ms_total'] = round(stats['checkout_wait_ms_total'], 1)
+        stats['checkout_wait_ms_max'] = round(stats['checkout_wait_ms_max'], 1)
+        stats['checkout_wait_ms_avg'] = round(stats['checkout_wait_ms_avg'], 2)
+        return stats
+
+def client_options():
+    """MongoClient options from the environment
+    
+    Waits for a pooled connection and for server selection are bounded, so an
+    overloaded or unreachable database fails requests fast instead of piling them up.
+    """
+    options = {
+        'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+        'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+        'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+        'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+        'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+        'readPreference': os.getenv('MONGO_READ_PREFERENCE', 'primary'),
+        'appname': os.getenv('MONGO_APP_NAME', 'attendance-app')
+    }
+    
+    # e.g. "zstd,snappy"; needs the zstandard / python-snappy packages, else pymongo skips them
+    compressors = os.getenv('MONGO_COMPRESSORS')
+    if compressors:
+        options['compressors'] = compressors
+    
+    write_concern = os.getenv('MONGO_WRITE_CONCERN')
+    if write_concern:
+        options['w'] = int(write_concern) if write_concern.isdigit() else write_concern
+    
+    return options
+
+def create_mongo_client(uri=None, pool_stats=None, **overrides):
+    """The one place MongoClients are built, so pool and timeout settings are shared
+    
+    Keyword overrides take precedence over the environment.
+    """
+    options = client_options()
+    options.update(overrides)
+    if pool_stats is not None:
+        options['event_listeners'] = list(options.get('event_listeners', [])) + [pool_stats]
+    
+    return MongoClient(uri or os.getenv('MONGODB_URI', DEFAULT_MONGODB_URI), **options)
+
+def get_database(client):
+    """The app database on a client"""
+    return client[os.getenv('MONGODB_DB', 'attendance_app')]
+
+def create_indexes(db):
+    """Create the app's indexes (idempotent; run once per deploy)
+    
+    Failures are raised: the unique partial index on (student_id, attendance_date)
+    is what prevents duplicate attendance marks.
+    """
+    # User indexes
+    db.users.create_index('username', unique=True)
+    db.users.create_index('role')
+    db.users.create_index([('role', 1), ('username_lower', 1)])
+    db.users.create_index([('company_id', 1), ('role', 1), ('username_lower', 1)])
+    db.users.create_index('company_id')
+    # Face identification indexes re-read users changed since their watermark
+    db.users.create_index('updated_at')
+    
+    # Attendance indexes
+    db.attendance_records.create_index([('student_id', 1), ('timestamp', -1)])
+    db.attendance_records.create_index('company_id')
+    db.attendance_records.create_index('timestamp')
+    db.attendance_records.create_index('status')
+    db.attendance_records.create_index([('timestamp', -1), ('_id', -1)])
+    db.attendance_records.create_index([('company_id', 1), ('timestamp', -1), ('_id', -1)])
+    db.attendance_records.create_index([('student_id', 1), ('timestamp', -1), ('_id', -1)])
+    db.attendance_records.create_index(
+        [('student_id', 1), ('attendance_date', 1)],
+        unique=True,
+        partialFilterExpression={'attendance_date': {'$exists': True}}
+    )
+    # Region queries; company admins always filter by company first
+    db.attendance_records.create_index([('location_geo', '2dsphere')])
+    db.attendance_records.create_index([('company_id', 1), ('location_geo', '2dsphere')])
+    # Delta exports walk (updated_at, _id) from a watermark
+    db.attendance_records.create_index([('updated_at', 1), ('_id', 1)])
+    db.attendance_records.create_index([('company_id', 1), ('updated_at', 1), ('_id', 1)])
+    
+    # Attendance stats indexes
+    db.attendance_daily_stats.create_index(
+        [('scope', 1), ('company_id', 1), ('student_id', 1), ('period', 1)],
+        unique=True
+    )
+    db.attendance_daily_stats.create_index([('scope', 1), ('student_id', 1), ('period', 1)])
+    
+    # Company indexes
+    db.companies.create_index('name')
+    
+    print("Database indexes created successfully")
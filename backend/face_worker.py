@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from metrics import observe_stages
+from models import FaceRecognitionModel
+
+class FaceWorkerUnavailable(Exception):
+    """Raised when face processing cannot be done right now (client should retry)"""
+    
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class FaceWorkerBusy(FaceWorkerUnavailable):
+    """Raised when the face processing queue is full"""
+
+class FaceWorkerTimeout(FaceWorkerUnavailable):
+    """Raised when a face processing job takes longer than the job timeout"""
+
+class FaceWorkerPool:
+    """Pool of worker processes for CPU-bound face processing"""
+    
+    def __init__(self, max_workers=None, max_queue=None, job_timeout=None, batch_deadline=None):
+        if max_workers is None:
+            max_workers = int(os.getenv('FACE_WORKERS', os.cpu_count() or 1))
+        if max_queue is None:
+            max_queue = int(os.getenv('FACE_QUEUE_SIZE', max(max_workers, 1) * 4))
+        if job_timeout is None:
+            job_timeout = float(os.getenv('FACE_JOB_TIMEOUT', 10))
+        if batch_deadline is None:
+            # Below the serving timeout, so a full batch cannot outlive its request
+            batch_deadline = float(os.getenv('FACE_BATCH_DEADLINE', 30))
+        
+        self.max_workers = max_workers  # 0 runs jobs inline in the request thread
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.batch_deadline = batch_deadline
+        self.executor = None
+        self.slots = threading.BoundedSemaphore(max_queue)
+        self.lock = threading.Lock()
+        self.stats = {
+            'submitted': 0,
+            'completed': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'in_flight': 0
+        }
+    
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                # forkserver avoids forking a multi-threaded web server process
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                if context.get_start_method() == 'forkserver':
+                    # Workers fork from a server that has already loaded the dlib models
+                    context.set_forkserver_preload(['models', 'cv2', 'face_recognition'])
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=context,
+                    initializer=FaceRecognitionModel.preload
+                )
+            return self.executor
+    
+    def _reset_executor(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+    
+    def _count(self, key, delta=1):
+        with self.lock:
+            self.stats[key] += delta
+    
+    def _job_done(self, future):
+        self.slots.release()
+        self._count('in_flight', -1)
+        self._count('completed')
+    
+    def submit(self, fn, *args, wait=None):
+        """Queue fn(*args) on a worker process, waiting up to `wait` seconds for a free slot"""
+        acquired = self.slots.acquire(timeout=wait) if wait else self.slots.acquire(blocking=False)
+        if not acquired:
+            self._count('rejected')
+            raise FaceWorkerBusy('Face processing queue is full, please retry shortly')
+        
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            self.slots.release()
+            self._reset_executor()
+            raise FaceWorkerUnavailable('Face processing workers restarted, please retry')
+        
+        self._count('submitted')
+        self._count('in_flight')
+        # The slot is freed when the job really finishes, even after a timeout
+        future.add_done_callback(self._job_done)
+        return future
+    
+    def result(self, future, timeout=None):
+        """Wait for a submitted job, applying the per-job timeout (or a shorter one)"""
+        try:
+            return future.result(timeout=self.job_timeout if timeout is None else min(timeout, self.job_timeout))
+        except FutureTimeoutError:
+            future.cancel()
+            self._count('timed_out')
+            raise FaceWorkerTimeout('Face processing timed out, please retry')
+        except BrokenProcessPool:
+            self._reset_executor()
+            raise FaceWorkerUnavailable('Face processing workers restarted, please retry')
+    
+    def run(self, fn, *args):
+        """Run fn(*args) in a worker process and wait for the result"""
+        if self.max_workers == 0:
+            return fn(*args)
+        
+        return self.result(self.submit(fn, *args))
+    
+    def run_many(self, fn, args_list):
+        """Run fn over many argument tuples in parallel
+        
+        Returns one result per tuple, or the FaceWorkerUnavailable raised for it.
+        Unlike run(), waits for queue slots instead of rejecting immediately, but
+        only until batch_deadline: tuples not done by then get FaceWorkerTimeout.
+        """
+        deadline = time.monotonic() + self.batch_deadline
+        
+        def past_deadline():
+            return FaceWorkerTimeout('Batch time limit reached, please retry this entry')
+        
+        if self.max_workers == 0:
+            return [fn(*args) if time.monotonic() < deadline else past_deadline() for args in args_list]
+        
+        futures = []
+        for args in args_list:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                futures.append(past_deadline())
+                continue
+            try:
+                futures.append(self.submit(fn, *args, wait=min(remaining, self.job_timeout)))
+            except FaceWorkerUnavailable as e:
+                futures.append(e)
+        
+        results = []
+        for future in futures:
+            try:
+                if isinstance(future, FaceWorkerUnavailable):
+                    results.append(future)
+                else:
+                    results.append(self.result(future, timeout=max(deadline - time.monotonic(), 0)))
+            except FaceWorkerUnavailable as e:
+                results.append(e)
+        return results
+    
+    def extract_face_encoding(self, image_data):
+        """Extract a face encoding in a worker process, recording its stage timings here"""
+        face_encoding, error, timings = self.run(FaceRecognitionModel.extract_face_encoding_timed, image_data)
+        observe_stages(timings)
+        return face_encoding, error
+    
+    def extract_face_encodings(self, images):
+        """Extract face encodings for many images in parallel worker processes"""
+        results = []
+        for result in self.run_many(FaceRecognitionModel.extract_face_encoding_timed, [(image,) for image in images]):
+            if isinstance(result, FaceWorkerUnavailable):
+                results.append(result)
+            else:
+                face_encoding, error, timings = result
+                observe_stages(timings)
+                results.append((face_encoding, error))
+        return results
+    
+    def warm(self):
+        """Start every worker process, loading the models, before the first request"""
+        if self.max_workers == 0:
+            FaceRecognitionModel.preload()
+            return
+        
+        executor = self._get_executor()
+        futures = [executor.submit(FaceRecognitionModel.preload) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+    
+    def get_stats(self):
+        """Queue depth and job counters"""
+        with self.lock:
+            stats = dict(self.stats)
+        stats['workers'] = self.max_workers
+        stats['max_queue'] = self.max_queue
+        stats['queue_depth'] = max(stats['in_flight'] - self.max_workers, 0)
+        return stats
+    
+    def shutdown(self):
+        self._reset_executor()
@@ -0,0 +1,202 @@
+import math
+from bson import ObjectId
+
+EARTH_RADIUS_M = 6371008.8
+MAX_GEOFENCES = 20
+MAX_POLYGON_VERTICES = 1000
+MIN_RADIUS_M = 10
+MAX_RADIUS_M = 50000
+GEOFENCE_MODES = ('enforce', 'flag')
+
+def parse_location(location):
+    """Validate a {latitude, longitude} dict, returning (latitude, longitude) floats
+    
+    Raises ValueError with a message suitable for the client.
+    """
+    if not isinstance(location, dict) or location.get('latitude') in (None, '') or location.get('longitude') in (None, ''):
+        raise ValueError('Location coordinates are required')
+    
+    try:
+        latitude = float(location['latitude'])
+        longitude = float(location['longitude'])
+    except (TypeError, ValueError):
+        raise ValueError('Location coordinates must be numbers')
+    
+    if not -90 <= latitude <= 90 or not -180 <= longitude <= 180:
+        raise ValueError('Location coordinates are out of range')
+    return latitude, longitude
+
+def point(latitude, longitude):
+    """GeoJSON point (GeoJSON puts longitude first)"""
+    return {'type': 'Point', 'coordinates': [longitude, latitude]}
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """Great-circle distance in meters"""
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+class CircleFence:
+    """Circle around a center point, with a bounding box to reject far points cheaply"""
+    
+    def __init__(self, fence_id, name, latitude, longitude, radius_m):
+        self.id = fence_id
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.radius_m = radius_m
+        
+        lat_margin = math.degrees(radius_m / EARTH_RADIUS_M)
+        lng_margin = lat_margin / max(math.cos(math.radians(latitude)), 1e-6)
+        self.bounds = (latitude - lat_margin, latitude + lat_margin, longitude - lng_margin, longitude + lng_margin)
+    
+    def contains(self, latitude, longitude):
+        min_lat, max_lat, min_lng, max_lng = self.bounds
+        if not (min_lat <= latitude <= max_lat and min_lng <= longitude <= max_lng):
+            return False
+        return haversine_m(self.latitude, self.longitude, latitude, longitude) <= self.radius_m
+    
+    def region(self):
+        """$geoWithin operand for this circle"""
+        return {'$centerSphere': [[self.longitude, self.latitude], self.radius_m / EARTH_RADIUS_M]}
+
+class PolygonFence:
+    """GeoJSON polygon (outer ring and optional holes), tested with ray casting
+    
+    Edges are treated as straight lines in longitude/latitude, which is accurate
+    for site-sized polygons; MongoDB uses geodesic edges for the same shape.
+    """
+    
+    def __init__(self, fence_id, name, geometry):
+        self.id = fence_id
+        self.name = name
+        self.geometry = geometry
+        self.rings = [[(lng, lat) for lng, lat in ring] for ring in geometry['coordinates']]
+        
+        outer = self.rings[0]
+        self.bounds = (
+            min(lat for _, lat in outer), max(lat for _, lat in outer),
+            min(lng for lng, _ in outer), max(lng for lng, _ in outer)
+        )
+    
+    @staticmethod
+    def _in_ring(ring, latitude, longitude):
+        inside = False
+        for (lng1, lat1), (lng2, lat2) in zip(ring, ring[1:]):
+            if (lat1 > latitude) != (lat2 > latitude):
+                if longitude < lng1 + (latitude - lat1) * (lng2 - lng1) / (lat2 - lat1):
+                    inside = not inside
+        return inside
+    
+    def contains(self, latitude, longitude):
+        min_lat, max_lat, min_lng, max_lng = self.bounds
+        if not (min_lat <= latitude <= max_lat and min_lng <= longitude <= max_lng):
+            return False
+        if not self._in_ring(self.rings[0], latitude, longitude):
+            return False
+        return not any(self._in_ring(hole, latitude, longitude) for hole in self.rings[1:])
+    
+    def region(self):
+        """$geoWithin operand for this polygon"""
+        return {'$geometry': self.geometry}
+
+class Geofences:
+    """A company's compiled geofences; a location is allowed if any fence contains it"""
+    
+    def __init__(self, fences=(), mode='enforce'):
+        self.fences = tuple(fences)
+        self.mode = mode
+    
+    def __bool__(self):
+        return bool(self.fences)
+    
+    def match(self, latitude, longitude):
+        """The first fence containing the location, or None"""
+        for fence in self.fences:
+            if fence.contains(latitude, longitude):
+                return fence
+        return None
+    
+    def get(self, fence_id):
+        for fence in self.fences:
+            if fence.id == fence_id:
+                return fence
+        return None
+
+def compile_fence(fence):
+    """Build a fence object from its stored form"""
+    if fence['type'] == 'circle':
+        longitude, latitude = fence['center']['coordinates']
+        return CircleFence(fence['id'], fence.get('name'), latitude, longitude, fence['radius_m'])
+    return PolygonFence(fence['id'], fence.get('name'), fence['geometry'])
+
+def compile_geofences(company):
+    """Compiled geofences of a company document (empty when it has none)"""
+    company = company or {}
+    return Geofences(
+        [compile_fence(fence) for fence in company.get('geofences') or []],
+        company.get('geofence_mode') or 'enforce'
+    )
+
+def _parse_ring(ring):
+    if not isinstance(ring, list) or len(ring) < 3:
+        raise ValueError('Polygon rings need at least 3 points')
+    
+    parsed = []
+    for position in ring:
+        if not isinstance(position, (list, tuple)) or len(position) != 2:
+            raise ValueError('Polygon points must be [longitude, latitude] pairs')
+        latitude, longitude = parse_location({'latitude': position[1], 'longitude': position[0]})
+        parsed.append([longitude, latitude])
+    
+    # GeoJSON rings are closed: the last point repeats the first
+    if parsed[0] != parsed[-1]:
+        parsed.append(list(parsed[0]))
+    if len(parsed) < 4:
+        raise ValueError('Polygon rings need at least 3 distinct points')
+    if len(parsed) > MAX_POLYGON_VERTICES:
+        raise ValueError(f'Polygon rings can have at most {MAX_POLYGON_VERTICES} points')
+    return parsed
+
+def normalize_geofence(fence):
+    """Validate a geofence from a request and return its stored form
+    
+    Accepted shapes:
+      {"type": "circle", "center": {"latitude": .., "longitude": ..}, "radius_m": ..}
+      {"type": "polygon", "coordinates": [[[lng, lat], ...], ...]}  (GeoJSON Polygon rings)
+    Raises ValueError with a message suitable for the client.
+    """
+    if not isinstance(fence, dict):
+        raise ValueError('Each geofence must be an object')
+    
+    name = str(fence.get('name') or '')[:100]
+    fence_id = str(fence.get('id') or ObjectId())
+    
+    if fence.get('type') == 'circle':
+        latitude, longitude = parse_location(fence.get('center'))
+        try:
+            radius_m = float(fence.get('radius_m'))
+        except (TypeError, ValueError):
+            raise ValueError('Circle geofences need a numeric radius_m')
+        if not MIN_RADIUS_M <= radius_m <= MAX_RADIUS_M:
+            raise ValueError(f'radius_m must be between {MIN_RADIUS_M} and {MAX_RADIUS_M}')
+        return {
+            'id': fence_id,
+            'name': name,
+            'type': 'circle',
+            'center': point(latitude, longitude),
+            'radius_m': radius_m
+        }
+    
+    if fence.get('type') == 'polygon':
+        rings = fence.get('coordinates')
+        if not isinstance(rings, list) or not rings:
+            raise ValueError('Polygon geofences need GeoJSON coordinates')
+        return {
+            'id': fence_id,
+            'name': name,
+            'type': 'polygon',
+            'geometry': {'type': 'Polygon', 'coordinates': [_parse_ring(ring) for ring in rings]}
+        }
+    
+    raise ValueError("Geofence type must be 'circle' or 'polygon'")
@@ -0,0 +1,64 @@
+"""
+Gunicorn settings for production serving: gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is deployed as two services from the same code, chosen with
+SERVING_ROLE, and the load balancer routes requests to them by path:
+  
+  face  /api/attendance/mark, /api/attendance/mark-batch, /api/attendance/identify,
+        /api/auth/register and /api/auth/update-face. CPU-bound (dlib), so one
+        gthread worker per node takes requests and hands face work to its
+        FaceWorkerPool processes. The pool's bounded queue answers overload
+        with 503 + Retry-After, every job has FACE_JOB_TIMEOUT and batches
+        FACE_BATCH_DEADLINE. The pool forks its processes from a server that
+        has loaded the dlib models, so they share them copy-on-write.
+  api   everything else (login, listings, export, images, health). I/O-bound,
+        so a few gevent workers each serving many concurrent requests.
+
+Worker sizing (override any of these with WEB_CONCURRENCY / GEVENT_CONNECTIONS):
+  
+  face  workers = 1, FACE_WORKERS = cores. dlib uses one core per job, so
+        more processes only queue on the CPU; fewer leaves cores idle. With
+        WEB_CONCURRENCY > 1 the cores are split between the workers' pools.
+        threads = FACE_QUEUE_SIZE + FACE_WORKERS, so requests beyond the queue
+        reach the app and get a 503 instead of waiting unseen in the backlog.
+        Keep the api service on other machines, or subtract the cores you give it.
+  api   workers = cores (at least 2), worker_connections = 1000. Each worker
+        is one process, so this is bounded by Mongo pool size (connections
+        per process x workers x nodes) rather than by CPU.
+"""
+
+import multiprocessing
+import os
+
+role = os.getenv('SERVING_ROLE', 'api')
+# Tells the app it runs as one of several processes (see AttendanceFeed)
+os.environ.setdefault('SERVING_ROLE', role)
+cores = multiprocessing.cpu_count()
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+accesslog = '-'
+graceful_timeout = 30
+
+if role == 'face':
+    worker_class = 'gthread'
+    workers = int(os.getenv('WEB_CONCURRENCY', 1))
+    # Read by FaceWorkerPool when wsgi:app is loaded in the worker
+    os.environ.setdefault('FACE_WORKERS', str(max(cores // workers, 1)))
+    face_queue = int(os.getenv('FACE_QUEUE_SIZE', int(os.environ['FACE_WORKERS']) * 4))
+    threads = int(os.getenv('GUNICORN_THREADS', face_queue + int(os.environ['FACE_WORKERS'])))
+    # Worker liveness only; requests are bounded by FACE_JOB_TIMEOUT / FACE_BATCH_DEADLINE
+    timeout = 60
+elif role == 'api':
+    worker_class = 'gevent'
+    workers = int(os.getenv('WEB_CONCURRENCY', max(cores, 2)))
+    worker_connections = int(os.getenv('GEVENT_CONNECTIONS', 1000))
+    timeout = 30
+else:
+    raise ValueError(f"Unknown SERVING_ROLE: {role}")
+
+
+def post_worker_init(worker):
+    """Start the face worker processes before the worker takes requests"""
+    if role == 'face':
+        worker.wsgi.extensions['attendance']['face_pool'].warm()
+        worker.log.info("Face worker pool started")
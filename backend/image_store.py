@@ -0,0 +1,308 @@
+import hashlib
+import heapq
+import io
+import os
+import queue
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+import gridfs
+
+THUMBNAIL_MAX_SIDE = int(os.getenv('THUMBNAIL_MAX_SIDE', 160))
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg')
+}
+# Served for originals whose format could not be decoded
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+
+def content_key(data):
+    """Content address of an image: the SHA-256 of its bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def make_thumbnails(image_bytes, max_side=THUMBNAIL_MAX_SIDE):
+    """The image's content type (from its decoded format) and small WebP and JPEG renditions keyed by format"""
+    from PIL import Image
+    
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        content_type = Image.MIME.get(image.format, DEFAULT_CONTENT_TYPE)
+        image = image.convert('RGB')
+        image.thumbnail((max_side, max_side))
+        
+        thumbnails = {}
+        for name, (pil_format, _) in THUMBNAIL_FORMATS.items():
+            output = io.BytesIO()
+            image.save(output, format=pil_format, quality=75)
+            thumbnails[name] = output.getvalue()
+        return content_type, thumbnails
+
+class ImageStore(ABC):
+    """Content-addressed blob store for selfie images
+    
+    Backends implement exists, get and _write; a backend missing one cannot be constructed.
+    """
+    
+    def put(self, data):
+        """Store bytes under their content key (idempotent) and return the key"""
+        key = content_key(data)
+        if not self.exists(key):
+            self._write(key, data)
+        return key
+    
+    def put_with_thumbnails(self, image_bytes):
+        """Store an image and its thumbnails, returning the image reference for a record
+        
+        The content type is that of the decoded image (JPEG, PNG, WebP, ...).
+        """
+        content_type = DEFAULT_CONTENT_TYPE
+        thumbnails = {}
+        try:
+            content_type, renditions = make_thumbnails(image_bytes)
+            for name, data in renditions.items():
+                thumbnails[name] = self.put(data)
+        except Exception as e:
+            # The original is still worth keeping if it cannot be thumbnailed
+            print(f"Error creating thumbnails: {e}")
+        
+        return {
+            'key': self.put(image_bytes),
+            'content_type': content_type,
+            'size': len(image_bytes),
+            'thumbnails': thumbnails
+        }
+    
+    @abstractmethod
+    def exists(self, key):
+        """Whether bytes are stored under key"""
+    
+    @abstractmethod
+    def get(self, key):
+        """Return the stored bytes, or None if the key is unknown"""
+    
+    @abstractmethod
+    def _write(self, key, data):
+        """Store data under key"""
+
+class LocalImageStore(ImageStore):
+    """Images as files on local disk, fanned out by key prefix"""
+    
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+    
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key[2:4], key)
+    
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+    
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+    
+    def _write(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # Write then rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+class GridFSImageStore(ImageStore):
+    """Images in MongoDB GridFS, shared by every app node"""
+    
+    def __init__(self, db, collection='images'):
+        self.fs = gridfs.GridFS(db, collection=collection)
+    
+    def exists(self, key):
+        return self.fs.exists(key)
+    
+    def get(self, key):
+        try:
+            return self.fs.get(key).read()
+        except gridfs.errors.NoFile:
+            return None
+    
+    def _write(self, key, data):
+        try:
+            self.fs.put(data, _id=key)
+        except gridfs.errors.FileExists:
+            pass
+
+class S3ImageStore(ImageStore):
+    """Images in an S3-compatible bucket (AWS S3, or MinIO as a local stand-in)"""
+    
+    def __init__(self, bucket, endpoint_url=None, prefix='images/'):
+        try:
+            import boto3
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise RuntimeError("IMAGE_STORE=s3 requires boto3 (pip install boto3)")
+        
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+        self.client_error = ClientError
+        self.bucket = bucket
+        self.prefix = prefix
+    
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except self.client_error:
+            return False
+    
+    def get(self, key):
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)
+            return response['Body'].read()
+        except self.client_error:
+            return None
+    
+    def _write(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+class ImageWriteBehind:
+    """Persists selfies to the image store on a background thread
+    
+    Requests only write the decoded bytes to a local spool directory (durable
+    across restarts) and enqueue the attendance id. The writer thread then
+    stores the image and thumbnails and fills in the record's image reference.
+    Failed writes are retried with backoff without holding up the rest of the queue.
+    """
+    
+    MAX_ATTEMPTS = 5
+    
+    def __init__(self, image_store, attendance_model, spool_dir, stale_after=60):
+        self.image_store = image_store
+        self.attendance_model = attendance_model
+        self.spool_dir = spool_dir
+        self.stale_after = stale_after
+        self.queue = queue.Queue()
+        self.retries = []  # heap of (due monotonic time, attendance id, attempt)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {'written': 0, 'failed': 0, 'recovered': 0}
+        os.makedirs(spool_dir, exist_ok=True)
+    
+    def _spool_path(self, attendance_id):
+        return os.path.join(self.spool_dir, f"{attendance_id}.img")
+    
+    def spool(self, attendance_id, image_bytes):
+        """Write image bytes to the spool before the record is inserted"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.spool_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, self._spool_path(attendance_id))
+    
+    def discard(self, attendance_id):
+        """Drop a spooled image whose record was not inserted"""
+        try:
+            os.remove(self._spool_path(attendance_id))
+        except FileNotFoundError:
+            pass
+    
+    def enqueue(self, attendance_id):
+        """Hand a spooled image to the writer thread"""
+        self._ensure_started()
+        self.queue.put((str(attendance_id), 1))
+    
+    def _ensure_started(self):
+        # Started lazily so the thread belongs to the serving process, not a pre-fork parent
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='image-write-behind', daemon=True)
+                self.thread.start()
+                self._recover()
+    
+    def _recover(self):
+        """Re-queue spooled images left behind by a previous process"""
+        cutoff = time.time() - self.stale_after
+        for name in os.listdir(self.spool_dir):
+            path = os.path.join(self.spool_dir, name)
+            if name.endswith('.img') and os.path.getmtime(path) < cutoff:
+                self.queue.put((name[:-len('.img')], 1))
+                self.stats['recovered'] += 1
+    
+    def _next_job(self):
+        """Next queued image, or None when only a retry became due meanwhile"""
+        now = time.monotonic()
+        while self.retries and self.retries[0][0] <= now:
+            _, attendance_id, attempt = heapq.heappop(self.retries)
+            self.queue.put((attendance_id, attempt))
+        
+        timeout = self.retries[0][0] - now if self.retries else None
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+    
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                continue
+            
+            attendance_id, attempt = job
+            try:
+                if self._persist(attendance_id):
+                    self.stats['written'] += 1
+            except Exception as e:
+                print(f"Error persisting image for attendance {attendance_id}: {e}")
+                if attempt < self.MAX_ATTEMPTS:
+                    # Scheduled rather than slept on, so other images keep flowing
+                    heapq.heappush(self.retries, (time.monotonic() + min(2 ** attempt, 30), attendance_id, attempt + 1))
+                else:
+                    # Left in the spool; recovered on the next process start
+                    self.stats['failed'] += 1
+            finally:
+                self.queue.task_done()
+    
+    def _persist(self, attendance_id):
+        path = self._spool_path(attendance_id)
+        try:
+            with open(path, 'rb') as f:
+                image_bytes = f.read()
+        except FileNotFoundError:
+            # Already persisted or discarded
+            return False
+        
+        image = self.image_store.put_with_thumbnails(image_bytes)
+        self.attendance_model.set_image(attendance_id, image)
+        os.remove(path)
+        return True
+    
+    def flush(self):
+        """Block until every queued image has been persisted (or has run out of retries)"""
+        while True:
+            self.queue.join()
+            if not self.retries:
+                return
+            time.sleep(0.05)
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['queued'] = self.queue.qsize()
+        stats['retrying'] = len(self.retries)
+        return stats
+
+def create_image_store(db, upload_folder):
+    """Build the image store selected by IMAGE_STORE (local, gridfs or s3)"""
+    backend = os.getenv('IMAGE_STORE', 'local')
+    
+    if backend == 'local':
+        return LocalImageStore(os.path.join(upload_folder, 'images'))
+    if backend == 'gridfs':
+        return GridFSImageStore(db)
+    if backend == 's3':
+        return S3ImageStore(
+            bucket=os.getenv('S3_BUCKET', 'attendance-images'),
+            endpoint_url=os.getenv('S3_ENDPOINT_URL')
+        )
+    
+    raise ValueError(f"Unknown IMAGE_STORE: {backend}")
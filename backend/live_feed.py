@@ -0,0 +1,175 @@
+import os
+import queue
+import threading
+import time
+from pymongo.errors import OperationFailure, PyMongoError
+
+# Fields of a record sent to dashboards (the selfie reference and GeoJSON copy stay out)
+EVENT_PROJECTION = {'fullDocument.image': 0, 'fullDocument.image_path': 0, 'fullDocument.location_geo': 0}
+
+class Subscription:
+    """One dashboard connection: a bounded queue of events for a company (or all)"""
+    
+    def __init__(self, company_id, max_queue):
+        self.company_id = company_id
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+    
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A stalled client must not hold up the others; it can catch up with Last-Event-ID
+            self.dropped += 1
+    
+    def get(self, timeout):
+        """Next event, or None when nothing arrived within timeout seconds"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class AttendanceFeed:
+    """Fans newly inserted attendance records out to live dashboard connections
+    
+    Records come from one change stream per process (LIVE_FEED_SOURCE=change_stream),
+    or, when the deployment is not a replica set, from inserts made by this process
+    (local). The default, auto, uses the change stream when the server supports it,
+    and falls back to local only outside gunicorn (no SERVING_ROLE), where the same
+    process makes the marks.
+    Either way Mongo work does not grow with the number of open dashboards.
+    """
+    
+    def __init__(self, collection, user_model, source=None, max_subscribers=None, max_queue=1000):
+        self.collection = collection
+        self.user_model = user_model
+        self.requested_source = source or os.getenv('LIVE_FEED_SOURCE', 'auto')
+        self.max_subscribers = max_subscribers or int(os.getenv('LIVE_FEED_MAX_SUBSCRIBERS', 500))
+        self.max_queue = max_queue
+        self.source = None  # decided on the first subscription
+        self.subscribers = set()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {'published': 0, 'stream_errors': 0}
+    
+    def subscribe(self, company_id=None):
+        """Register a connection for one company (None: every company), or None when full"""
+        self._ensure_started()
+        with self.lock:
+            if len(self.subscribers) >= self.max_subscribers:
+                return None
+            subscription = Subscription(company_id, self.max_queue)
+            self.subscribers.add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscribers.discard(subscription)
+    
+    def publish_local(self, records):
+        """Insert hook of the attendance model; only used without a change stream"""
+        if self.source == 'local' and self.subscribers:
+            for record in records:
+                self._publish(record)
+    
+    def _publish(self, record):
+        event = self.format_event(record)
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscription in subscribers:
+            if subscription.company_id is None or subscription.company_id == record.get('company_id'):
+                subscription.put(event)
+        self.stats['published'] += 1
+    
+    def format_event(self, record):
+        """JSON-ready event for a record, with the student's name from the user cache"""
+        student = self.user_model.get_user_summary(record['student_id'])
+        location = record.get('location') or {}
+        return {
+            'id': str(record['_id']),
+            'student': {
+                'id': str(record['student_id']),
+                'username': student['username'] if student else 'Unknown'
+            },
+            'company_id': str(record['company_id']) if record.get('company_id') else None,
+            'timestamp': record['timestamp'].isoformat(),
+            'date': record.get('attendance_date'),
+            'status': record['status'],
+            'location': {'latitude': location.get('latitude'), 'longitude': location.get('longitude')},
+            'geofence': record.get('geofence')
+        }
+    
+    def _ensure_started(self):
+        # Started lazily so the stream belongs to the serving process, not a pre-fork parent
+        with self.lock:
+            if self.source == 'local' or (self.thread is not None and self.thread.is_alive()):
+                return
+            
+            stream = None
+            if self.requested_source != 'local':
+                try:
+                    stream = self._open_stream()
+                except PyMongoError as e:
+                    # Only "not supported here" falls back; connection errors are retried next time
+                    if self.requested_source == 'change_stream' or not isinstance(e, OperationFailure):
+                        raise
+                    print(f"Change streams unavailable, live feed uses in-process events: {e}")
+                except Exception as e:
+                    # Clients without change stream support at all (e.g. mongomock)
+                    if self.requested_source == 'change_stream':
+                        raise
+                    print(f"Change streams unavailable, live feed uses in-process events: {e}")
+            
+            if stream is None:
+                if self.requested_source == 'auto' and os.getenv('SERVING_ROLE'):
+                    # Under gunicorn marks are made by other processes (and the face service),
+                    # so a local feed would silently stream nothing
+                    raise RuntimeError(
+                        "The live feed needs a MongoDB replica set (change streams) when served by "
+                        "gunicorn; set LIVE_FEED_SOURCE=local to only stream this process's inserts"
+                    )
+                self.source = 'local'
+                return
+            
+            self.source = 'change_stream'
+            self.thread = threading.Thread(target=self._run, args=(stream,), name='attendance-live-feed', daemon=True)
+            self.thread.start()
+    
+    def _open_stream(self, resume_after=None):
+        return self.collection.watch(
+            [{'$match': {'operationType': 'insert'}}, {'$project': EVENT_PROJECTION}],
+            resume_after=resume_after
+        )
+    
+    def _run(self, stream):
+        resume_token = None
+        attempt = 0
+        while True:
+            try:
+                if stream is None:
+                    stream = self._open_stream(resume_after=resume_token)
+                attempt = 0
+                with stream:
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        try:
+                            self._publish(change['fullDocument'])
+                        except Exception as e:
+                            print(f"Error publishing attendance {change.get('documentKey')}: {e}")
+            except PyMongoError as e:
+                # Resumes after the last delivered change, so nothing is missed or repeated,
+                # unless the oplog no longer has it (then dashboards catch up with Last-Event-ID)
+                if isinstance(e, OperationFailure) and e.code in (280, 286):
+                    resume_token = None
+                self.stats['stream_errors'] += 1
+                attempt += 1
+                print(f"Attendance change stream error, reconnecting: {e}")
+                time.sleep(min(2 ** attempt, 30))
+            stream = None
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['subscribers'] = len(self.subscribers)
+        stats['dropped'] = sum(subscription.dropped for subscription in list(self.subscribers))
+        stats['change_stream'] = 1 if self.source == 'change_stream' else 0
+        return stats
@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+PROFILE_ROLES = ('company_admin', 'faculty_admin')
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=None):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """Monotonic counter with labels"""
+    
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, value in sorted(self.values.items(), key=lambda item: tuple(map(str, item[0]))):
+                lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+    
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., sum, count]
+        self.lock = threading.Lock()
+    
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, series in sorted(self.series.items(), key=lambda item: tuple(map(str, item[0]))):
+                for bound, count in zip(self.buckets, series):
+                    le = f'le="{bound}"'
+                    lines.append(f'{self.name}_bucket{format_labels(self.labels, label_values, le)} {count}')
+                le = 'le="+Inf"'
+                lines.append(f'{self.name}_bucket{format_labels(self.labels, label_values, le)} {series[-1]}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, label_values)} {series[-2]}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, label_values)} {series[-1]}')
+        return lines
+
+class MetricsRegistry:
+    """Metrics of one process, rendered in the Prometheus text format
+    
+    Each gunicorn worker keeps its own registry; the pid comment at the top
+    of the output tells which worker answered a scrape.
+    """
+    
+    def __init__(self):
+        self.metrics = []
+        self.collectors = {}
+    
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+    
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+    
+    def add_gauges(self, prefix, collect):
+        """Export the numeric values of a stats dict returned by collect() as gauges"""
+        self.collectors[prefix] = collect
+    
+    def render(self):
+        lines = [f'# pid {os.getpid()}']
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        
+        for prefix, collect in self.collectors.items():
+            try:
+                stats = collect()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", prefix, e)
+                continue
+            for key, value in sorted(stats.items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'# TYPE {prefix}_{key} gauge')
+                    lines.append(f'{prefix}_{key} {value}')
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Request latency by route', ['method', 'route', 'status']
+)
+REQUEST_EXCEPTIONS = REGISTRY.counter(
+    'http_request_exceptions_total', 'Exceptions turned into 500 responses', ['route', 'exception']
+)
+MONGO_COMMANDS = REGISTRY.counter(
+    'mongo_commands_total', 'MongoDB commands by name and outcome', ['command', 'outcome']
+)
+MONGO_COMMAND_DURATION = REGISTRY.histogram(
+    'mongo_command_duration_seconds', 'MongoDB command latency', ['command']
+)
+MONGO_COMMANDS_PER_REQUEST = REGISTRY.histogram(
+    'mongo_commands_per_request', 'MongoDB commands issued per request', ['route'], buckets=COUNT_BUCKETS
+)
+MONGO_TIME_PER_REQUEST = REGISTRY.histogram(
+    'mongo_time_per_request_seconds', 'Time spent in MongoDB commands per request', ['route']
+)
+STAGE_DURATION = REGISTRY.histogram(
+    'attendance_stage_duration_seconds', 'Time in each stage of face and attendance processing', ['stage']
+)
+
+def current_route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+def observe_stage(stage, seconds):
+    """Record a processing stage (also reported in the request's Server-Timing header)"""
+    STAGE_DURATION.observe(seconds, stage)
+    if has_request_context():
+        stages = g.setdefault('stage_timings', {})
+        stages[stage] = stages.get(stage, 0.0) + seconds
+
+def observe_stages(timings):
+    for stage, seconds in timings.items():
+        observe_stage(stage, seconds)
+
+@contextmanager
+def time_stage(stage):
+    """Time the enclosed block as a processing stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - started)
+
+def record_exception(error):
+    """Log an exception a route is about to turn into a 500, with its traceback"""
+    route = current_route() if has_request_context() else None
+    REQUEST_EXCEPTIONS.inc(route, type(error).__name__)
+    logger.exception("Unhandled error in %s", route)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Counts MongoDB commands and their latency, per command and per request
+    
+    pymongo calls listeners on the thread that runs the command, so commands
+    issued while handling a request are attributed to that request.
+    """
+    
+    def started(self, event):
+        if has_request_context():
+            g.mongo_commands = g.get('mongo_commands', 0) + 1
+    
+    def _finished(self, event, outcome):
+        seconds = event.duration_micros / 1e6
+        MONGO_COMMANDS.inc(event.command_name, outcome)
+        MONGO_COMMAND_DURATION.observe(seconds, event.command_name)
+        if has_request_context():
+            g.mongo_seconds = g.get('mongo_seconds', 0.0) + seconds
+    
+    def succeeded(self, event):
+        self._finished(event, 'success')
+    
+    def failed(self, event):
+        self._finished(event, 'failure')
+
+def start_profiler():
+    """pyinstrument (sampling) when installed, else cProfile"""
+    try:
+        from pyinstrument import Profiler
+        profiler = Profiler()
+    except ImportError:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    
+    profiler.start()
+    return profiler
+
+def save_profile(profiler, profile_dir):
+    """Stop a profiler and write its report, returning the file name"""
+    os.makedirs(profile_dir, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{threading.get_ident()}"
+    
+    if hasattr(profiler, 'output_html'):
+        profiler.stop()
+        name += '.html'
+        with open(os.path.join(profile_dir, name), 'w') as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.disable()
+        name += '.prof'
+        profiler.dump_stats(os.path.join(profile_dir, name))
+    return name
+
+def init_app(app):
+    """Time every request, attribute Mongo work to it and handle the X-Profile header
+    
+    Profiling is opt-in (PROFILING_ENABLED=true) and only for admin tokens. The
+    report is written to PROFILE_DIR and named in the X-Profile-File response header.
+    """
+    profiling_enabled = os.getenv('PROFILING_ENABLED', 'false').lower() == 'true'
+    profile_dir = os.getenv('PROFILE_DIR', os.path.join(app.config['UPLOAD_FOLDER'], 'profiles'))
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+        
+        if profiling_enabled and request.headers.get('X-Profile'):
+            from flask_jwt_extended import get_jwt, verify_jwt_in_request
+            try:
+                verify_jwt_in_request(optional=True)
+                role = get_jwt().get('role')
+            except Exception:
+                role = None
+            if role in PROFILE_ROLES:
+                g.profiler = start_profiler()
+    
+    @app.after_request
+    def record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        
+        route = current_route()
+        REQUEST_DURATION.observe(time.perf_counter() - started, request.method, route, response.status_code)
+        MONGO_COMMANDS_PER_REQUEST.observe(g.get('mongo_commands', 0), route)
+        MONGO_TIME_PER_REQUEST.observe(g.get('mongo_seconds', 0.0), route)
+        
+        timings = [f'mongo;dur={g.get("mongo_seconds", 0.0) * 1000:.1f};desc="{g.get("mongo_commands", 0)} commands"']
+        for stage, seconds in g.get('stage_timings', {}).items():
+            timings.append(f'{stage};dur={seconds * 1000:.1f}')
+        response.headers['Server-Timing'] = ', '.join(timings)
+        
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            response.headers['X-Profile-File'] = save_profile(profiler, profile_dir)
+        return response
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Migration: backfill attendance_date on existing attendance records
+Computes each record's local calendar date in its company's timezone and
+then creates the unique (student_id, attendance_date) index.
+
+Records that would break the once-per-day rule (a second record for the
+same student and day) keep no attendance_date and get
+attendance_date_conflict instead, so they stay visible for manual review.
+
+Usage: python migrations/backfill_attendance_date.py [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import os
+import sys
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import create_mongo_client, get_database
+from models import AttendanceModel
+
+# Load environment variables
+load_dotenv()
+
+def backfill(db, batch_size=1000, dry_run=False):
+    """Backfill attendance_date in batches, returning (updated, conflicts)"""
+    attendance_model = AttendanceModel(db)
+    
+    # Earliest record of each student/day wins, so walk in that order
+    cursor = db.attendance_records.find(
+        {'attendance_date': {'$exists': False}, 'attendance_date_conflict': {'$exists': False}},
+        {'student_id': 1, 'company_id': 1, 'timestamp': 1}
+    ).sort([('student_id', 1), ('timestamp', 1)]).batch_size(batch_size)
+    
+    updated = 0
+    conflicts = 0
+    current_student = None
+    student_days = set()
+    batch = []
+    
+    def flush(batch):
+        nonlocal updated, conflicts
+        # Records created after the deploy already carry attendance_date
+        existing = attendance_model.find_marked_days(
+            (record['student_id'], attendance_date) for record, attendance_date in batch
+        )
+        
+        operations = []
+        for record, attendance_date in batch:
+            if (record['student_id'], attendance_date) in existing:
+                operations.append(UpdateOne({'_id': record['_id']}, {'$set': {'attendance_date_conflict': attendance_date}}))
+                conflicts += 1
+            else:
+                operations.append(UpdateOne({'_id': record['_id']}, {'$set': {'attendance_date': attendance_date}}))
+                updated += 1
+        
+        if operations and not dry_run:
+            db.attendance_records.bulk_write(operations, ordered=False)
+    
+    for record in cursor:
+        if record['student_id'] != current_student:
+            current_student = record['student_id']
+            student_days = set()
+        
+        attendance_date = attendance_model.get_attendance_date(record.get('company_id'), record['timestamp'])
+        if attendance_date in student_days:
+            # Duplicate within this run: the earlier record of the day keeps the date
+            if not dry_run:
+                db.attendance_records.update_one(
+                    {'_id': record['_id']},
+                    {'$set': {'attendance_date_conflict': attendance_date}}
+                )
+            conflicts += 1
+            continue
+        
+        student_days.add(attendance_date)
+        batch.append((record, attendance_date))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+            print(f"Processed {updated + conflicts} records...")
+    
+    if batch:
+        flush(batch)
+    
+    return updated, conflicts
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill attendance_date on attendance records')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    
+    client = create_mongo_client()
+    db = get_database(client)
+    
+    updated, conflicts = backfill(db, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"Backfilled attendance_date on {updated} records")
+    if conflicts:
+        print(f"{conflicts} records duplicate an earlier record of the same day and were marked with attendance_date_conflict")
+    
+    if not args.dry_run:
+        db.attendance_records.create_index(
+            [('student_id', 1), ('attendance_date', 1)],
+            unique=True,
+            partialFilterExpression={'attendance_date': {'$exists': True}}
+        )
+        print("Unique (student_id, attendance_date) index created")
+
+if __name__ == '__main__':
+    main()
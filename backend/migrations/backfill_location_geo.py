@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Migration: backfill location_geo on existing attendance records
+Region queries match the GeoJSON point in location_geo (2dsphere indexed), so
+records created before it was introduced are not found until this has run.
+Records whose stored coordinates are missing or invalid are skipped.
+
+Usage: python migrations/backfill_location_geo.py [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import os
+import sys
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import create_mongo_client, get_database
+from geofence import parse_location, point
+
+# Load environment variables
+load_dotenv()
+
+def backfill(db, batch_size=1000, dry_run=False):
+    """Set location_geo in batches, returning (records updated, records skipped)"""
+    cursor = db.attendance_records.find(
+        {'location_geo': {'$exists': False}},
+        {'location': 1}
+    ).batch_size(batch_size)
+    
+    updated = 0
+    skipped = 0
+    operations = []
+    for record in cursor:
+        try:
+            latitude, longitude = parse_location(record.get('location'))
+        except ValueError:
+            skipped += 1
+            continue
+        
+        operations.append(UpdateOne({'_id': record['_id']}, {'$set': {
+            'location': {'latitude': latitude, 'longitude': longitude},
+            'location_geo': point(latitude, longitude)
+        }}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                db.attendance_records.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+            print(f"Processed {updated} records...")
+    
+    if operations:
+        if not dry_run:
+            db.attendance_records.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    
+    return updated, skipped
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill location_geo on attendance records')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    
+    client = create_mongo_client()
+    db = get_database(client)
+    
+    updated, skipped = backfill(db, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"Backfilled location_geo on {updated} records ({skipped} without valid coordinates skipped)")
+    
+    if not args.dry_run:
+        db.attendance_records.create_index([('location_geo', '2dsphere')])
+        db.attendance_records.create_index([('company_id', 1), ('location_geo', '2dsphere')])
+        print("location_geo indexes created")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Migration: backfill updated_at on existing attendance records
+Delta exports (/api/attendance/export/delta) walk records in updated_at order,
+so records created before it was introduced are only exported after this has
+run. They get their created_at (or timestamp) as updated_at.
+
+Usage: python migrations/backfill_updated_at.py [--dry-run]
+"""
+
+import argparse
+import os
+import sys
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import create_mongo_client, get_database
+
+# Load environment variables
+load_dotenv()
+
+def backfill(db, dry_run=False):
+    """Set updated_at with one server-side update, returning the number of records updated"""
+    query = {'updated_at': {'$exists': False}}
+    if dry_run:
+        return db.attendance_records.count_documents(query)
+    
+    result = db.attendance_records.update_many(
+        query,
+        [{'$set': {'updated_at': {'$ifNull': ['$created_at', '$timestamp']}}}]
+    )
+    return result.modified_count
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill updated_at on attendance records')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    args = parser.parse_args()
+    
+    client = create_mongo_client()
+    db = get_database(client)
+    
+    updated = backfill(db, dry_run=args.dry_run)
+    print(f"Backfilled updated_at on {updated} records")
+    
+    if not args.dry_run:
+        db.attendance_records.create_index([('updated_at', 1), ('_id', 1)])
+        db.attendance_records.create_index([('company_id', 1), ('updated_at', 1), ('_id', 1)])
+        print("updated_at indexes created")
+
+if __name__ == '__main__':
+    main()
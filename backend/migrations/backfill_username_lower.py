@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Migration: backfill username_lower on existing users
+Student name search matches a prefix of this normalized field, so users
+created before it was introduced are not found until this has run.
+
+Usage: python migrations/backfill_username_lower.py [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import os
+import sys
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import create_mongo_client, get_database
+
+# Load environment variables
+load_dotenv()
+
+def backfill(db, batch_size=1000, dry_run=False):
+    """Set username_lower in batches, returning the number of users updated"""
+    cursor = db.users.find(
+        {'username_lower': {'$exists': False}},
+        {'username': 1}
+    ).batch_size(batch_size)
+    
+    updated = 0
+    operations = []
+    for user in cursor:
+        operations.append(UpdateOne({'_id': user['_id']}, {'$set': {'username_lower': user['username'].lower()}}))
+        if len(operations) >= batch_size:
+            if not dry_run:
+                db.users.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+            print(f"Processed {updated} users...")
+    
+    if operations:
+        if not dry_run:
+            db.users.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    
+    return updated
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill username_lower on users')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    
+    client = create_mongo_client()
+    db = get_database(client)
+    
+    updated = backfill(db, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"Backfilled username_lower on {updated} users")
+    
+    if not args.dry_run:
+        db.users.create_index([('role', 1), ('username_lower', 1)])
+        db.users.create_index([('company_id', 1), ('role', 1), ('username_lower', 1)])
+        print("username_lower indexes created")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Migration: convert face encodings to the compact binary format
+Rewrites encodings stored as a list of 128 doubles into float32 BSON
+Binary (format version 1) and sets has_face_encoding on every user.
+
+Usage: python migrations/convert_face_encodings.py [--dry-run] [--batch-size N]
+"""
+
+import argparse
+import os
+import sys
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from database import create_mongo_client, get_database
+from models import face_encoding_fields
+
+# Load environment variables
+load_dotenv()
+
+def convert(db, batch_size=1000, dry_run=False):
+    """Convert legacy encodings in bulk, returning (converted, without_encoding)"""
+    converted = 0
+    without_encoding = 0
+    operations = []
+    
+    def flush(operations):
+        if operations and not dry_run:
+            db.users.bulk_write(operations, ordered=False)
+    
+    # Legacy list encodings, plus users that never had the has_face_encoding flag
+    cursor = db.users.find(
+        {'$or': [
+            {'face_encoding': {'$type': 'array'}},
+            {'has_face_encoding': {'$exists': False}}
+        ]},
+        {'face_encoding': 1}
+    ).batch_size(batch_size)
+    
+    for user in cursor:
+        face_encoding = user.get('face_encoding')
+        if face_encoding is None:
+            fields = face_encoding_fields(None)
+            without_encoding += 1
+        elif isinstance(face_encoding, list):
+            fields = face_encoding_fields(face_encoding)
+            converted += 1
+        else:
+            # Already binary, only the flag is missing
+            fields = {'has_face_encoding': True}
+        
+        operations.append(UpdateOne({'_id': user['_id']}, {'$set': fields}))
+        if len(operations) >= batch_size:
+            flush(operations)
+            operations = []
+            print(f"Processed {converted + without_encoding} users...")
+    
+    flush(operations)
+    return converted, without_encoding
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert face encodings to float32 BSON Binary')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args()
+    
+    client = create_mongo_client()
+    db = get_database(client)
+    
+    converted, without_encoding = convert(db, batch_size=args.batch_size, dry_run=args.dry_run)
+    print(f"Converted {converted} face encodings to binary")
+    print(f"Flagged {without_encoding} users without a face encoding")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Migration: rebuild the attendance_daily_stats aggregates
+Recomputes the per-company daily and per-student monthly counts from the
+raw attendance records, including those moved to the Parquet archive. Run
+once after deploying the stats collection, and again whenever the
+aggregates may have drifted (e.g. after manual edits).
+
+Usage: python migrations/rebuild_attendance_stats.py [--company-id ID]
+"""
+
+import argparse
+import os
+import sys
+from dotenv import load_dotenv
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from archive import AttendanceArchive, archive_root
+from database import create_mongo_client, get_database
+from models import AttendanceStatsModel
+
+# Load environment variables
+load_dotenv()
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild attendance stats from attendance records')
+    parser.add_argument('--company-id', help='Only rebuild the stats of this company')
+    args = parser.parse_args()
+    
+    client = create_mongo_client()
+    db = get_database(client)
+    
+    db.attendance_daily_stats.create_index(
+        [('scope', 1), ('company_id', 1), ('student_id', 1), ('period', 1)],
+        unique=True
+    )
+    db.attendance_daily_stats.create_index([('scope', 1), ('student_id', 1), ('period', 1)])
+    
+    archive = AttendanceArchive(archive_root(), db.attendance_archive)
+    archived_rows = archive.grouped_counts(args.company_id) if archive.has_data() else None
+    
+    rows = AttendanceStatsModel(db).rebuild(args.company_id, archived_rows=archived_rows)
+    print(f"Rebuilt attendance stats from {rows} student/day groups")
+
+if __name__ == '__main__':
+    main()
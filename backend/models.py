@@ -1,15 +1,114 @@
-from datetime import datetime
-from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from bson import Binary, ObjectId
+from collections import OrderedDict
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from zoneinfo import ZoneInfo
+import base64
+import importlib
+import itertools
+import json
+import os
+import re
+import threading
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
-import face_recognition
 import numpy as np
-import cv2 # Added missing import for cv2
+from archive import merge_newest_first
+from geofence import Geofences, compile_geofences, parse_location, point
+
+# Timezone used for a company's attendance day when it has none configured
+DEFAULT_TIMEZONE = os.getenv('DEFAULT_TIMEZONE', 'UTC')
+
+# Image reference of a record whose selfie is still being stored
+PENDING_IMAGE = {'pending': True}
+
+# Fields never needed when users are resolved for listings/exports
+USER_SUMMARY_PROJECTION = {'password_hash': 0, 'face_encoding': 0}
+
+# Face encodings are stored as little-endian float32 BSON Binary (512 bytes)
+FACE_ENCODING_VERSION = 1
+FACE_ENCODING_DTYPE = np.dtype('<f4')
+
+def encode_face_encoding(face_encoding):
+    """Pack a face encoding into its stored Binary form"""
+    return Binary(np.asarray(face_encoding, dtype=FACE_ENCODING_DTYPE).tobytes())
+
+def decode_face_encoding(stored):
+    """Unpack a stored face encoding into a NumPy array
+    
+    Binary encodings are viewed in place with np.frombuffer (no copy); legacy
+    encodings stored as a list of doubles are still accepted.
+    """
+    if stored is None:
+        return None
+    if isinstance(stored, bytes):
+        return np.frombuffer(stored, dtype=FACE_ENCODING_DTYPE)
+    return np.asarray(stored, dtype=np.float32)
+
+def face_encoding_fields(face_encoding):
+    """User document fields for a (possibly missing) face encoding"""
+    if face_encoding is None:
+        return {'face_encoding': None, 'face_encoding_version': None, 'has_face_encoding': False}
+    return {
+        'face_encoding': encode_face_encoding(face_encoding),
+        'face_encoding_version': FACE_ENCODING_VERSION,
+        'has_face_encoding': True
+    }
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after a TTL"""
+    
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key):
+        """Return the cached value, or None if missing or expired"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+    
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+    
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+    
+    def get_stats(self):
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses}
 
 class UserModel:
     """User model for handling user operations"""
     
     def __init__(self, db):
         self.collection = db.users
+        self.cache = TTLCache(
+            maxsize=int(os.getenv('USER_CACHE_SIZE', 10000)),
+            ttl=float(os.getenv('USER_CACHE_TTL', 60))
+        )
     
     def create_user(self, username, password, role, company_id=None, face_encoding=None):
         """Create a new user"""
@@ -19,104 +118,515 @@ class UserModel:
         
         user_data = {
             'username': username,
+            'username_lower': username.lower(),
             'password_hash': generate_password_hash(password),
             'role': role,  # 'student', 'company_admin', 'faculty_admin'
             'company_id': ObjectId(company_id) if company_id else None,
-            'face_encoding': face_encoding.tolist() if face_encoding is not None else None,
+            **face_encoding_fields(face_encoding),
             'created_at': datetime.utcnow(),
-            'is_active': True
+            'updated_at': datetime.utcnow(),
+            'is_active': True,
+            'token_version': 0
         }
         
         result = self.collection.insert_one(user_data)
         return str(result.inserted_id), None
     
     def authenticate_user(self, username, password):
-        """Authenticate user credentials"""
-        user = self.collection.find_one({'username': username, 'is_active': True})
+        """Authenticate user credentials
+        
+        The user comes with has_face_encoding, so logins need no second lookup.
+        """
+        user = self.collection.find_one({'username': username, 'is_active': True}, {'face_encoding': 0})
         if user and check_password_hash(user['password_hash'], password):
+            if 'has_face_encoding' not in user:
+                # Not yet migrated by migrations/convert_face_encodings.py
+                user['has_face_encoding'] = self.collection.count_documents(
+                    {'_id': user['_id'], 'face_encoding': {'$ne': None}}, limit=1
+                ) > 0
             return user
         return None
     
-    def get_user_by_id(self, user_id):
-        """Get user by ID"""
-        return self.collection.find_one({'_id': ObjectId(user_id)})
+    def get_user_by_id(self, user_id, with_face_encoding=False):
+        """Get user by ID
+        
+        The face encoding is only loaded when asked for, and is returned as a NumPy array.
+        """
+        projection = None if with_face_encoding else {'face_encoding': 0}
+        user = self.collection.find_one({'_id': ObjectId(user_id)}, projection)
+        if user and with_face_encoding:
+            user['face_encoding'] = decode_face_encoding(user.get('face_encoding'))
+        return user
+    
+    def get_user_summary(self, user_id):
+        """Get a user's role, company and active state, served from the cache when possible
+        
+        The summary has _id, username, role, company_id, is_active, created_at
+        and has_face_encoding, but never the password hash or face encoding.
+        """
+        user_id = ObjectId(user_id)
+        summary = self.cache.get(user_id)
+        if summary is None:
+            user = self.collection.find_one({'_id': user_id}, USER_SUMMARY_PROJECTION)
+            if not user:
+                return None
+            
+            if 'has_face_encoding' not in user:
+                # Not yet migrated by migrations/convert_face_encodings.py
+                user['has_face_encoding'] = self.collection.count_documents(
+                    {'_id': user_id, 'face_encoding': {'$ne': None}}, limit=1
+                ) > 0
+            summary = user
+            self.cache.set(user_id, summary)
+        
+        return dict(summary)
+    
+    def search_student_ids(self, name_prefix, company_id=None, limit=None):
+        """Ids of students whose username starts with name_prefix (case-insensitive)
+        
+        The anchored regex on username_lower is an index range scan. Returns at most
+        limit + 1 ids so callers can tell when the match was capped.
+        """
+        query = {
+            'role': 'student',
+            'username_lower': {'$regex': '^' + re.escape(name_prefix.lower())}
+        }
+        if company_id:
+            query['company_id'] = ObjectId(company_id)
+        
+        cursor = self.collection.find(query, {'_id': 1})
+        if limit:
+            cursor = cursor.limit(limit + 1)
+        return [user['_id'] for user in cursor]
+    
+    def invalidate_user(self, user_id):
+        """Drop a user from the cache after it changes"""
+        self.cache.invalidate(ObjectId(user_id))
+    
+    def get_users_by_ids(self, user_ids, projection=None):
+        """Get users for a list of IDs in a single query, keyed by _id"""
+        ids = list({ObjectId(user_id) for user_id in user_ids if user_id})
+        if not ids:
+            return {}
+        
+        cursor = self.collection.find({'_id': {'$in': ids}}, projection or USER_SUMMARY_PROJECTION)
+        return {user['_id']: user for user in cursor}
+    
+    def iter_face_encodings(self):
+        """Iterate over active users that have a registered face encoding"""
+        cursor = self.collection.find(
+            {'is_active': True, 'face_encoding': {'$ne': None}},
+            {'company_id': 1, 'face_encoding': 1}
+        )
+        for user in cursor:
+            user['face_encoding'] = decode_face_encoding(user['face_encoding'])
+            yield user
+    
+    def iter_face_encoding_changes(self, since):
+        """Iterate over users changed since a time, with is_active and decoded face_encoding"""
+        cursor = self.collection.find(
+            {'updated_at': {'$gte': since}},
+            {'company_id': 1, 'face_encoding': 1, 'is_active': 1}
+        )
+        for user in cursor:
+            user['face_encoding'] = decode_face_encoding(user.get('face_encoding'))
+            yield user
+    
+    def set_user_active(self, user_id, is_active):
+        """Activate or deactivate a user, revoking tokens issued so far"""
+        result = self.collection.update_one(
+            {'_id': ObjectId(user_id)},
+            {'$set': {'is_active': is_active, 'updated_at': datetime.utcnow()}, '$inc': {'token_version': 1}}
+        )
+        self.invalidate_user(user_id)
+        return result
     
     def update_face_encoding(self, user_id, face_encoding):
         """Update user's face encoding"""
-        return self.collection.update_one(
+        result = self.collection.update_one(
             {'_id': ObjectId(user_id)},
-            {'$set': {'face_encoding': face_encoding.tolist()}}
+            {'$set': {**face_encoding_fields(face_encoding), 'updated_at': datetime.utcnow()}}
         )
+        self.invalidate_user(user_id)
+        return result
 
 class CompanyModel:
     """Company model for handling company operations"""
     
     def __init__(self, db):
         self.collection = db.companies
+        self.cache = TTLCache(
+            maxsize=int(os.getenv('COMPANY_CACHE_SIZE', 1000)),
+            ttl=float(os.getenv('COMPANY_CACHE_TTL', 300))
+        )
     
-    def create_company(self, name, description=""):
+    def create_company(self, name, description="", timezone=None):
         """Create a new company"""
         company_data = {
             'name': name,
             'description': description,
+            'timezone': timezone or DEFAULT_TIMEZONE,
             'created_at': datetime.utcnow(),
             'is_active': True
         }
         
         result = self.collection.insert_one(company_data)
+        self.invalidate_company(result.inserted_id)
         return str(result.inserted_id)
     
     def get_company_by_id(self, company_id):
-        """Get company by ID"""
-        return self.collection.find_one({'_id': ObjectId(company_id)})
+        """Get company by ID, served from the cache when possible"""
+        company_id = ObjectId(company_id)
+        company = self.cache.get(company_id)
+        if company is None:
+            company = self.collection.find_one({'_id': company_id})
+            if not company:
+                return None
+            self.cache.set(company_id, company)
+        
+        # Callers may modify the result, so never hand out the cached dict
+        return dict(company)
+    
+    def invalidate_company(self, company_id):
+        """Drop a company (and the active company list) from the cache after it changes"""
+        self.cache.invalidate(ObjectId(company_id))
+        self.cache.invalidate(('geofences', ObjectId(company_id)))
+        self.cache.invalidate('active')
+    
+    def get_geofences(self, company_id):
+        """Compiled geofences of a company, cached so marks check them in-process"""
+        if not company_id:
+            return Geofences()
+        
+        key = ('geofences', ObjectId(company_id))
+        geofences = self.cache.get(key)
+        if geofences is None:
+            company = self.collection.find_one({'_id': ObjectId(company_id)}, {'geofences': 1, 'geofence_mode': 1})
+            geofences = compile_geofences(company)
+            self.cache.set(key, geofences)
+        return geofences
+    
+    def set_geofences(self, company_id, geofences, mode):
+        """Replace a company's geofences (already normalized) and enforcement mode"""
+        result = self.collection.update_one(
+            {'_id': ObjectId(company_id)},
+            {'$set': {'geofences': geofences, 'geofence_mode': mode}}
+        )
+        self.invalidate_company(company_id)
+        return result
+    
+    def get_companies_by_ids(self, company_ids, projection=None):
+        """Get companies for a list of IDs in a single query, keyed by _id"""
+        ids = list({ObjectId(company_id) for company_id in company_ids if company_id})
+        if not ids:
+            return {}
+        
+        cursor = self.collection.find({'_id': {'$in': ids}}, projection or {'name': 1})
+        return {company['_id']: company for company in cursor}
     
     def get_all_companies(self):
         """Get all active companies"""
-        return list(self.collection.find({'is_active': True}))
+        companies = self.cache.get('active')
+        if companies is None:
+            companies = list(self.collection.find({'is_active': True}))
+            self.cache.set('active', companies)
+        
+        return [dict(company) for company in companies]
+
+class AttendanceStatsModel:
+    """Pre-aggregated attendance counts per (company, day) and (student, month)"""
+    
+    COMPANY_DAY = 'company_day'
+    STUDENT_MONTH = 'student_month'
+    
+    def __init__(self, db):
+        self.collection = db.attendance_daily_stats
+        self.attendance = db.attendance_records
+    
+    @classmethod
+    def _keys(cls, record):
+        """Stats documents a record counts towards"""
+        attendance_date = record.get('attendance_date') or record['timestamp'].strftime('%Y-%m-%d')
+        return [
+            (cls.COMPANY_DAY, record.get('company_id'), None, attendance_date),
+            (cls.STUDENT_MONTH, record.get('company_id'), record['student_id'], attendance_date[:7])
+        ]
+    
+    def _upsert_counts(self, counts):
+        """Add {(scope, company_id, student_id, period): {status: n}} to the stats in one bulk write"""
+        operations = []
+        for (scope, company_id, student_id, period), statuses in counts.items():
+            increments = {f'counts.{status}': n for status, n in statuses.items()}
+            increments['total'] = sum(statuses.values())
+            operations.append(UpdateOne(
+                {'scope': scope, 'company_id': company_id, 'student_id': student_id, 'period': period},
+                {'$inc': increments},
+                upsert=True
+            ))
+        
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+    
+    def record(self, records):
+        """Count newly inserted attendance records"""
+        counts = {}
+        for record in records:
+            for key in self._keys(record):
+                statuses = counts.setdefault(key, {})
+                statuses[record['status']] = statuses.get(record['status'], 0) + 1
+        
+        self._upsert_counts(counts)
+    
+    def rebuild(self, company_id=None, archived_rows=None):
+        """Recompute stats from the raw attendance records (all companies or one)
+        
+        archived_rows adds records moved out of MongoDB, as rows shaped like the
+        aggregation's (see AttendanceArchive.grouped_counts).
+        """
+        match = {'company_id': ObjectId(company_id)} if company_id else {}
+        self.collection.delete_many(match)
+        
+        pipeline = [
+            {'$match': match},
+            {'$project': {
+                'company_id': 1,
+                'student_id': 1,
+                'status': 1,
+                'date': {'$ifNull': [
+                    '$attendance_date',
+                    {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}}
+                ]}
+            }},
+            {'$group': {
+                '_id': {
+                    'company_id': '$company_id',
+                    'student_id': '$student_id',
+                    'date': '$date',
+                    'status': '$status'
+                },
+                'count': {'$sum': 1}
+            }}
+        ]
+        
+        # Grouped rows are per student/day/status, far fewer than raw records
+        counts = {}
+        rows = 0
+        for row in itertools.chain(self.attendance.aggregate(pipeline, allowDiskUse=True), archived_rows or []):
+            group = row['_id']
+            record = {
+                'company_id': group.get('company_id'),
+                'student_id': group['student_id'],
+                'attendance_date': group['date'],
+                'timestamp': None
+            }
+            for key in self._keys(record):
+                statuses = counts.setdefault(key, {})
+                statuses[group['status']] = statuses.get(group['status'], 0) + row['count']
+            
+            rows += 1
+            if len(counts) >= 10000:
+                self._upsert_counts(counts)
+                counts = {}
+        
+        self._upsert_counts(counts)
+        return rows
+    
+    def get_company_daily(self, company_id=None, date_from=None, date_to=None):
+        """Daily counts for one company (or all companies summed), oldest first"""
+        query = {'scope': self.COMPANY_DAY}
+        if company_id:
+            query['company_id'] = ObjectId(company_id)
+        if date_from or date_to:
+            query['period'] = {}
+            if date_from:
+                query['period']['$gte'] = date_from
+            if date_to:
+                query['period']['$lte'] = date_to
+        
+        return self._sum_by_period(self.collection.find(query).sort('period', 1))
+    
+    def get_student_monthly(self, student_id, month_from=None, month_to=None):
+        """Monthly counts for one student, oldest first"""
+        query = {'scope': self.STUDENT_MONTH, 'student_id': ObjectId(student_id)}
+        if month_from or month_to:
+            query['period'] = {}
+            if month_from:
+                query['period']['$gte'] = month_from
+            if month_to:
+                query['period']['$lte'] = month_to
+        
+        return self._sum_by_period(self.collection.find(query).sort('period', 1))
+    
+    @staticmethod
+    def _sum_by_period(stats):
+        periods = OrderedDict()
+        for stat in stats:
+            summary = periods.setdefault(stat['period'], {'period': stat['period'], 'counts': {}, 'total': 0})
+            for status, n in stat.get('counts', {}).items():
+                summary['counts'][status] = summary['counts'].get(status, 0) + n
+            summary['total'] += stat.get('total', 0)
+        return list(periods.values())
 
 class AttendanceModel:
     """Attendance model for handling attendance operations"""
     
-    def __init__(self, db):
+    def __init__(self, db, report_read_preference=None, archive=None):
         self.collection = db.attendance_records
+        # Closed months moved to Parquet (archive.AttendanceArchive); listings and exports include them
+        self.archive = archive
+        # Admin listing and export reads, which may be served by secondaries
+        self.report_collection = (
+            self.collection.with_options(read_preference=report_read_preference)
+            if report_read_preference else self.collection
+        )
+        self.companies = db.companies
+        self.company_timezones = {}
+        self.stats = AttendanceStatsModel(db)
+        # Called with the records of every successful insert (e.g. the in-process live feed)
+        self.insert_listeners = []
     
-    def mark_attendance(self, student_id, company_id, location, image_path, status="Present"):
-        """Mark attendance for a student"""
-        # Check if already marked today
-        today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        today_end = datetime.utcnow().replace(hour=23, minute=59, second=59, microsecond=999999)
+    def _after_insert(self, records):
+        # Stats can be rebuilt from the raw records, so never fail a mark over them
+        try:
+            self.stats.record(records)
+        except Exception as e:
+            print(f"Error updating attendance stats: {e}")
         
-        existing_record = self.collection.find_one({
-            'student_id': ObjectId(student_id),
-            'timestamp': {'$gte': today_start, '$lte': today_end}
-        })
+        for listener in self.insert_listeners:
+            try:
+                listener(records)
+            except Exception as e:
+                print(f"Error in attendance insert listener: {e}")
+    
+    def get_company_timezone(self, company_id):
+        """Get a company's timezone, cached for the life of the process"""
+        if not company_id:
+            return ZoneInfo(DEFAULT_TIMEZONE)
+        
+        company_id = ObjectId(company_id)
+        if company_id not in self.company_timezones:
+            company = self.companies.find_one({'_id': company_id}, {'timezone': 1})
+            self.company_timezones[company_id] = ZoneInfo((company or {}).get('timezone') or DEFAULT_TIMEZONE)
+        return self.company_timezones[company_id]
+    
+    def get_attendance_date(self, company_id, timestamp):
+        """Local calendar date (YYYY-MM-DD) of a naive UTC timestamp in the company's timezone"""
+        local_time = timestamp.replace(tzinfo=timezone.utc).astimezone(self.get_company_timezone(company_id))
+        return local_time.strftime('%Y-%m-%d')
+    
+    def mark_attendance(self, student_id, company_id, location, image, status="Present", attendance_id=None, geofence=None):
+        """Mark attendance for a student
+        
+        The unique (student_id, attendance_date) index enforces once per day,
+        so this is a single write and concurrent submissions cannot both succeed.
+        """
+        attendance_data = self.build_record(student_id, company_id, location, image, status, geofence=geofence)
+        if attendance_id:
+            attendance_data['_id'] = ObjectId(attendance_id)
         
-        if existing_record:
+        try:
+            result = self.collection.insert_one(attendance_data)
+        except DuplicateKeyError:
             return None, "Attendance already marked for today"
         
-        attendance_data = {
+        self._after_insert([attendance_data])
+        return str(result.inserted_id), None
+    
+    def build_record(self, student_id, company_id, location, image, status, timestamp=None, geofence=None):
+        """Build an attendance record document
+        
+        image is the reference returned by ImageStore.put_with_thumbnails, or
+        PENDING_IMAGE while the write-behind writer has not stored it yet.
+        Records created before the image store have an image_path instead.
+        location_geo is the same location as a GeoJSON point (2dsphere indexed);
+        geofence is the result of the company geofence check, if it has fences.
+        updated_at drives delta exports: any later change to exported fields must set it.
+        """
+        now = datetime.utcnow()
+        timestamp = timestamp or now
+        latitude, longitude = parse_location(location)
+        record = {
             'student_id': ObjectId(student_id),
             'company_id': ObjectId(company_id) if company_id else None,
-            'timestamp': datetime.utcnow(),
+            'timestamp': timestamp,
+            'attendance_date': self.get_attendance_date(company_id, timestamp),
             'location': {
-                'latitude': location.get('latitude'),
-                'longitude': location.get('longitude')
+                'latitude': latitude,
+                'longitude': longitude
             },
-            'image_path': image_path,
+            'location_geo': point(latitude, longitude),
+            'image': image,
             'status': status,
-            'created_at': datetime.utcnow()
+            'created_at': now,
+            'updated_at': now
         }
+        if geofence is not None:
+            record['geofence'] = geofence
+        return record
+    
+    def get_attendance_by_id(self, attendance_id):
+        """Get a single attendance record"""
+        return self.collection.find_one({'_id': ObjectId(attendance_id)})
+    
+    def get_archived_attendance(self, attendance_id, month, company_id=None):
+        """Get a single record from the archive partitions of its month (None without an archive)"""
+        if not self.archive or not self.archive.has_data():
+            return None
+        return self.archive.get_record(attendance_id, month, company_id)
+    
+    def set_image(self, attendance_id, image):
+        """Fill in the image reference of a record once the image is stored"""
+        return self.collection.update_one({'_id': ObjectId(attendance_id)}, {'$set': {'image': image}})
+    
+    def find_marked_days(self, student_days):
+        """Get the (student_id, attendance_date) pairs that already have attendance, in one query"""
+        student_ids = list({ObjectId(student_id) for student_id, _ in student_days})
+        dates = list({attendance_date for _, attendance_date in student_days})
+        if not student_ids:
+            return set()
         
-        result = self.collection.insert_one(attendance_data)
-        return str(result.inserted_id), None
+        cursor = self.collection.find({
+            'student_id': {'$in': student_ids},
+            'attendance_date': {'$in': dates}
+        }, {'student_id': 1, 'attendance_date': 1})
+        
+        return {(record['student_id'], record['attendance_date']) for record in cursor}
     
-    def get_attendance_records(self, filters=None, skip=0, limit=50):
-        """Get attendance records with optional filters"""
+    def insert_attendance_batch(self, records):
+        """Insert many attendance records with one unordered write
+        
+        Returns (attendance_id, error) for each record, in order.
+        """
+        if not records:
+            return []
+        
+        for record in records:
+            record.setdefault('_id', ObjectId())
+        results = [(str(record['_id']), None) for record in records]
+        
+        try:
+            self.collection.insert_many(records, ordered=False)
+        except BulkWriteError as e:
+            for write_error in e.details.get('writeErrors', []):
+                index = write_error['index']
+                if write_error.get('code') == 11000:
+                    results[index] = (None, "Attendance already marked for this day")
+                else:
+                    results[index] = (None, write_error.get('errmsg', 'Write failed'))
+        
+        self._after_insert([record for record, (_, error) in zip(records, results) if not error])
+        return results
+    
+    @staticmethod
+    def build_query(filters=None):
+        """Build a Mongo query from attendance filters"""
         query = {}
         
         if filters:
             if filters.get('student_id'):
                 query['student_id'] = ObjectId(filters['student_id'])
+            elif filters.get('student_ids'):
+                query['student_id'] = {'$in': [ObjectId(student_id) for student_id in filters['student_ids']]}
             if filters.get('company_id'):
                 query['company_id'] = ObjectId(filters['company_id'])
             if filters.get('date_from') and filters.get('date_to'):
@@ -126,64 +636,345 @@ class AttendanceModel:
                 }
             if filters.get('status'):
                 query['status'] = filters['status']
+            # region is a $geoWithin operand; only the inside match can use the 2dsphere index
+            if filters.get('region') and filters.get('outside_region'):
+                query['location_geo'] = {'$exists': True}
+                query['$nor'] = [{'location_geo': {'$geoWithin': filters['region']}}]
+            elif filters.get('region'):
+                query['location_geo'] = {'$geoWithin': filters['region']}
+        
+        return query
+    
+    def _reads(self, secondary_ok):
+        return self.report_collection if secondary_ok else self.collection
+    
+    def _archive_for(self, filters):
+        """The archive, when it has data and can evaluate these filters"""
+        if self.archive and self.archive.supports(filters) and self.archive.has_data():
+            return self.archive
+        return None
+    
+    def get_attendance_records(self, filters=None, skip=0, limit=50, secondary_ok=False):
+        """Get attendance records with optional filters"""
+        query = self.build_query(filters)
+        collection = self._reads(secondary_ok)
         
         # Get total count
-        total = self.collection.count_documents(query)
+        total = collection.count_documents(query)
         
         # Get records with pagination
-        records = list(self.collection.find(query)
+        records = list(collection.find(query)
                       .sort('timestamp', -1)
                       .skip(skip)
                       .limit(limit))
         
+        # Archived months are older than everything left in MongoDB, so their records follow
+        archive = self._archive_for(filters)
+        if archive:
+            if len(records) < limit:
+                records += archive.iter_records(filters, skip=max(0, skip - total), limit=limit - len(records))
+            total += archive.count(filters)
+        
         return records, total
     
-    def get_student_attendance(self, student_id, skip=0, limit=50):
-        """Get attendance records for a specific student"""
-        query = {'student_id': ObjectId(student_id)}
+    @staticmethod
+    def encode_cursor(record):
+        """Opaque pagination cursor for the position just after a record"""
+        position = json.dumps({'t': record['timestamp'].isoformat(), 'id': str(record['_id'])})
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode a pagination cursor to (timestamp, _id), raising ValueError if invalid"""
+        try:
+            position = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            return datetime.fromisoformat(position['t']), ObjectId(position['id'])
+        except Exception:
+            raise ValueError("Invalid cursor")
+    
+    def get_attendance_page(self, filters=None, cursor=None, limit=50, include_total=False, secondary_ok=False):
+        """Get a page of attendance records using keyset pagination on (timestamp, _id)
         
-        total = self.collection.count_documents(query)
-        records = list(self.collection.find(query)
-                      .sort('timestamp', -1)
-                      .skip(skip)
-                      .limit(limit))
+        Every page costs the same as the first one. Returns (records, next_cursor, total);
+        next_cursor is None on the last page and total is None unless requested.
+        """
+        query = self.build_query(filters)
+        collection = self._reads(secondary_ok)
+        total = collection.count_documents(query) if include_total else None
         
-        return records, total
+        if cursor:
+            timestamp, record_id = self.decode_cursor(cursor)
+            after_cursor = {'$or': [
+                {'timestamp': {'$lt': timestamp}},
+                {'timestamp': timestamp, '_id': {'$lt': record_id}}
+            ]}
+            query = {'$and': [query, after_cursor]} if query else after_cursor
+        
+        # Fetch one extra record to know whether another page exists
+        records = list(collection.find(query)
+                      .sort([('timestamp', -1), ('_id', -1)])
+                      .limit(limit + 1))
+        
+        archive = self._archive_for(filters)
+        if archive and len(records) <= limit:
+            before = self.decode_cursor(cursor) if cursor else None
+            archived = archive.iter_records(filters, before=before, limit=limit + 1 - len(records))
+            records = list(merge_newest_first(records, archived))
+            if include_total:
+                total += archive.count(filters)
+        
+        next_cursor = None
+        if len(records) > limit:
+            records = records[:limit]
+            next_cursor = self.encode_cursor(records[-1])
+        
+        return records, next_cursor, total
+    
+    @staticmethod
+    def encode_watermark(record):
+        """Opaque delta export watermark for the position of a record in (updated_at, _id) order"""
+        position = json.dumps({'u': record['updated_at'].isoformat(), 'id': str(record['_id'])})
+        return base64.urlsafe_b64encode(position.encode()).decode().rstrip('=')
+    
+    @staticmethod
+    def decode_watermark(watermark):
+        """Decode a watermark to (updated_at, _id), raising ValueError if invalid"""
+        try:
+            position = json.loads(base64.urlsafe_b64decode(watermark + '=' * (-len(watermark) % 4)))
+            return datetime.fromisoformat(position['u']), ObjectId(position['id'])
+        except Exception:
+            raise ValueError("Invalid watermark")
+    
+    @staticmethod
+    def _delta_query(filters=None, since=None, until=None, cutoff=None):
+        clauses = [AttendanceModel.build_query(filters)]
+        if since:
+            updated_at, record_id = since
+            clauses.append({'$or': [
+                {'updated_at': {'$gt': updated_at}},
+                {'updated_at': updated_at, '_id': {'$gt': record_id}}
+            ]})
+        if until:
+            updated_at, record_id = until
+            clauses.append({'$or': [
+                {'updated_at': {'$lt': updated_at}},
+                {'updated_at': updated_at, '_id': {'$lte': record_id}}
+            ]})
+        if cutoff:
+            clauses.append({'updated_at': {'$lte': cutoff}})
+        return {'$and': clauses}
+    
+    def get_delta_end(self, filters=None, since=None, limit=10000, settle_seconds=60):
+        """Last record a delta export after since should include, and whether more follow
+        
+        Records changed in the last settle_seconds are left for the next sync, so
+        writes still in flight (or from servers with skewed clocks) are not skipped.
+        Returns (record with _id and updated_at, or None when nothing changed, has_more).
+        Delta reads always use the primary, so a lagging secondary cannot skip records.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=settle_seconds)
+        query = self._delta_query(filters, since=since, cutoff=cutoff)
+        
+        # The limit-th record ends this export; one more means another call is needed
+        page = list(self.collection.find(query, {'updated_at': 1})
+                    .sort([('updated_at', 1), ('_id', 1)])
+                    .skip(limit - 1)
+                    .limit(2))
+        if page:
+            return page[0], len(page) > 1
+        
+        last = list(self.collection.find(query, {'updated_at': 1})
+                    .sort([('updated_at', -1), ('_id', -1)])
+                    .limit(1))
+        return (last[0] if last else None), False
+    
+    def iter_delta_records(self, filters=None, since=None, until=None, batch_size=1000):
+        """Iterate over records changed after since, up to and including until, in (updated_at, _id) order"""
+        return (self.collection.find(self._delta_query(filters, since=since, until=until), {'image': 0, 'location_geo': 0})
+                .sort([('updated_at', 1), ('_id', 1)])
+                .batch_size(batch_size))
+    
+    def iter_attendance_records(self, filters=None, batch_size=1000, secondary_ok=False):
+        """Iterate over all matching attendance records without loading them into memory"""
+        records = (self._reads(secondary_ok).find(self.build_query(filters))
+                   .sort([('timestamp', -1), ('_id', -1)])
+                   .batch_size(batch_size))
+        
+        archive = self._archive_for(filters)
+        if archive:
+            return merge_newest_first(records, archive.iter_records(filters))
+        return records
+    
+    def get_records_after(self, attendance_id, company_id=None, limit=100):
+        """Records inserted after a given record, oldest first (live feed catch-up)"""
+        query = {'_id': {'$gt': ObjectId(attendance_id)}}
+        if company_id:
+            query['company_id'] = ObjectId(company_id)
+        
+        return list(self.collection.find(query, {'image': 0, 'location_geo': 0})
+                    .sort('_id', 1)
+                    .limit(limit))
+    
+    def get_student_attendance(self, student_id, skip=0, limit=50, company_id=None):
+        """Get attendance records for a specific student
+        
+        Passing the student's company_id limits the archive to that company's partitions.
+        """
+        return self.get_attendance_records({'student_id': student_id, 'company_id': company_id}, skip=skip, limit=limit)
 
 class FaceRecognitionModel:
     """Face recognition utilities"""
     
+    # Decode JPEGs at 1/2, 1/4 or 1/8 scale (1 decodes at full size)
+    DECODE_REDUCTION = int(os.getenv('FACE_DECODE_REDUCTION', 2))
+    # Reduced decodes smaller than this fall back to a full-size decode
+    MIN_DECODE_SIDE = int(os.getenv('FACE_MIN_DECODE_SIDE', 640))
+    # Run face detection on a copy no larger than this (0 detects at decoded size)
+    DETECT_MAX_SIDE = int(os.getenv('FACE_DETECT_MAX_SIDE', 640))
+    # Padding kept around the detected face when cropping for the embedding
+    CROP_MARGIN = 0.25
+    
+    REDUCED_DECODE_FLAGS = {
+        2: 'IMREAD_REDUCED_COLOR_2',
+        4: 'IMREAD_REDUCED_COLOR_4',
+        8: 'IMREAD_REDUCED_COLOR_8'
+    }
+    
+    @staticmethod
+    def preload():
+        """Import OpenCV and face_recognition (loading the dlib models) ahead of the first job
+        
+        They are imported lazily so web processes that never run face work stay
+        small and start fast; face worker processes call this when they start.
+        """
+        for module in ('cv2', 'face_recognition'):
+            importlib.import_module(module)
+    
     @staticmethod
-    def extract_face_encoding(image_data):
-        """Extract face encoding from image data"""
+    def decode_base64_image(image_data):
+        """Decode a base64 (optionally data URL) image to raw bytes; raw bytes pass through"""
+        if isinstance(image_data, bytes):
+            return image_data
+        
+        if isinstance(image_data, str) and image_data.startswith('data:image'):
+            # Remove data URL prefix
+            image_data = image_data.split(',')[1]
+        
+        return base64.b64decode(image_data)
+    
+    @classmethod
+    def decode_image(cls, image_bytes):
+        """Decode image bytes to a BGR array, at reduced scale when configured"""
+        import cv2
+        
+        nparr = np.frombuffer(image_bytes, np.uint8)
+        
+        flag = cls.REDUCED_DECODE_FLAGS.get(cls.DECODE_REDUCTION)
+        if flag is not None:
+            image = cv2.imdecode(nparr, getattr(cv2, flag))
+            if image is not None and max(image.shape[:2]) >= cls.MIN_DECODE_SIDE:
+                return image
+        
+        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    
+    @classmethod
+    def detect_face(cls, image):
+        """Locate the largest face as (top, right, bottom, left) in image coordinates"""
+        import cv2
+        import face_recognition
+        
+        height, width = image.shape[:2]
+        scale = 1.0
+        if cls.DETECT_MAX_SIDE and max(height, width) > cls.DETECT_MAX_SIDE:
+            scale = cls.DETECT_MAX_SIDE / max(height, width)
+        
+        if scale < 1.0:
+            small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        else:
+            small = image
+        
+        # Convert BGR to RGB (OpenCV uses BGR, face_recognition uses RGB)
+        locations = face_recognition.face_locations(cv2.cvtColor(small, cv2.COLOR_BGR2RGB))
+        if not locations:
+            return None
+        
+        top, right, bottom, left = max(locations, key=lambda box: (box[2] - box[0]) * (box[1] - box[3]))
+        return (
+            max(int(top / scale), 0),
+            min(int(right / scale), width),
+            min(int(bottom / scale), height),
+            max(int(left / scale), 0)
+        )
+    
+    @classmethod
+    def encode_face(cls, image, location):
+        """Compute the embedding on a crop around the detected face only"""
+        import cv2
+        import face_recognition
+        
+        height, width = image.shape[:2]
+        top, right, bottom, left = location
+        margin_y = int((bottom - top) * cls.CROP_MARGIN)
+        margin_x = int((right - left) * cls.CROP_MARGIN)
+        
+        crop_top = max(top - margin_y, 0)
+        crop_left = max(left - margin_x, 0)
+        crop = image[crop_top:min(bottom + margin_y, height), crop_left:min(right + margin_x, width)]
+        
+        face_location = (top - crop_top, right - crop_left, bottom - crop_top, left - crop_left)
+        encodings = face_recognition.face_encodings(
+            cv2.cvtColor(crop, cv2.COLOR_BGR2RGB),
+            known_face_locations=[face_location]
+        )
+        return encodings[0] if encodings else None
+    
+    @classmethod
+    def extract_face_encoding(cls, image_data, timings=None):
+        """Extract face encoding from image data (base64 string or raw bytes)
+        
+        If a timings dict is given, per-stage latencies in seconds are added to it.
+        """
         try:
-            # Convert base64 to image
-            if isinstance(image_data, str) and image_data.startswith('data:image'):
-                # Remove data URL prefix
-                image_data = image_data.split(',')[1]
+            stage_start = time.perf_counter()
+            
+            def record(stage):
+                nonlocal stage_start
+                now = time.perf_counter()
+                if timings is not None:
+                    timings[stage] = now - stage_start
+                stage_start = now
             
-            # Decode base64
-            import base64
-            image_bytes = base64.b64decode(image_data)
+            image_bytes = cls.decode_base64_image(image_data)
+            record('base64')
             
-            # Convert to numpy array
-            nparr = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            image = cls.decode_image(image_bytes)
+            if image is None:
+                return None, "Could not decode image"
+            record('decode')
             
-            # Convert BGR to RGB (OpenCV uses BGR, face_recognition uses RGB)
-            rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            location = cls.detect_face(image)
+            record('detect')
+            if location is None:
+                return None, "No face detected in image"
             
-            # Get face encodings
-            face_encodings = face_recognition.face_encodings(rgb_image)
+            face_encoding = cls.encode_face(image, location)
+            record('embed')
             
-            if len(face_encodings) > 0:
-                return face_encodings[0], None
+            if face_encoding is not None:
+                return face_encoding, None
             else:
                 return None, "No face detected in image"
                 
         except Exception as e:
             return None, f"Error processing image: {str(e)}"
     
+    @classmethod
+    def extract_face_encoding_timed(cls, image_data):
+        """extract_face_encoding that also returns its per-stage timings, for use in worker processes"""
+        timings = {}
+        face_encoding, error = cls.extract_face_encoding(image_data, timings=timings)
+        return face_encoding, error, timings
+    
     @staticmethod
     def compare_faces(known_encoding, unknown_encoding, tolerance=0.6):
         """Compare two face encodings"""
@@ -191,16 +982,162 @@ class FaceRecognitionModel:
             return False
         
         try:
-            # Convert lists back to numpy arrays if needed
-            if isinstance(known_encoding, list):
-                known_encoding = np.array(known_encoding)
-            if isinstance(unknown_encoding, list):
-                unknown_encoding = np.array(unknown_encoding)
+            # Stored encodings may be Binary (or legacy lists)
+            known_encoding = decode_face_encoding(known_encoding)
+            unknown_encoding = decode_face_encoding(unknown_encoding)
             
-            # Compare faces
-            results = face_recognition.compare_faces([known_encoding], unknown_encoding, tolerance=tolerance)
-            return results[0] if results else False
+            # Same Euclidean distance test as face_recognition.compare_faces, without loading dlib
+            return bool(np.linalg.norm(known_encoding - unknown_encoding) <= tolerance)
             
         except Exception as e:
             print(f"Error comparing faces: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+class FaceIdentificationIndex:
+    """In-memory 1:N face identification index partitioned by company
+    
+    Each serving process has its own copy. Registrations, face updates and
+    deactivations made by other processes are picked up from the users'
+    updated_at at most every FACE_INDEX_REFRESH_SECONDS.
+    """
+    
+    ENCODING_SIZE = 128
+    # Changes are re-read this far behind the watermark, covering clock skew between nodes
+    REFRESH_OVERLAP = timedelta(seconds=60)
+    
+    def __init__(self, initial_capacity=64, refresh_seconds=None):
+        self.initial_capacity = initial_capacity
+        self.refresh_seconds = float(os.getenv('FACE_INDEX_REFRESH_SECONDS', 5)) if refresh_seconds is None else refresh_seconds
+        self.partitions = {}  # company key -> partition dict
+        self.user_partition = {}  # user id -> company key
+        self.loaded = False
+        self.watermark = None  # users changed at or after this are re-read on refresh
+        self.refreshed_at = 0
+        self.lock = threading.RLock()
+    
+    @staticmethod
+    def _company_key(company_id):
+        return str(company_id) if company_id else None
+    
+    def _new_partition(self):
+        return {
+            'encodings': np.zeros((self.initial_capacity, self.ENCODING_SIZE), dtype=np.float32),
+            'sq_norms': np.zeros(self.initial_capacity, dtype=np.float32),
+            'user_ids': [],
+            'rows': {}  # user id -> row number
+        }
+    
+    def load(self, user_model):
+        """Build the index from every active user with a face encoding"""
+        with self.lock:
+            started = datetime.utcnow()
+            self.partitions = {}
+            self.user_partition = {}
+            for user in user_model.iter_face_encodings():
+                self._upsert(str(user['_id']), user.get('company_id'), user['face_encoding'])
+            self.watermark = started - self.REFRESH_OVERLAP
+            self.refreshed_at = time.monotonic()
+            self.loaded = True
+    
+    def ensure_loaded(self, user_model):
+        """Load the index on first use, then keep it in step with the users collection"""
+        if not self.loaded:
+            with self.lock:
+                if not self.loaded:
+                    self.load(user_model)
+        elif time.monotonic() - self.refreshed_at >= self.refresh_seconds:
+            self.refresh(user_model)
+    
+    def refresh(self, user_model):
+        """Apply users changed since the watermark (idempotent, so overlapping reads are harmless)"""
+        with self.lock:
+            if time.monotonic() - self.refreshed_at < self.refresh_seconds:
+                return
+            self.refreshed_at = time.monotonic()
+            started = datetime.utcnow()
+            for user in user_model.iter_face_encoding_changes(self.watermark):
+                if user.get('is_active') and user['face_encoding'] is not None:
+                    self._upsert(str(user['_id']), user.get('company_id'), user['face_encoding'])
+                else:
+                    self._remove(str(user['_id']))
+            self.watermark = started - self.REFRESH_OVERLAP
+    
+    def upsert(self, user_id, company_id, face_encoding):
+        """Add or replace a user's encoding"""
+        with self.lock:
+            self._upsert(str(user_id), company_id, face_encoding)
+    
+    def _upsert(self, user_id, company_id, face_encoding):
+        key = self._company_key(company_id)
+        if self.user_partition.get(user_id, key) != key:
+            self._remove(user_id)
+        
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions[key] = self._new_partition()
+        
+        row = partition['rows'].get(user_id)
+        if row is None:
+            row = len(partition['user_ids'])
+            if row == len(partition['encodings']):
+                # Grow geometrically so appends stay amortized O(1)
+                partition['encodings'] = np.concatenate([partition['encodings'], np.zeros_like(partition['encodings'])])
+                partition['sq_norms'] = np.concatenate([partition['sq_norms'], np.zeros_like(partition['sq_norms'])])
+            partition['user_ids'].append(user_id)
+            partition['rows'][user_id] = row
+        
+        encoding = np.asarray(face_encoding, dtype=np.float32)
+        partition['encodings'][row] = encoding
+        partition['sq_norms'][row] = np.dot(encoding, encoding)
+        self.user_partition[user_id] = key
+    
+    def remove(self, user_id):
+        """Remove a user's encoding from the index"""
+        with self.lock:
+            self._remove(str(user_id))
+    
+    def _remove(self, user_id):
+        key = self.user_partition.pop(user_id, None)
+        partition = self.partitions.get(key)
+        if partition is None or user_id not in partition['rows']:
+            return
+        
+        # Move the last row into the freed slot to keep the matrix dense
+        row = partition['rows'].pop(user_id)
+        last = len(partition['user_ids']) - 1
+        if row != last:
+            moved_user_id = partition['user_ids'][last]
+            partition['encodings'][row] = partition['encodings'][last]
+            partition['sq_norms'][row] = partition['sq_norms'][last]
+            partition['user_ids'][row] = moved_user_id
+            partition['rows'][moved_user_id] = row
+        partition['user_ids'].pop()
+    
+    def identify(self, face_encoding, company_id=None, top_k=5):
+        """Return the top_k closest users as (user_id, distance), searching all companies if none given"""
+        query = np.asarray(face_encoding, dtype=np.float32)
+        query_sq_norm = np.dot(query, query)
+        
+        with self.lock:
+            if company_id:
+                partitions = [self.partitions.get(self._company_key(company_id))]
+            else:
+                partitions = list(self.partitions.values())
+            
+            candidates = []
+            for partition in partitions:
+                if not partition or not partition['user_ids']:
+                    continue
+                
+                size = len(partition['user_ids'])
+                encodings = partition['encodings'][:size]
+                # ||a - b||^2 = ||a||^2 - 2 a.b + ||b||^2 as a single matrix-vector product
+                sq_distances = partition['sq_norms'][:size] - 2 * (encodings @ query) + query_sq_norm
+                distances = np.sqrt(np.maximum(sq_distances, 0))
+                
+                k = min(top_k, size)
+                nearest = np.argpartition(distances, k - 1)[:k]
+                candidates.extend((partition['user_ids'][i], float(distances[i])) for i in nearest)
+        
+        candidates.sort(key=lambda candidate: candidate[1])
+        return candidates[:top_k]
@@ -1,29 +1,260 @@
-from flask import Blueprint, request, jsonify, send_file
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
+from flask_jwt_extended import get_jwt, get_jwt_identity, get_jwt_request_location
+from authorization import create_user_token, get_current_user, role_required
 from bson import ObjectId
-import base64
+from face_worker import FaceWorkerUnavailable
+from geofence import compile_fence, normalize_geofence, parse_location
+from metrics import record_exception, time_stage
+from image_store import THUMBNAIL_FORMATS
+from models import PENDING_IMAGE
+import csv
+import io
+import json
 import os
-from datetime import datetime
-from werkzeug.utils import secure_filename
-import uuid
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
 
-def create_attendance_routes(app, db, user_model, attendance_model, face_model):
+EXPORT_COLUMNS = ['Student Name', 'Company', 'Date', 'Time', 'Status', 'Latitude', 'Longitude']
+DELTA_EXPORT_COLUMNS = [
+    'ID', 'Student ID', 'Student Name', 'Company ID', 'Company', 'Date', 'Timestamp',
+    'Status', 'Latitude', 'Longitude', 'Updated At'
+]
+DELTA_EXPORT_MAX_LIMIT = 100000
+# Records changed more recently than this are left for the next sync
+DELTA_EXPORT_SETTLE_SECONDS = int(os.getenv('DELTA_EXPORT_SETTLE_SECONDS', 60))
+EXPORT_BATCH_SIZE = 1000
+EXPORT_NAME_CACHE_SIZE = 50000
+MAX_BATCH_ENTRIES = 100
+MAX_OFFLINE_DAYS = 7
+MAX_STUDENT_NAME_MATCHES = 500
+CLIENT_CLOCK_SKEW = timedelta(minutes=5)
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+LIVE_FEED_RETRY_MS = 5000
+LIVE_FEED_KEEPALIVE = 15
+LIVE_FEED_REPLAY_LIMIT = 500
+# Lifetime of the query string tokens EventSource clients connect with (checked on connect only)
+LIVE_TOKEN_EXPIRES = int(os.getenv('LIVE_TOKEN_EXPIRES', 60))
+# Live connections are closed (and re-authenticated on reconnect) after this long
+LIVE_FEED_MAX_SECONDS = int(os.getenv('LIVE_FEED_MAX_SECONDS', 600))
+
+def parse_client_timestamp(value, now):
+    """Parse an ISO client timestamp to naive UTC, rejecting values too far from now"""
+    if not value:
+        return now, None
+    
+    try:
+        timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None, 'Invalid client_timestamp. Use ISO 8601'
+    
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    if timestamp > now + CLIENT_CLOCK_SKEW:
+        return None, 'client_timestamp is in the future'
+    if timestamp < now - timedelta(days=MAX_OFFLINE_DAYS):
+        return None, f'client_timestamp is older than {MAX_OFFLINE_DAYS} days'
+    
+    return min(timestamp, now), None
+
+def parse_date_range(args):
+    """Inclusive date_from / date_to filters from query args (both or neither), as (filters, error)"""
+    date_from = args.get('date_from')
+    date_to = args.get('date_to')
+    if not (date_from and date_to):
+        return {}, None
+    
+    try:
+        # Add time to make it inclusive
+        date_from = datetime.fromisoformat(date_from).replace(hour=0, minute=0, second=0)
+        date_to = datetime.fromisoformat(date_to).replace(hour=23, minute=59, second=59)
+    except ValueError:
+        return None, 'Invalid date format. Use YYYY-MM-DD'
+    
+    return {'date_from': date_from.isoformat(), 'date_to': date_to.isoformat()}, None
+
+def iter_ndjson_chunks(rows, rows_per_chunk=EXPORT_BATCH_SIZE):
+    """Encode export rows (dicts) as newline-delimited JSON, one chunk per batch of rows"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) >= rows_per_chunk:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def export_row(record, student_name, company_name):
+    """Row of the full export"""
+    location = record.get('location') or {}
+    return [
+        student_name,
+        company_name,
+        record['timestamp'].strftime('%Y-%m-%d'),
+        record['timestamp'].strftime('%H:%M:%S'),
+        record['status'],
+        location.get('latitude', ''),
+        location.get('longitude', '')
+    ]
+
+def delta_export_row(record, student_name, company_name):
+    """Row of the delta export, keyed by record ID so partners can upsert"""
+    location = record.get('location') or {}
+    return {
+        'id': str(record['_id']),
+        'student_id': str(record['student_id']),
+        'student_name': student_name,
+        'company_id': str(record['company_id']) if record.get('company_id') else None,
+        'company': company_name,
+        'date': record.get('attendance_date') or record['timestamp'].strftime('%Y-%m-%d'),
+        'timestamp': record['timestamp'].isoformat(),
+        'status': record['status'],
+        'latitude': location.get('latitude'),
+        'longitude': location.get('longitude'),
+        'updated_at': record['updated_at'].isoformat()
+    }
+
+def thumbnail_url(record):
+    """Thumbnail URL of a record's selfie; archived records also carry their partition month"""
+    url = f"/api/attendance/image/{record['_id']}?size=thumbnail"
+    if record.get('archived'):
+        url += f"&archived={record['timestamp'].strftime('%Y-%m')}"
+    return url
+
+def format_sse(event):
+    """Encode a live feed event as a server-sent event"""
+    return f"id: {event['id']}\nevent: attendance\ndata: {json.dumps(event)}\n\n"
+
+def iter_csv_chunks(rows, rows_per_chunk=EXPORT_BATCH_SIZE, columns=EXPORT_COLUMNS):
+    """Encode export rows as CSV, yielding one chunk per batch of rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % rows_per_chunk == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    yield buffer.getvalue()
+
+def create_attendance_routes(app, db, user_model, company_model, attendance_model, face_model, face_pool, face_index, image_store, image_writer, live_feed):
     attendance_bp = Blueprint('attendance', __name__, url_prefix='/api/attendance')
     
+    def resolve_students_and_companies(records):
+        """Fetch students and companies referenced by records in one query per collection"""
+        students = user_model.get_users_by_ids(record['student_id'] for record in records)
+        companies = company_model.get_companies_by_ids(record.get('company_id') for record in records)
+        return students, companies
+    
+    def format_admin_records(records):
+        """Format records for admin listings, with student and company info for the whole page"""
+        students, companies = resolve_students_and_companies(records)
+        
+        formatted_records = []
+        for record in records:
+            student = students.get(record['student_id'])
+            company = companies.get(record.get('company_id'))
+            
+            formatted_record = {
+                'id': str(record['_id']),
+                'student': {
+                    'id': str(student['_id']) if student else None,
+                    'username': student['username'] if student else 'Unknown'
+                },
+                'company': {
+                    'id': str(company['_id']) if company else None,
+                    'name': company['name'] if company else 'Unknown'
+                } if company else None,
+                'timestamp': record['timestamp'].isoformat(),
+                'status': record['status'],
+                'location': record['location'],
+                'geofence': record.get('geofence'),
+                'date': record['timestamp'].strftime('%Y-%m-%d'),
+                'time': record['timestamp'].strftime('%H:%M:%S'),
+                'thumbnail_url': thumbnail_url(record)
+                if record.get('image') or record.get('image_path') else None
+            }
+            formatted_records.append(formatted_record)
+        
+        return formatted_records
+    
+    def check_geofence(company_id, location):
+        """Check a validated location against the company's cached geofences
+        
+        Returns (geofence, rejected): the result stored on the record (None when the
+        company has no fences) and whether the company's mode rejects the location.
+        """
+        with time_stage('geofence'):
+            geofences = company_model.get_geofences(company_id)
+            if not geofences:
+                return None, False
+            fence = geofences.match(*parse_location(location))
+        
+        geofence = {'inside': fence is not None, 'fence_id': fence.id if fence else None}
+        return geofence, fence is None and geofences.mode == 'enforce'
+    
+    def iter_export_rows(records, make_row=export_row):
+        """Turn a record cursor into export rows, resolving names in cached batches"""
+        student_names = {}
+        company_names = {}
+        
+        def resolve_names(batch):
+            # Keep the name caches bounded for very large exports
+            if len(student_names) > EXPORT_NAME_CACHE_SIZE:
+                student_names.clear()
+            if len(company_names) > EXPORT_NAME_CACHE_SIZE:
+                company_names.clear()
+            
+            missing_students = {record['student_id'] for record in batch} - student_names.keys()
+            if missing_students:
+                found = user_model.get_users_by_ids(missing_students, {'username': 1})
+                for student_id in missing_students:
+                    student = found.get(student_id)
+                    student_names[student_id] = student['username'] if student else 'Unknown'
+            
+            missing_companies = {record.get('company_id') for record in batch} - company_names.keys() - {None}
+            if missing_companies:
+                found = company_model.get_companies_by_ids(missing_companies)
+                for company_id in missing_companies:
+                    company = found.get(company_id)
+                    company_names[company_id] = company['name'] if company else 'Unknown'
+        
+        def format_batch(batch):
+            resolve_names(batch)
+            for record in batch:
+                yield make_row(
+                    record,
+                    student_names[record['student_id']],
+                    company_names.get(record.get('company_id'), 'Unknown')
+                )
+        
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= EXPORT_BATCH_SIZE:
+                yield from format_batch(batch)
+                batch = []
+        
+        if batch:
+            yield from format_batch(batch)
+    
     @attendance_bp.route('/mark', methods=['POST'])
-    @jwt_required()
+    @role_required(['student'], 'Only students can mark attendance')
     def mark_attendance():
         """Mark attendance for current user"""
         try:
             current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
+            # The stored face encoding is needed, so this lookup cannot come from the token
+            user = user_model.get_user_by_id(current_user_id, with_face_encoding=True)
             
             if not user:
                 return jsonify({'error': 'User not found'}), 404
             
-            if user['role'] != 'student':
-                return jsonify({'error': 'Only students can mark attendance'}), 403
-            
             data = request.get_json()
             selfie_image = data.get('selfie_image')  # Base64 encoded
             location = data.get('location')  # {latitude: float, longitude: float}
@@ -31,21 +262,35 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
             if not selfie_image:
                 return jsonify({'error': 'Selfie image is required'}), 400
             
-            if not location or not location.get('latitude') or not location.get('longitude'):
-                return jsonify({'error': 'Location coordinates are required'}), 400
+            try:
+                parse_location(location)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            # Checked before any face work, so off-site marks are rejected cheaply
+            geofence, rejected = check_geofence(user.get('company_id'), location)
+            if rejected:
+                return jsonify({'error': 'Your location is outside the permitted area'}), 403
+            
+            # Decode once; the bytes go to face verification and then to the image writer
+            try:
+                image_bytes = face_model.decode_base64_image(selfie_image)
+            except ValueError:
+                return jsonify({'error': 'Invalid selfie image data'}), 400
             
             # Extract face encoding from selfie
-            selfie_encoding, error = face_model.extract_face_encoding(selfie_image)
+            selfie_encoding, error = face_pool.extract_face_encoding(image_bytes)
             if error:
                 return jsonify({'error': f'Face processing error: {error}'}), 400
             
             # Compare with stored face encoding
             stored_encoding = user.get('face_encoding')
-            if not stored_encoding:
+            if stored_encoding is None:
                 return jsonify({'error': 'No registered face found. Please register your face first.'}), 400
             
             # Verify face match
-            is_match = face_model.compare_faces(stored_encoding, selfie_encoding)
+            with time_stage('compare'):
+                is_match = face_model.compare_faces(stored_encoding, selfie_encoding)
             
             if not is_match:
                 # Still save the record but mark as rejected
@@ -53,71 +298,302 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
             else:
                 status = "Present"
             
-            # Save selfie image
-            image_filename = f"selfie_{current_user_id}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}.jpg"
-            image_path = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-            
-            # Decode and save image
-            if selfie_image.startswith('data:image'):
-                selfie_image = selfie_image.split(',')[1]
-            
-            image_bytes = base64.b64decode(selfie_image)
-            with open(image_path, 'wb') as f:
-                f.write(image_bytes)
-            
-            # Mark attendance
-            attendance_id, error = attendance_model.mark_attendance(
-                student_id=current_user_id,
-                company_id=user.get('company_id'),
-                location=location,
-                image_path=image_path,
-                status=status
-            )
+            # Spool the selfie locally; the image store write happens in the background
+            record_id = ObjectId()
+            with time_stage('spool'):
+                image_writer.spool(record_id, image_bytes)
             
-            if error:
-                # Clean up the saved image if attendance marking failed
+            # Mark attendance with a pending image reference
+            with time_stage('db_insert'):
                 try:
-                    os.remove(image_path)
-                except:
-                    pass
+                    attendance_id, error = attendance_model.mark_attendance(
+                        student_id=current_user_id,
+                        company_id=user.get('company_id'),
+                        location=location,
+                        image=dict(PENDING_IMAGE),
+                        status=status,
+                        attendance_id=record_id,
+                        geofence=geofence
+                    )
+                except Exception:
+                    # No record to attach it to; recovery would otherwise persist it later
+                    image_writer.discard(record_id)
+                    raise
+            
+            if error:
+                image_writer.discard(record_id)
                 return jsonify({'error': error}), 400
             
+            image_writer.enqueue(record_id)
+            
             return jsonify({
                 'message': 'Attendance marked successfully',
                 'attendance_id': attendance_id,
                 'status': status,
                 'face_match': is_match,
+                'geofence': geofence,
                 'timestamp': datetime.utcnow().isoformat()
             }), 201
             
+        except FaceWorkerUnavailable as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
         except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/mark-batch', methods=['POST'])
+    @role_required(['student', 'company_admin', 'faculty_admin'])
+    def mark_attendance_batch():
+        """Mark many attendance entries at once (kiosks and offline sync)
+        
+        Students may only submit entries for themselves; admins may submit
+        entries for students of their company (any company for faculty admins).
+        """
+        try:
+            user = get_current_user()
+            current_user_id = str(user['_id'])
+            
+            data = request.get_json()
+            entries = data.get('entries')
+            
+            if not isinstance(entries, list) or not entries:
+                return jsonify({'error': 'A non-empty list of entries is required'}), 400
+            
+            if len(entries) > MAX_BATCH_ENTRIES:
+                return jsonify({'error': f'At most {MAX_BATCH_ENTRIES} entries can be submitted at once'}), 400
+            
+            now = datetime.utcnow()
+            results = [None] * len(entries)
+            pending = []  # (index, student_id, timestamp) for entries that passed validation
+            
+            for index, entry in enumerate(entries):
+                if not isinstance(entry, dict):
+                    results[index] = {'status': 'error', 'error': 'Invalid entry'}
+                    continue
+                student_id = current_user_id if user['role'] == 'student' else entry.get('student_id')
+                try:
+                    parse_location(entry.get('location'))
+                    location_error = None
+                except ValueError as e:
+                    location_error = str(e)
+                
+                if user['role'] == 'student' and entry.get('student_id') not in (None, current_user_id):
+                    results[index] = {'status': 'error', 'error': 'Students can only mark their own attendance'}
+                elif not student_id or not ObjectId.is_valid(student_id):
+                    results[index] = {'status': 'error', 'error': 'Valid student_id is required'}
+                elif not entry.get('selfie_image'):
+                    results[index] = {'status': 'error', 'error': 'Selfie image is required'}
+                elif location_error:
+                    results[index] = {'status': 'error', 'error': location_error}
+                else:
+                    timestamp, error = parse_client_timestamp(entry.get('client_timestamp'), now)
+                    if error:
+                        results[index] = {'status': 'error', 'error': error}
+                    else:
+                        pending.append((index, student_id, timestamp))
+            
+            # Resolve all students with one query
+            students = user_model.get_users_by_ids(
+                (student_id for _, student_id, _ in pending),
+                {'role': 1, 'company_id': 1, 'face_encoding': 1, 'is_active': 1}
+            )
+            
+            # Dedupe against existing same-day records with one query; same-day entries
+            # within the batch are deduped once their faces have been verified
+            entry_days = {}
+            for index, student_id, timestamp in pending:
+                student = students.get(ObjectId(student_id))
+                if student:
+                    entry_days[index] = (
+                        student['_id'],
+                        attendance_model.get_attendance_date(student.get('company_id'), timestamp)
+                    )
+            marked_days = attendance_model.find_marked_days(entry_days.values())
+            
+            to_verify = []
+            for index, student_id, timestamp in pending:
+                student = students.get(ObjectId(student_id))
+                day = entry_days.get(index)
+                
+                if not student or student['role'] != 'student' or not student.get('is_active'):
+                    results[index] = {'status': 'error', 'error': 'Student not found'}
+                elif user['role'] == 'company_admin' and student.get('company_id') != user['company_id']:
+                    results[index] = {'status': 'error', 'error': 'Access denied'}
+                elif not student.get('face_encoding'):
+                    results[index] = {'status': 'error', 'error': 'No registered face found'}
+                elif day in marked_days:
+                    results[index] = {'status': 'duplicate', 'error': 'Attendance already marked for this day'}
+                else:
+                    geofence, rejected = check_geofence(student.get('company_id'), entries[index]['location'])
+                    if rejected:
+                        results[index] = {'status': 'error', 'error': 'Location is outside the permitted area'}
+                        continue
+                    try:
+                        image_bytes = face_model.decode_base64_image(entries[index]['selfie_image'])
+                    except ValueError:
+                        results[index] = {'status': 'error', 'error': 'Invalid selfie image data'}
+                        continue
+                    to_verify.append((index, student, timestamp, image_bytes, geofence, day))
+            
+            # Run face verification for all remaining entries in parallel
+            encodings = face_pool.extract_face_encodings(
+                [image_bytes for _, _, _, image_bytes, _, _ in to_verify]
+            )
+            
+            # Keep one verified entry per student and day, preferring a face match,
+            # so an entry that failed verification never displaces a valid one
+            verified = {}
+            for (index, student, timestamp, image_bytes, geofence, day), outcome in zip(to_verify, encodings):
+                if isinstance(outcome, FaceWorkerUnavailable):
+                    results[index] = {'status': 'error', 'error': str(outcome), 'retryable': True}
+                    continue
+                
+                selfie_encoding, error = outcome
+                if error:
+                    results[index] = {'status': 'error', 'error': f'Face processing error: {error}'}
+                    continue
+                
+                is_match = face_model.compare_faces(student['face_encoding'], selfie_encoding)
+                candidate = (index, student, timestamp, image_bytes, geofence, is_match)
+                kept = verified.get(day)
+                if kept is None or (is_match and not kept[-1]):
+                    if kept is not None:
+                        results[kept[0]] = {'status': 'duplicate', 'error': 'Attendance already marked for this day'}
+                    verified[day] = candidate
+                else:
+                    results[index] = {'status': 'duplicate', 'error': 'Attendance already marked for this day'}
+            
+            records = []
+            record_indexes = []
+            for index, student, timestamp, image_bytes, geofence, is_match in sorted(verified.values(), key=lambda c: c[0]):
+                record = attendance_model.build_record(
+                    student_id=student['_id'],
+                    company_id=student.get('company_id'),
+                    location=entries[index]['location'],
+                    image=dict(PENDING_IMAGE),
+                    status="Present" if is_match else "Rejected",
+                    timestamp=timestamp,
+                    geofence=geofence
+                )
+                record['_id'] = ObjectId()
+                image_writer.spool(record['_id'], image_bytes)
+                records.append(record)
+                record_indexes.append((index, is_match))
+            
+            # Single unordered write for every accepted entry
+            try:
+                inserted = attendance_model.insert_attendance_batch(records)
+            except Exception:
+                for record in records:
+                    image_writer.discard(record['_id'])
+                raise
+            
+            for (index, is_match), record, (attendance_id, error) in zip(record_indexes, records, inserted):
+                if error:
+                    image_writer.discard(record['_id'])
+                    results[index] = {'status': 'duplicate', 'error': error}
+                else:
+                    image_writer.enqueue(record['_id'])
+                    results[index] = {
+                        'status': record['status'],
+                        'attendance_id': attendance_id,
+                        'face_match': is_match,
+                        'timestamp': record['timestamp'].isoformat()
+                    }
+            
+            for index, result in enumerate(results):
+                result['index'] = index
+            
+            return jsonify({'results': results}), 200
+            
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/identify', methods=['POST'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def identify_face():
+        """Identify a selfie against all enrolled students (kiosk check-in, admin only)"""
+        try:
+            user = get_current_user()
+            
+            data = request.get_json()
+            selfie_image = data.get('selfie_image')  # Base64 encoded
+            top_k = min(int(data.get('top_k', 5)), 50)
+            tolerance = float(data.get('tolerance', 0.6))
+            
+            if not selfie_image:
+                return jsonify({'error': 'Selfie image is required'}), 400
+            if top_k < 1:
+                return jsonify({'error': 'top_k must be at least 1'}), 400
+            
+            # Company admins can only identify within their company
+            company_id = data.get('company_id')
+            if user['role'] == 'company_admin':
+                company_id = user['company_id']
+            
+            selfie_encoding, error = face_pool.extract_face_encoding(selfie_image)
+            if error:
+                return jsonify({'error': f'Face processing error: {error}'}), 400
+            
+            face_index.ensure_loaded(user_model)
+            matches = face_index.identify(selfie_encoding, company_id=company_id, top_k=top_k)
+            students = user_model.get_users_by_ids(user_id for user_id, _ in matches)
+            
+            candidates = []
+            for user_id, distance in matches:
+                student = students.get(ObjectId(user_id))
+                candidates.append({
+                    'student': {
+                        'id': user_id,
+                        'username': student['username'] if student else 'Unknown'
+                    },
+                    'distance': distance,
+                    'is_match': distance <= tolerance
+                })
+            
+            return jsonify({'candidates': candidates}), 200
+            
+        except FaceWorkerUnavailable as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
+        except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @attendance_bp.route('/my-records', methods=['GET'])
-    @jwt_required()
+    @role_required(['student'], 'Only students can view personal attendance')
     def get_my_attendance():
         """Get attendance records for current user"""
         try:
-            current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
-            
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
-            
-            if user['role'] != 'student':
-                return jsonify({'error': 'Only students can view personal attendance'}), 403
+            user = get_current_user()
             
             # Get pagination parameters
             page = int(request.args.get('page', 1))
             per_page = int(request.args.get('per_page', 20))
             skip = (page - 1) * per_page
             
+            # Passing ?cursor= (empty for the first page) switches to keyset pagination
+            cursor_mode = 'cursor' in request.args
+            include_total = request.args.get('include_total') == 'true'
+            
             # Get attendance records
-            records, total = attendance_model.get_student_attendance(
-                student_id=current_user_id,
-                skip=skip,
-                limit=per_page
-            )
+            if cursor_mode:
+                try:
+                    records, next_cursor, total = attendance_model.get_attendance_page(
+                        filters={'student_id': user['_id'], 'company_id': user['company_id']},
+                        cursor=request.args.get('cursor'),
+                        limit=per_page,
+                        include_total=include_total
+                    )
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+            else:
+                records, total = attendance_model.get_student_attendance(
+                    student_id=user['_id'],
+                    skip=skip,
+                    limit=per_page,
+                    company_id=user['company_id']
+                )
             
             # Format records
             formatted_records = []
@@ -132,53 +608,49 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
                 }
                 formatted_records.append(formatted_record)
             
-            return jsonify({
-                'records': formatted_records,
-                'pagination': {
+            if cursor_mode:
+                pagination = {'per_page': per_page, 'next_cursor': next_cursor, 'total': total}
+            else:
+                pagination = {
                     'current_page': page,
                     'per_page': per_page,
                     'total': total,
                     'pages': (total + per_page - 1) // per_page
                 }
+            
+            return jsonify({
+                'records': formatted_records,
+                'pagination': pagination
             }), 200
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @attendance_bp.route('/records', methods=['GET'])
-    @jwt_required()
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
     def get_attendance_records():
         """Get attendance records (admin only)"""
         try:
-            current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
-            
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
-            
-            if user['role'] not in ['company_admin', 'faculty_admin']:
-                return jsonify({'error': 'Admin access required'}), 403
+            user = get_current_user()
             
             # Get query parameters
             page = int(request.args.get('page', 1))
             per_page = int(request.args.get('per_page', 50))
             skip = (page - 1) * per_page
             
+            # Passing ?cursor= (empty for the first page) switches to keyset pagination
+            cursor_mode = 'cursor' in request.args
+            include_total = request.args.get('include_total') == 'true'
+            
             # Build filters
             filters = {}
             
             # Date range filter
-            date_from = request.args.get('date_from')
-            date_to = request.args.get('date_to')
-            if date_from and date_to:
-                try:
-                    # Add time to make it inclusive
-                    date_from = datetime.fromisoformat(date_from).replace(hour=0, minute=0, second=0)
-                    date_to = datetime.fromisoformat(date_to).replace(hour=23, minute=59, second=59)
-                    filters['date_from'] = date_from.isoformat()
-                    filters['date_to'] = date_to.isoformat()
-                except:
-                    return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+            date_filters, error = parse_date_range(request.args)
+            if error:
+                return jsonify({'error': error}), 400
+            filters.update(date_filters)
             
             # Company filter (company admins can only see their company)
             company_id = request.args.get('company_id')
@@ -195,109 +667,264 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
             # Student name search (this requires joining with users collection)
             student_name = request.args.get('student_name')
             if student_name:
-                # Find students matching the name
-                student_query = {
-                    'username': {'$regex': student_name, '$options': 'i'},
-                    'role': 'student'
-                }
-                if user['role'] == 'company_admin':
-                    student_query['company_id'] = user['company_id']
-                
-                matching_students = list(db.users.find(student_query, {'_id': 1}))
-                student_ids = [str(s['_id']) for s in matching_students]
+                # Prefix match on the normalized username (index-backed)
+                student_ids = user_model.search_student_ids(
+                    student_name,
+                    company_id=filters.get('company_id'),
+                    limit=MAX_STUDENT_NAME_MATCHES
+                )
+                if len(student_ids) > MAX_STUDENT_NAME_MATCHES:
+                    return jsonify({'error': 'Too many students match this name, please refine the search'}), 400
                 
                 if not student_ids:
                     # No matching students found
-                    return jsonify({
-                        'records': [],
-                        'pagination': {
+                    if cursor_mode:
+                        pagination = {'per_page': per_page, 'next_cursor': None, 'total': 0}
+                    else:
+                        pagination = {
                             'current_page': page,
                             'per_page': per_page,
                             'total': 0,
                             'pages': 0
                         }
+                    return jsonify({
+                        'records': [],
+                        'pagination': pagination
                     }), 200
                 
                 # Add student filter
                 filters['student_ids'] = student_ids
             
             # Get attendance records
-            records, total = attendance_model.get_attendance_records(
-                filters=filters,
-                skip=skip,
-                limit=per_page
-            )
+            if cursor_mode:
+                try:
+                    records, next_cursor, total = attendance_model.get_attendance_page(
+                        filters=filters,
+                        cursor=request.args.get('cursor'),
+                        limit=per_page,
+                        include_total=include_total,
+                        secondary_ok=True
+                    )
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+            else:
+                records, total = attendance_model.get_attendance_records(
+                    filters=filters,
+                    skip=skip,
+                    limit=per_page,
+                    secondary_ok=True
+                )
             
-            # Get student and company info for each record
-            formatted_records = []
-            for record in records:
-                # Get student info
-                student = user_model.get_user_by_id(record['student_id'])
-                
-                # Get company info
-                company = None
-                if record.get('company_id'):
-                    company = db.companies.find_one({'_id': record['company_id']})
-                
-                formatted_record = {
-                    'id': str(record['_id']),
-                    'student': {
-                        'id': str(student['_id']) if student else None,
-                        'username': student['username'] if student else 'Unknown'
-                    },
-                    'company': {
-                        'id': str(company['_id']) if company else None,
-                        'name': company['name'] if company else 'Unknown'
-                    } if company else None,
-                    'timestamp': record['timestamp'].isoformat(),
-                    'status': record['status'],
-                    'location': record['location'],
-                    'date': record['timestamp'].strftime('%Y-%m-%d'),
-                    'time': record['timestamp'].strftime('%H:%M:%S')
-                }
-                formatted_records.append(formatted_record)
+            formatted_records = format_admin_records(records)
             
-            return jsonify({
-                'records': formatted_records,
-                'pagination': {
+            if cursor_mode:
+                pagination = {'per_page': per_page, 'next_cursor': next_cursor, 'total': total}
+            else:
+                pagination = {
                     'current_page': page,
                     'per_page': per_page,
                     'total': total,
                     'pages': (total + per_page - 1) // per_page
                 }
+            
+            return jsonify({
+                'records': formatted_records,
+                'pagination': pagination
             }), 200
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
-    @attendance_bp.route('/export', methods=['GET'])
-    @jwt_required()
-    def export_attendance():
-        """Export attendance records to Excel"""
+    @attendance_bp.route('/region', methods=['GET'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def get_region_records():
+        """Get attendance records inside or outside a region (admin only)
+        
+        The region is one of the company's geofences (?geofence_id=), a circle
+        (?latitude=&longitude=&radius_m=) or a GeoJSON polygon (?polygon=, the
+        coordinates array as JSON). ?match=outside returns the records outside it.
+        Inside matches use the 2dsphere index; results are cursor-paginated.
+        """
         try:
-            current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
+            user = get_current_user()
             
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
+            per_page = min(int(request.args.get('per_page', 50)), 500)
+            include_total = request.args.get('include_total') == 'true'
+            
+            match = request.args.get('match', 'inside')
+            if match not in ['inside', 'outside']:
+                return jsonify({'error': 'match must be inside or outside'}), 400
+            
+            # Company filter (company admins can only see their company)
+            filters = {}
+            company_id = request.args.get('company_id')
+            if user['role'] == 'company_admin':
+                filters['company_id'] = str(user['company_id'])
+            elif company_id:
+                filters['company_id'] = company_id
+            
+            geofence_id = request.args.get('geofence_id')
+            if geofence_id:
+                if not filters.get('company_id'):
+                    return jsonify({'error': 'company_id is required with geofence_id'}), 400
+                fence = company_model.get_geofences(filters['company_id']).get(geofence_id)
+                if fence is None:
+                    return jsonify({'error': 'Geofence not found'}), 404
+            else:
+                if request.args.get('polygon'):
+                    try:
+                        region = {'type': 'polygon', 'coordinates': json.loads(request.args['polygon'])}
+                    except ValueError:
+                        return jsonify({'error': 'polygon must be a JSON array of rings'}), 400
+                else:
+                    region = {
+                        'type': 'circle',
+                        'center': {
+                            'latitude': request.args.get('latitude'),
+                            'longitude': request.args.get('longitude')
+                        },
+                        'radius_m': request.args.get('radius_m')
+                    }
+                try:
+                    fence = compile_fence(normalize_geofence(region))
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+            
+            filters['region'] = fence.region()
+            filters['outside_region'] = match == 'outside'
+            
+            # Date range filter
+            date_filters, error = parse_date_range(request.args)
+            if error:
+                return jsonify({'error': error}), 400
+            filters.update(date_filters)
+            
+            # Status filter
+            status = request.args.get('status')
+            if status:
+                filters['status'] = status
+            
+            try:
+                records, next_cursor, total = attendance_model.get_attendance_page(
+                    filters=filters,
+                    cursor=request.args.get('cursor'),
+                    limit=per_page,
+                    include_total=include_total,
+                    secondary_ok=True
+                )
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            return jsonify({
+                'records': format_admin_records(records),
+                'region': {'match': match, 'geofence_id': fence.id if geofence_id else None},
+                'pagination': {'per_page': per_page, 'next_cursor': next_cursor, 'total': total}
+            }), 200
+            
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/live/token', methods=['POST'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def live_attendance_token():
+        """Short-lived token for /live, which browsers (EventSource) can only pass in ?jwt="""
+        try:
+            user = get_current_user()
+            user['token_version'] = get_jwt().get('token_version', 0)
+            token = create_user_token(user, scope='live', expires_delta=timedelta(seconds=LIVE_TOKEN_EXPIRES))
+            return jsonify({'token': token, 'expires_in': LIVE_TOKEN_EXPIRES}), 200
+            
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/live', methods=['GET'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required', locations=['headers', 'query_string'])
+    def live_attendance():
+        """Stream newly marked attendance as server-sent events (admin only)
+        
+        Company admins get their own company; faculty admins get every company
+        or the one in ?company_id=. A reconnecting client sends Last-Event-ID and
+        first receives the records it missed.
+        
+        Browsers connect with new EventSource('/api/attendance/live?jwt=<token>'), the
+        token from POST /live/token. It is checked on connect only; once it has expired a
+        reconnect gets 401, and the client fetches a new token and reopens the stream
+        with ?last_event_id= set to the last event it received.
+        """
+        try:
+            user = get_current_user()
+            
+            # URLs end up in access logs, so only short-lived live tokens are taken from them
+            if get_jwt_request_location() == 'query_string' and get_jwt().get('scope') != 'live':
+                return jsonify({'error': 'Pass a token from /api/attendance/live/token in ?jwt='}), 401
+            
+            company_id = request.args.get('company_id')
+            if user['role'] == 'company_admin':
+                company_id = user['company_id']
+            elif company_id:
+                if not ObjectId.is_valid(company_id):
+                    return jsonify({'error': 'Invalid company_id'}), 400
+                company_id = ObjectId(company_id)
+            
+            last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+            if last_event_id and not ObjectId.is_valid(last_event_id):
+                return jsonify({'error': 'Invalid Last-Event-ID'}), 400
+            
+            subscription = live_feed.subscribe(company_id or None)
+            if subscription is None:
+                return jsonify({'error': 'Too many live connections, please retry'}), 503, {'Retry-After': '30'}
+            
+            # Read the backlog after subscribing so no record falls in between
+            missed = attendance_model.get_records_after(
+                last_event_id, company_id, limit=LIVE_FEED_REPLAY_LIMIT
+            ) if last_event_id else []
+            
+            def stream():
+                yield f"retry: {LIVE_FEED_RETRY_MS}\n\n"
+                replayed = set()
+                for record in missed:
+                    event = live_feed.format_event(record)
+                    replayed.add(event['id'])
+                    yield format_sse(event)
+                
+                deadline = time.monotonic() + LIVE_FEED_MAX_SECONDS
+                while time.monotonic() < deadline:
+                    event = subscription.get(timeout=LIVE_FEED_KEEPALIVE)
+                    if event is None:
+                        yield ': keepalive\n\n'
+                    elif event['id'] not in replayed:
+                        yield format_sse(event)
+            
+            response = Response(stream(), mimetype='text/event-stream', headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            })
+            # Runs even when the client goes away before the stream starts
+            response.call_on_close(lambda: live_feed.unsubscribe(subscription))
+            return response
             
-            if user['role'] not in ['company_admin', 'faculty_admin']:
-                return jsonify({'error': 'Admin access required'}), 403
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/export', methods=['GET'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def export_attendance():
+        """Export attendance records to Excel or CSV"""
+        try:
+            user = get_current_user()
             
             # Build filters (same as get_attendance_records)
             filters = {}
             
             # Date range filter
-            date_from = request.args.get('date_from')
-            date_to = request.args.get('date_to')
-            if date_from and date_to:
-                try:
-                    date_from = datetime.fromisoformat(date_from).replace(hour=0, minute=0, second=0)
-                    date_to = datetime.fromisoformat(date_to).replace(hour=23, minute=59, second=59)
-                    filters['date_from'] = date_from.isoformat()
-                    filters['date_to'] = date_to.isoformat()
-                except:
-                    return jsonify({'error': 'Invalid date format. Use YYYY-MM-DD'}), 400
+            date_filters, error = parse_date_range(request.args)
+            if error:
+                return jsonify({'error': error}), 400
+            filters.update(date_filters)
             
             # Company filter
             company_id = request.args.get('company_id')
@@ -311,51 +938,43 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
             if status:
                 filters['status'] = status
             
-            # Get all records (no pagination for export)
-            records, _ = attendance_model.get_attendance_records(
+            export_format = request.args.get('format', 'xlsx')
+            if export_format not in ['xlsx', 'csv']:
+                return jsonify({'error': 'Invalid export format. Use xlsx or csv'}), 400
+            
+            # Walk all matching records with a cursor (no pagination or row cap for export)
+            records = attendance_model.iter_attendance_records(
                 filters=filters,
-                skip=0,
-                limit=10000  # Large limit for export
+                batch_size=EXPORT_BATCH_SIZE,
+                secondary_ok=True
             )
+            rows = iter_export_rows(records)
             
-            # Prepare data for Excel
-            excel_data = []
-            for record in records:
-                # Get student info
-                student = user_model.get_user_by_id(record['student_id'])
-                
-                # Get company info
-                company = None
-                if record.get('company_id'):
-                    company = db.companies.find_one({'_id': record['company_id']})
-                
-                excel_data.append({
-                    'Student Name': student['username'] if student else 'Unknown',
-                    'Company': company['name'] if company else 'Unknown',
-                    'Date': record['timestamp'].strftime('%Y-%m-%d'),
-                    'Time': record['timestamp'].strftime('%H:%M:%S'),
-                    'Status': record['status'],
-                    'Latitude': record['location'].get('latitude', ''),
-                    'Longitude': record['location'].get('longitude', '')
-                })
+            # Generate filename
+            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
+            filename = f'attendance_report_{timestamp}.{export_format}'
             
-            # Create DataFrame and export to Excel
-            import pandas as pd
-            import io
+            if export_format == 'csv':
+                return Response(
+                    stream_with_context(iter_csv_chunks(rows)),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'}
+                )
             
-            df = pd.DataFrame(excel_data)
+            # Imported here so only processes that build workbooks pay for openpyxl
+            from openpyxl import Workbook
             
-            # Create Excel file in memory
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                df.to_excel(writer, sheet_name='Attendance Records', index=False)
+            # Write-only workbooks keep rows on disk, so memory stays flat while building
+            workbook = Workbook(write_only=True)
+            worksheet = workbook.create_sheet('Attendance Records')
+            worksheet.append(EXPORT_COLUMNS)
+            for row in rows:
+                worksheet.append(row)
             
+            output = tempfile.TemporaryFile()
+            workbook.save(output)
             output.seek(0)
             
-            # Generate filename
-            timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-            filename = f'attendance_report_{timestamp}.xlsx'
-            
             return send_file(
                 output,
                 mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
@@ -364,24 +983,159 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
             )
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
-    @attendance_bp.route('/image/<attendance_id>', methods=['GET'])
-    @jwt_required()
-    def get_attendance_image():
-        """Get attendance image (admin only)"""
+    @attendance_bp.route('/export/delta', methods=['GET'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def export_attendance_delta():
+        """Export records added or changed since a watermark, as NDJSON or CSV (admin only)
+        
+        Omit ?since= for the first sync. The X-Watermark response header is the
+        since value for the next call; X-Has-More is true when ?limit= cut the
+        export short and the next call should follow immediately.
+        """
         try:
-            current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
+            user = get_current_user()
             
-            if not user:
-                return jsonify({'error': 'User not found'}), 404
+            filters = {}
+            company_id = request.args.get('company_id')
+            if user['role'] == 'company_admin':
+                filters['company_id'] = str(user['company_id'])
+            elif company_id:
+                filters['company_id'] = company_id
+            
+            export_format = request.args.get('format', 'ndjson')
+            if export_format not in ['ndjson', 'csv']:
+                return jsonify({'error': 'Invalid export format. Use ndjson or csv'}), 400
+            
+            try:
+                limit = int(request.args.get('limit', 10000))
+            except ValueError:
+                return jsonify({'error': 'limit must be a number'}), 400
+            if not 1 <= limit <= DELTA_EXPORT_MAX_LIMIT:
+                return jsonify({'error': f'limit must be between 1 and {DELTA_EXPORT_MAX_LIMIT}'}), 400
+            
+            since = request.args.get('since')
+            try:
+                since_position = attendance_model.decode_watermark(since) if since else None
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            if user['role'] not in ['company_admin', 'faculty_admin']:
-                return jsonify({'error': 'Admin access required'}), 403
+            # Fix the end of this export first, so the watermark can go in the headers
+            end, has_more = attendance_model.get_delta_end(
+                filters=filters,
+                since=since_position,
+                limit=limit,
+                settle_seconds=DELTA_EXPORT_SETTLE_SECONDS
+            )
+            
+            if end:
+                records = attendance_model.iter_delta_records(
+                    filters=filters,
+                    since=since_position,
+                    until=(end['updated_at'], end['_id']),
+                    batch_size=EXPORT_BATCH_SIZE
+                )
+                rows = iter_export_rows(records, make_row=delta_export_row)
+                watermark = attendance_model.encode_watermark(end)
+            else:
+                rows = iter([])
+                watermark = since or ''
+            
+            headers = {'X-Watermark': watermark, 'X-Has-More': 'true' if has_more else 'false'}
+            if export_format == 'csv':
+                chunks = iter_csv_chunks(
+                    (list(row.values()) for row in rows),
+                    columns=DELTA_EXPORT_COLUMNS
+                )
+                return Response(stream_with_context(chunks), mimetype='text/csv', headers=headers)
+            
+            return Response(stream_with_context(iter_ndjson_chunks(rows)), mimetype='application/x-ndjson', headers=headers)
+            
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/summary', methods=['GET'])
+    @role_required(['student', 'company_admin', 'faculty_admin'])
+    def get_attendance_summary():
+        """Attendance counts from the pre-aggregated stats
+        
+        Students get their own monthly counts. Admins get daily counts for a company
+        (faculty admins: all companies when none is given) or, with ?student_id=,
+        one student's monthly counts.
+        """
+        try:
+            user = get_current_user()
+            
+            student_id = request.args.get('student_id')
+            if user['role'] == 'student':
+                student_id = str(user['_id'])
+            
+            if student_id:
+                if not ObjectId.is_valid(student_id):
+                    return jsonify({'error': 'Invalid student_id'}), 400
+                if user['role'] == 'company_admin':
+                    student = user_model.get_user_summary(student_id)
+                    if not student or student.get('company_id') != user['company_id']:
+                        return jsonify({'error': 'Access denied'}), 403
+                
+                periods = attendance_model.stats.get_student_monthly(
+                    student_id,
+                    month_from=request.args.get('month_from'),
+                    month_to=request.args.get('month_to')
+                )
+                scope = 'student_month'
+            else:
+                company_id = request.args.get('company_id')
+                if user['role'] == 'company_admin':
+                    company_id = str(user['company_id'])
+                elif company_id and not ObjectId.is_valid(company_id):
+                    return jsonify({'error': 'Invalid company_id'}), 400
+                
+                periods = attendance_model.stats.get_company_daily(
+                    company_id,
+                    date_from=request.args.get('date_from'),
+                    date_to=request.args.get('date_to')
+                )
+                scope = 'company_day'
+            
+            totals = {'counts': {}, 'total': 0}
+            for period in periods:
+                for status, n in period['counts'].items():
+                    totals['counts'][status] = totals['counts'].get(status, 0) + n
+                totals['total'] += period['total']
+            
+            return jsonify({
+                'scope': scope,
+                'periods': periods,
+                'totals': totals
+            }), 200
+            
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @attendance_bp.route('/image/<attendance_id>', methods=['GET'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def get_attendance_image(attendance_id):
+        """Get attendance image (admin only)
+        
+        ?size=thumbnail returns a small WebP (or JPEG) rendition. Stored images are
+        content-addressed, so the key is a strong ETag and responses are immutable.
+        """
+        try:
+            user = get_current_user()
             
-            # Get attendance record
-            attendance_record = attendance_model.collection.find_one({'_id': ObjectId(attendance_id)})
+            # Get attendance record (archived ones are found by the month in their URL)
+            attendance_record = attendance_model.get_attendance_by_id(attendance_id)
+            if not attendance_record and request.args.get('archived'):
+                attendance_record = attendance_model.get_archived_attendance(
+                    attendance_id,
+                    request.args['archived'],
+                    company_id=user['company_id'] if user['role'] == 'company_admin' else None
+                )
             
             if not attendance_record:
                 return jsonify({'error': 'Attendance record not found'}), 404
@@ -390,13 +1144,50 @@ def create_attendance_routes(app, db, user_model, attendance_model, face_model):
             if user['role'] == 'company_admin' and attendance_record.get('company_id') != user['company_id']:
                 return jsonify({'error': 'Access denied'}), 403
             
-            image_path = attendance_record.get('image_path')
-            if not image_path or not os.path.exists(image_path):
-                return jsonify({'error': 'Image not found'}), 404
+            image = attendance_record.get('image')
+            if not image:
+                # Records from before the image store keep a local file path
+                image_path = attendance_record.get('image_path')
+                if not image_path or not os.path.exists(image_path):
+                    return jsonify({'error': 'Image not found'}), 404
+                return send_file(image_path, conditional=True)
+            
+            if image.get('pending'):
+                return jsonify({'error': 'Image is still being processed'}), 503, {'Retry-After': '1'}
+            
+            key, mimetype = image['key'], image['content_type']
+            if request.args.get('size') == 'thumbnail':
+                preferred = request.accept_mimetypes.best_match(['image/jpeg', 'image/webp'])
+                thumbnail_format = 'webp' if preferred == 'image/webp' else 'jpeg'
+                if image['thumbnails'].get(thumbnail_format):
+                    key = image['thumbnails'][thumbnail_format]
+                    mimetype = THUMBNAIL_FORMATS[thumbnail_format][1]
+            
+            # Repeat views are answered without touching the image store
+            if request.if_none_match.contains(key):
+                response = app.response_class(status=304)
+            else:
+                data = image_store.get(key)
+                if data is None:
+                    return jsonify({'error': 'Image not found'}), 404
+                response = send_file(
+                    io.BytesIO(data),
+                    mimetype=mimetype,
+                    etag=key,
+                    conditional=True,
+                    max_age=IMAGE_CACHE_MAX_AGE
+                )
             
-            return send_file(image_path)
+            response.set_etag(key)
+            response.cache_control.public = False
+            response.cache_control.private = True
+            response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+            response.cache_control.immutable = True
+            response.vary.add('Accept')
+            return response
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     return attendance_bp
\ No newline at end of file
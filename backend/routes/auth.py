@@ -1,11 +1,16 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from authorization import create_user_token, get_current_user, role_required
 from bson import ObjectId
+from face_worker import FaceWorkerUnavailable
+from geofence import GEOFENCE_MODES, MAX_GEOFENCES, normalize_geofence
+from metrics import record_exception
 import base64
 import os
 from werkzeug.utils import secure_filename
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-def create_auth_routes(app, db, user_model, company_model, face_model):
+def create_auth_routes(app, db, user_model, company_model, face_model, face_pool, face_index):
     auth_bp = Blueprint('auth', __name__, url_prefix='/api/auth')
     
     @auth_bp.route('/login', methods=['POST'])
@@ -24,8 +29,8 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
             if not user:
                 return jsonify({'error': 'Invalid credentials'}), 401
             
-            # Create access token
-            access_token = create_access_token(identity=str(user['_id']))
+            # Create access token with role/company claims so routes need no user lookup
+            access_token = create_user_token(user)
             
             # Get company info if user has one
             company = None
@@ -40,11 +45,12 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
                     'username': user['username'],
                     'role': user['role'],
                     'company': company,
-                    'has_face_encoding': user.get('face_encoding') is not None
+                    'has_face_encoding': user['has_face_encoding']
                 }
             }), 200
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @auth_bp.route('/register', methods=['POST'])
@@ -71,7 +77,7 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
             # Process face image if provided
             face_encoding = None
             if face_image:
-                face_encoding, error = face_model.extract_face_encoding(face_image)
+                face_encoding, error = face_pool.extract_face_encoding(face_image)
                 if error:
                     return jsonify({'error': f'Face processing error: {error}'}), 400
             
@@ -87,12 +93,18 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
             if error:
                 return jsonify({'error': error}), 400
             
+            if face_encoding is not None:
+                face_index.upsert(user_id, company_id, face_encoding)
+            
             return jsonify({
                 'message': 'User registered successfully',
                 'user_id': user_id
             }), 201
             
+        except FaceWorkerUnavailable as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @auth_bp.route('/profile', methods=['GET'])
@@ -101,7 +113,7 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
         """Get current user profile"""
         try:
             current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
+            user = user_model.get_user_summary(current_user_id)
             
             if not user:
                 return jsonify({'error': 'User not found'}), 404
@@ -119,12 +131,13 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
                     'username': user['username'],
                     'role': user['role'],
                     'company': company,
-                    'has_face_encoding': user.get('face_encoding') is not None,
+                    'has_face_encoding': user['has_face_encoding'],
                     'created_at': user['created_at'].isoformat()
                 }
             }), 200
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @auth_bp.route('/update-face', methods=['POST'])
@@ -140,7 +153,7 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
                 return jsonify({'error': 'Face image is required'}), 400
             
             # Process face image
-            face_encoding, error = face_model.extract_face_encoding(face_image)
+            face_encoding, error = face_pool.extract_face_encoding(face_image)
             if error:
                 return jsonify({'error': f'Face processing error: {error}'}), 400
             
@@ -148,11 +161,15 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
             result = user_model.update_face_encoding(current_user_id, face_encoding)
             
             if result.modified_count > 0:
+                face_index.upsert(current_user_id, get_current_user()['company_id'], face_encoding)
                 return jsonify({'message': 'Face encoding updated successfully'}), 200
             else:
                 return jsonify({'error': 'Failed to update face encoding'}), 500
                 
+        except FaceWorkerUnavailable as e:
+            return jsonify({'error': str(e)}), 503, {'Retry-After': str(e.retry_after)}
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @auth_bp.route('/companies', methods=['GET'])
@@ -169,27 +186,29 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
             return jsonify({'companies': companies}), 200
             
         except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     @auth_bp.route('/create-company', methods=['POST'])
-    @jwt_required()
+    @role_required(['faculty_admin'], 'Only faculty admins can create companies')
     def create_company():
         """Create a new company (faculty admin only)"""
         try:
-            current_user_id = get_jwt_identity()
-            user = user_model.get_user_by_id(current_user_id)
-            
-            if not user or user['role'] != 'faculty_admin':
-                return jsonify({'error': 'Only faculty admins can create companies'}), 403
-            
             data = request.get_json()
             name = data.get('name')
             description = data.get('description', '')
+            timezone = data.get('timezone')
             
             if not name:
                 return jsonify({'error': 'Company name is required'}), 400
             
-            company_id = company_model.create_company(name, description)
+            if timezone:
+                try:
+                    ZoneInfo(timezone)
+                except (ValueError, ZoneInfoNotFoundError):
+                    return jsonify({'error': 'Invalid timezone. Use an IANA name such as Asia/Kolkata'}), 400
+            
+            company_id = company_model.create_company(name, description, timezone)
             
             return jsonify({
                 'message': 'Company created successfully',
@@ -197,6 +216,90 @@ def create_auth_routes(app, db, user_model, company_model, face_model):
             }), 201
             
         except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @auth_bp.route('/companies/<company_id>/geofences', methods=['PUT'])
+    @role_required(['company_admin', 'faculty_admin'], 'Admin access required')
+    def set_company_geofences(company_id):
+        """Replace a company's geofences (company admins: their own company only)
+        
+        Body: {"geofences": [...], "mode": "enforce" | "flag"}. In enforce mode marks
+        outside every fence are rejected; in flag mode they are stored and flagged.
+        An empty list turns location checks off.
+        """
+        try:
+            user = get_current_user()
+            
+            if not ObjectId.is_valid(company_id) or not company_model.get_company_by_id(company_id):
+                return jsonify({'error': 'Company not found'}), 404
+            
+            if user['role'] == 'company_admin' and ObjectId(company_id) != user['company_id']:
+                return jsonify({'error': 'Access denied'}), 403
+            
+            data = request.get_json()
+            fences = data.get('geofences')
+            mode = data.get('mode', 'enforce')
+            
+            if not isinstance(fences, list):
+                return jsonify({'error': 'geofences must be a list'}), 400
+            
+            if len(fences) > MAX_GEOFENCES:
+                return jsonify({'error': f'A company can have at most {MAX_GEOFENCES} geofences'}), 400
+            
+            if mode not in GEOFENCE_MODES:
+                return jsonify({'error': 'mode must be enforce or flag'}), 400
+            
+            try:
+                geofences = [normalize_geofence(fence) for fence in fences]
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            company_model.set_geofences(company_id, geofences, mode)
+            
+            return jsonify({
+                'message': 'Geofences updated successfully',
+                'geofences': geofences,
+                'mode': mode
+            }), 200
+            
+        except Exception as e:
+            record_exception(e)
+            return jsonify({'error': str(e)}), 500
+    
+    @auth_bp.route('/users/<user_id>/status', methods=['POST'])
+    @role_required(['faculty_admin'], 'Only faculty admins can change user status')
+    def set_user_status(user_id):
+        """Activate or deactivate a user (faculty admin only)
+        
+        Changing the status bumps the user's token version, which revokes
+        any tokens already issued to them.
+        """
+        try:
+            data = request.get_json()
+            is_active = data.get('is_active')
+            
+            if not isinstance(is_active, bool):
+                return jsonify({'error': 'is_active must be true or false'}), 400
+            
+            if not ObjectId.is_valid(user_id):
+                return jsonify({'error': 'User not found'}), 404
+            
+            result = user_model.set_user_active(user_id, is_active)
+            if result.matched_count == 0:
+                return jsonify({'error': 'User not found'}), 404
+            
+            if is_active:
+                user = user_model.get_user_by_id(user_id, with_face_encoding=True)
+                if user.get('face_encoding') is not None:
+                    face_index.upsert(user_id, user.get('company_id'), user['face_encoding'])
+            else:
+                face_index.remove(user_id)
+            
+            return jsonify({'message': 'User status updated successfully', 'is_active': is_active}), 200
+            
+        except Exception as e:
+            record_exception(e)
             return jsonify({'error': str(e)}), 500
     
     return auth_bp
\ No newline at end of file
@@ -2,24 +2,43 @@
 """
 Database setup script for the Attendance App
 This script creates initial companies and admin users for testing
+
+With --generate it instead loads a synthetic dataset for performance testing:
+N companies, M students with synthetic face encodings and K days of attendance,
+generated in parallel processes and written with large unordered insert_many
+batches. Point MONGODB_DB at a throwaway database, e.g.
+    
+    MONGODB_DB=attendance_load python setup_db.py --generate \\
+        --companies 50 --students 50000 --days 220 --workers 8
+
+loads about 10M attendance records.
 """
 
-import os
-from pymongo import MongoClient
+import argparse
+import multiprocessing
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
 from werkzeug.security import generate_password_hash
-from datetime import datetime
 from dotenv import load_dotenv
+import numpy as np
+
+from database import create_indexes, create_mongo_client, get_database
+from models import AttendanceModel, AttendanceStatsModel, face_encoding_fields
 
 # Load environment variables
 load_dotenv()
 
+STUDENTS_PER_TASK = 500
+GENERATED_PASSWORD = 'student123'
+
 def setup_database():
     """Setup initial database with sample data"""
     
     # Connect to MongoDB
-    MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/attendance_app')
-    client = MongoClient(MONGODB_URI)
-    db = client.attendance_app
+    client = create_mongo_client()
+    db = get_database(client)
     
     print("Setting up database...")
     
@@ -28,33 +47,40 @@ def setup_database():
         {
             'name': 'Tech Corp',
             'description': 'Technology company',
+            'timezone': 'UTC',
             'created_at': datetime.utcnow(),
             'is_active': True
         },
         {
             'name': 'Business Solutions Ltd',
             'description': 'Business consulting company',
+            'timezone': 'UTC',
             'created_at': datetime.utcnow(),
             'is_active': True
         },
         {
             'name': 'Innovation Hub',
             'description': 'Startup incubator',
+            'timezone': 'UTC',
             'created_at': datetime.utcnow(),
             'is_active': True
         }
     ]
     
-    # Insert companies if they don't exist
-    companies = []
-    for company_data in companies_data:
-        existing_company = db.companies.find_one({'name': company_data['name']})
-        if not existing_company:
-            result = db.companies.insert_one(company_data)
-            companies.append(result.inserted_id)
+    # Insert companies if they don't exist (one round trip)
+    result = db.companies.bulk_write([
+        UpdateOne({'name': company_data['name']}, {'$setOnInsert': company_data}, upsert=True)
+        for company_data in companies_data
+    ], ordered=False)
+    company_ids = {
+        company['name']: company['_id']
+        for company in db.companies.find({'name': {'$in': [c['name'] for c in companies_data]}}, {'name': 1})
+    }
+    companies = [company_ids[company_data['name']] for company_data in companies_data]
+    for index, company_data in enumerate(companies_data):
+        if index in result.upserted_ids:
             print(f"Created company: {company_data['name']}")
         else:
-            companies.append(existing_company['_id'])
             print(f"Company already exists: {company_data['name']}")
     
     # Create initial users
@@ -65,6 +91,7 @@ def setup_database():
             'role': 'faculty_admin',
             'company_id': None,
             'face_encoding': None,
+            'has_face_encoding': False,
             'created_at': datetime.utcnow(),
             'is_active': True
         },
@@ -74,6 +101,7 @@ def setup_database():
             'role': 'company_admin',
             'company_id': companies[0],  # Tech Corp
             'face_encoding': None,
+            'has_face_encoding': False,
             'created_at': datetime.utcnow(),
             'is_active': True
         },
@@ -83,6 +111,7 @@ def setup_database():
             'role': 'company_admin',
             'company_id': companies[1],  # Business Solutions Ltd
             'face_encoding': None,
+            'has_face_encoding': False,
             'created_at': datetime.utcnow(),
             'is_active': True
         },
@@ -92,6 +121,7 @@ def setup_database():
             'role': 'student',
             'company_id': companies[0],  # Tech Corp
             'face_encoding': None,
+            'has_face_encoding': False,
             'created_at': datetime.utcnow(),
             'is_active': True
         },
@@ -101,39 +131,26 @@ def setup_database():
             'role': 'student',
             'company_id': companies[1],  # Business Solutions Ltd
             'face_encoding': None,
+            'has_face_encoding': False,
             'created_at': datetime.utcnow(),
             'is_active': True
         }
     ]
     
-    # Insert users if they don't exist
+    # Insert users if they don't exist (one round trip)
     for user_data in users_data:
-        existing_user = db.users.find_one({'username': user_data['username']})
-        if not existing_user:
-            db.users.insert_one(user_data)
+        user_data['username_lower'] = user_data['username'].lower()
+    result = db.users.bulk_write([
+        UpdateOne({'username': user_data['username']}, {'$setOnInsert': user_data}, upsert=True)
+        for user_data in users_data
+    ], ordered=False)
+    for index, user_data in enumerate(users_data):
+        if index in result.upserted_ids:
             print(f"Created user: {user_data['username']} ({user_data['role']})")
         else:
             print(f"User already exists: {user_data['username']}")
     
-    # Create indexes
-    try:
-        # User indexes
-        db.users.create_index('username', unique=True)
-        db.users.create_index('role')
-        db.users.create_index('company_id')
-        
-        # Attendance indexes
-        db.attendance_records.create_index([('student_id', 1), ('timestamp', -1)])
-        db.attendance_records.create_index('company_id')
-        db.attendance_records.create_index('timestamp')
-        db.attendance_records.create_index('status')
-        
-        # Company indexes
-        db.companies.create_index('name')
-        
-        print("Database indexes created successfully")
-    except Exception as e:
-        print(f"Note: Some indexes may already exist - {e}")
+    create_indexes(db)
     
     print("\nDatabase setup completed!")
     print("\nDefault login credentials:")
@@ -144,5 +161,162 @@ def setup_database():
     print("Student (Business): jane_student / student123")
     print("\nNote: Students need to register their faces before marking attendance.")
 
+# Per-process database handle for generator workers
+generator_db = None
+
+def init_generator_worker():
+    """Give each generator process its own client (clients must not cross a fork)"""
+    global generator_db
+    generator_db = get_database(create_mongo_client())
+
+def generate_students(task):
+    """Insert one slice of synthetic students and their attendance, returning (students, records)"""
+    prefix, start, end, companies, days, attendance_rate, batch_size, password_hash, seed = task
+    db = generator_db
+    attendance_model = AttendanceModel(db)
+    rng = np.random.default_rng(seed + start)
+    now = datetime.utcnow()
+    
+    students = []
+    for index in range(start, end):
+        company_id, _ = companies[index % len(companies)]
+        username = f'{prefix}_{index:07d}'
+        students.append({
+            '_id': ObjectId(),
+            'username': username,
+            'username_lower': username,
+            'password_hash': password_hash,
+            'role': 'student',
+            'company_id': company_id,
+            **face_encoding_fields(rng.normal(0, 0.1, 128)),
+            'created_at': now,
+            'is_active': True,
+            'token_version': 0
+        })
+    db.users.insert_many(students, ordered=False)
+    
+    inserted = 0
+    batch = []
+    for index, student in zip(range(start, end), students):
+        _, (latitude, longitude) = companies[index % len(companies)]
+        present = rng.random(len(days)) < attendance_rate
+        # Arrivals spread over 08:00-10:00, positions within ~100 m of the site
+        arrivals = rng.integers(8 * 3600, 10 * 3600, len(days))
+        jitter = rng.normal(0, 0.0005, (len(days), 2)).tolist()
+        
+        for day, is_present, arrival, (d_lat, d_lon) in zip(days, present, arrivals, jitter):
+            if not is_present:
+                continue
+            timestamp = day + timedelta(seconds=int(arrival))
+            record = attendance_model.build_record(
+                student['_id'],
+                student['company_id'],
+                {'latitude': latitude + d_lat, 'longitude': longitude + d_lon},
+                None,
+                'Present',
+                timestamp=timestamp
+            )
+            record['created_at'] = timestamp
+            batch.append(record)
+            
+            if len(batch) >= batch_size:
+                db.attendance_records.insert_many(batch, ordered=False)
+                inserted += len(batch)
+                batch = []
+    
+    if batch:
+        db.attendance_records.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    
+    return len(students), inserted
+
+def generate_companies(db, prefix, num_companies, rng):
+    """Insert synthetic companies, returning [(company_id, (latitude, longitude) of its site)]"""
+    companies_data = [
+        {
+            'name': f'{prefix} company {index:04d}',
+            'description': 'Synthetic company for load testing',
+            'timezone': 'UTC',
+            'created_at': datetime.utcnow(),
+            'is_active': True
+        }
+        for index in range(num_companies)
+    ]
+    company_ids = db.companies.insert_many(companies_data).inserted_ids
+    sites = rng.uniform([-60, -180], [60, 180], (num_companies, 2)).round(6).tolist()
+    return list(zip(company_ids, [tuple(site) for site in sites]))
+
+def generation_days(num_days):
+    """UTC midnights of the num_days days before today, oldest first"""
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return [today - timedelta(days=offset) for offset in range(num_days, 0, -1)]
+
+def generate_dataset(num_companies, num_students, num_days, workers=None, batch_size=10000,
+                     attendance_rate=0.9, seed=0, rebuild_stats=True):
+    """Load a synthetic dataset for performance testing"""
+    client = create_mongo_client()
+    db = get_database(client)
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    
+    # Tagged per run so repeated loads into one database do not collide
+    prefix = f'load_{str(ObjectId())[-6:]}'
+    companies = generate_companies(db, prefix, num_companies, rng)
+    print(f"Created {num_companies} companies")
+    
+    # Hashing is deliberately slow, so every generated student shares one hash
+    password_hash = generate_password_hash(GENERATED_PASSWORD)
+    days = generation_days(num_days)
+    
+    tasks = [
+        (prefix, start, min(start + STUDENTS_PER_TASK, num_students), companies, days,
+         attendance_rate, batch_size, password_hash, seed)
+        for start in range(0, num_students, STUDENTS_PER_TASK)
+    ]
+    
+    students = records = 0
+    with multiprocessing.Pool(workers, initializer=init_generator_worker) as pool:
+        for task_students, task_records in pool.imap_unordered(generate_students, tasks):
+            students += task_students
+            records += task_records
+            elapsed = time.perf_counter() - started
+            print(f"{students}/{num_students} students, {records} records ({records / elapsed:,.0f} records/s)")
+    
+    # Indexes are cheaper to build once after the load than to maintain during it
+    create_indexes(db)
+    if rebuild_stats:
+        AttendanceStatsModel(db).rebuild()
+        print("Attendance stats rebuilt")
+    
+    print(f"\nGenerated {students} students and {records} attendance records in {time.perf_counter() - started:.0f}s")
+    print(f"Generated students log in as {prefix}_<n> / {GENERATED_PASSWORD}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Set up the database with demo data or a synthetic load-test dataset')
+    parser.add_argument('--generate', action='store_true', help='Load a synthetic dataset instead of the demo data')
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--students', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--attendance-rate', type=float, default=0.9, help='Chance a student attends on a given day')
+    parser.add_argument('--workers', type=int, default=None, help='Generator processes (default: CPU count)')
+    parser.add_argument('--batch-size', type=int, default=10000, help='Records per insert_many')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip-stats', action='store_true', help='Do not rebuild attendance stats after loading')
+    args = parser.parse_args()
+    
+    if args.generate:
+        generate_dataset(
+            args.companies,
+            args.students,
+            args.days,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            attendance_rate=args.attendance_rate,
+            seed=args.seed,
+            rebuild_stats=not args.skip_stats
+        )
+    else:
+        setup_database()
+
 if __name__ == '__main__':
-    setup_database()
\ No newline at end of file
+    main()
\ No newline at end of file